@@ -1,38 +1,58 @@
 import sys
 from argparse import ArgumentParser
 from NESEmulator.rom import ROM
-from NESEmulator.ppu import PPU, NES_WIDTH, NES_HEIGHT
-from NESEmulator.cpu import CPU
+from NESEmulator.ppu import NES_WIDTH, NES_HEIGHT
+from NESEmulator import core_nb
+# Prefer the ahead of time build from tools/build_core.py, which skips the
+# JIT warmup, and fall back to compiling the core at startup
+try:
+    from NESEmulator.nes_core import run_frame
+except ImportError:
+    from NESEmulator.core_nb import run_frame
 import pygame
-from timeit import default_timer as timer
+from time import perf_counter_ns
 import os
 
+# Keyboard keys for each joypad button
+KEYMAP = {pygame.K_LEFT: core_nb.BUTTON_LEFT,
+          pygame.K_RIGHT: core_nb.BUTTON_RIGHT,
+          pygame.K_UP: core_nb.BUTTON_UP,
+          pygame.K_DOWN: core_nb.BUTTON_DOWN,
+          pygame.K_x: core_nb.BUTTON_A,
+          pygame.K_z: core_nb.BUTTON_B,
+          pygame.K_s: core_nb.BUTTON_START,
+          pygame.K_a: core_nb.BUTTON_SELECT}
+
 
 def run(rom: ROM, name: str):
     pygame.init()
     screen = pygame.display.set_mode((NES_WIDTH, NES_HEIGHT), 0, 24)
     pygame.display.set_caption(f"NES Emulator - {os.path.basename(name)}")
-    ppu = PPU(rom)
-    cpu = CPU(ppu, rom)
-    ticks = 0
+    # Only queue the events we handle, SDL drops the rest
+    pygame.event.set_blocked(None)
+    pygame.event.set_allowed([pygame.QUIT, pygame.KEYDOWN, pygame.KEYUP])
+    # The CPU and PPU run inside the compiled core, see core_nb.py
+    state, mem, vram = core_nb.power_on(rom)
+    # Frame times are summed and the frame rate printed once per second
+    frames = 0
+    acc_ns = 0
     start = None
     while True:
-        cpu.step()
-        new_ticks = cpu.cpu_ticks - ticks
-        # 3 PPU cycles for every CPU tick
-        for _ in range(new_ticks * 3):
-            ppu.step()
-            # Draw, once per frame, everything onto the screen
-            if (ppu.scanline == 240) and (ppu.cycle == 257):
-                pygame.surfarray.blit_array(screen, ppu.display_buffer)
-                pygame.display.flip()
-                end = timer()
-                if start is not None:
-                    print(end - start)
-                start = timer()
-            if (ppu.scanline == 241) and (ppu.cycle == 2) and ppu.generate_nmi:
-                cpu.trigger_NMI()
-        ticks += new_ticks
+        # Run until the PPU has drawn a frame straight into the screen's
+        # pixels, which have to be unlocked again before the flip
+        display_buffer = pygame.surfarray.pixels3d(screen)
+        run_frame(state, mem, vram, display_buffer)
+        del display_buffer
+        pygame.display.flip()
+        end = perf_counter_ns()
+        if start is not None:
+            acc_ns += end - start
+            frames += 1
+            if acc_ns > 1_000_000_000:
+                print(frames / (acc_ns / 1e9))
+                frames = 0
+                acc_ns = 0
+        start = end
 
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
@@ -40,24 +60,10 @@ def run(rom: ROM, name: str):
             # Handle keyboard events as joypad changes
             if event.type not in {pygame.KEYDOWN, pygame.KEYUP}:
                 continue
-            is_keydown = event.type == pygame.KEYDOWN
-            match event.key:
-                case pygame.K_LEFT:
-                    cpu.joypad1.left = is_keydown
-                case pygame.K_RIGHT:
-                    cpu.joypad1.right = is_keydown
-                case pygame.K_UP:
-                    cpu.joypad1.up = is_keydown
-                case pygame.K_DOWN:
-                    cpu.joypad1.down = is_keydown
-                case pygame.K_x:
-                    cpu.joypad1.a = is_keydown
-                case pygame.K_z:
-                    cpu.joypad1.b = is_keydown
-                case pygame.K_s:
-                    cpu.joypad1.start = is_keydown
-                case pygame.K_a:
-                    cpu.joypad1.select = is_keydown
+            button = KEYMAP.get(event.key)
+            if button is not None:
+                core_nb.set_button(state, button,
+                                   event.type == pygame.KEYDOWN)
 
 
 if __name__ == "__main__":
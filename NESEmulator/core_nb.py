@@ -0,0 +1,910 @@
+import numpy as np
+from numba import njit
+from NESEmulator.cpu import (ADC, AHX, ALR, ANC, AND, ARR, ASL, AXS, BCC, BCS,
+                             BEQ, BIT, BMI, BNE, BPL, BRK, BVC, BVS, CLC, CLD,
+                             CLI, CLV, CMP, CPX, CPY, DCP, DEC, DEX, DEY, EOR,
+                             INC, INX, INY, ISC, JMP, JSR, KIL, LAS, LAX, LDA,
+                             LDX, LDY, LSR, NOP, ORA, PHA, PHP, PLA, PLP, RLA,
+                             ROL, ROR, RRA, RTI, RTS, SAX, SBC, SEC, SED, SEI,
+                             SHX, SHY, SLO, SRE, STA, STX, STY, TAS, TAX, TAY,
+                             TSX, TXA, TXS, TYA, XAA, MODE_DUMMY,
+                             MODE_ABSOLUTE, MODE_ABSOLUTE_X, MODE_ABSOLUTE_Y,
+                             MODE_ACCUMULATOR, MODE_IMMEDIATE, MODE_IMPLIED,
+                             MODE_INDEXED_INDIRECT, MODE_INDIRECT,
+                             MODE_INDIRECT_INDEXED, MODE_RELATIVE,
+                             MODE_ZEROPAGE, MODE_ZEROPAGE_X, MODE_ZEROPAGE_Y,
+                             INSTRUCTIONS, STACK_POINTER_RESET,
+                             RESET_VECTOR, NMI_VECTOR, IRQ_BRK_VECTOR,
+                             MEM_SIZE, FLAG_C, FLAG_Z, FLAG_I, FLAG_D, FLAG_B,
+                             FLAG_U, FLAG_V, FLAG_N, BUTTON_A, BUTTON_B,
+                             BUTTON_SELECT, BUTTON_START, BUTTON_UP,
+                             BUTTON_DOWN, BUTTON_LEFT, BUTTON_RIGHT)
+from NESEmulator.ppu import (NES_PALETTE, NES_WIDTH, NES_HEIGHT,
+                             SPR_RAM_SIZE, NAMETABLE_SIZE, PALETTE_SIZE)
+from NESEmulator.rom import ROM, PRG_RAM_SIZE
+
+# One array per field of the CPU's opcode table
+OPCODE_TYPE = np.array([i[0] for i in INSTRUCTIONS], dtype=np.uint8)
+OPCODE_MODE = np.array([i[1] for i in INSTRUCTIONS], dtype=np.uint8)
+OPCODE_LENGTH = np.array([i[2] for i in INSTRUCTIONS], dtype=np.uint8)
+OPCODE_TICKS = np.array([i[3] for i in INSTRUCTIONS], dtype=np.uint8)
+OPCODE_PAGE_TICKS = np.array([i[4] for i in INSTRUCTIONS], dtype=np.uint8)
+
+# Slots in the state vector. The CPU registers sit together at the front
+# (A, X, Y, SP, PC, P, cycles), then the PPU's registers and latches, then
+# cartridge and controller settings.
+A, X, Y, SP, PC, P, CYCLES = range(7)
+STALL, JUMPED, PAGE_CROSSED = range(7, 10)
+(PPU_ADDR, PPU_ADDR_WRITE_LATCH, PPU_STATUS, PPU_SPR_ADDRESS,
+ PPU_NAMETABLE_ADDRESS, PPU_ADDRESS_INCREMENT, PPU_SPR_PATTERN_TABLE_ADDRESS,
+ PPU_BACKGROUND_PATTERN_TABLE_ADDRESS, PPU_GENERATE_NMI, PPU_SHOW_BACKGROUND,
+ PPU_SHOW_SPRITES, PPU_LEFT_8_SPRITE_SHOW, PPU_LEFT_8_BACKGROUND_SHOW,
+ PPU_SCROLL_X, PPU_SCROLL_Y, PPU_SCROLL_LATCH, PPU_BUFFER2007, PPU_SCANLINE,
+ PPU_CYCLE, PPU_PENDING_CYCLES) = range(10, 30)
+(MAPPER, PRG_ROM_MASK, CHR_ROM_OFFSET, VERTICAL_MIRRORING, JOYPAD1_BUTTONS,
+ JOYPAD1_STROBE, JOYPAD1_READ_COUNT, CHR_TILES_OFFSET) = range(30, 38)
+STATE_SIZE = 38
+
+# Layout of the flat CPU-side memory: RAM, PRG RAM, PRG ROM, CHR ROM then
+# CHR ROM decoded into 8x8 tiles of 2-bit color indices, 64 bytes each
+PRG_RAM_OFFSET = MEM_SIZE
+PRG_ROM_OFFSET = PRG_RAM_OFFSET + PRG_RAM_SIZE
+# Layout of the flat PPU-side memory: nametables, palette then sprite RAM
+PALETTE_OFFSET = NAMETABLE_SIZE
+SPR_OFFSET = PALETTE_OFFSET + PALETTE_SIZE
+VRAM_SIZE = SPR_OFFSET + SPR_RAM_SIZE
+
+# NES colors split into bytes, in the (red, green, blue) order of
+# pygame.surfarray.pixels3d
+NES_PALETTE_RGB = ((NES_PALETTE[:, None] >> np.array([16, 8, 0],
+                                                     dtype=np.uint32))
+                   & 0xFF).astype(np.uint8)
+
+
+def power_on(rom: ROM) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    state = np.zeros(STATE_SIZE, dtype=np.int64)
+    chr_rom_offset = PRG_ROM_OFFSET + len(rom.prg_rom)
+    chr_tiles_offset = chr_rom_offset + len(rom.chr_rom)
+    mem = np.zeros(chr_tiles_offset + rom.chr_tiles.size, dtype=np.uint8)
+    mem[PRG_ROM_OFFSET:chr_rom_offset] = np.frombuffer(rom.prg_rom,
+                                                       dtype=np.uint8)
+    mem[chr_rom_offset:chr_tiles_offset] = np.frombuffer(rom.chr_rom,
+                                                         dtype=np.uint8)
+    mem[chr_tiles_offset:] = rom.chr_tiles.reshape(-1)
+    vram = np.zeros(VRAM_SIZE, dtype=np.uint8)
+    # Cartridge
+    state[MAPPER] = rom.mapper
+    state[PRG_ROM_MASK] = 0x7FFF if rom.header.prg_rom_size > 1 else 0x3FFF
+    state[CHR_ROM_OFFSET] = chr_rom_offset
+    state[CHR_TILES_OFFSET] = chr_tiles_offset
+    state[VERTICAL_MIRRORING] = rom.vertical_mirroring
+    # CPU and PPU power up state, matching CPU.__init__ and PPU.__init__
+    state[SP] = STACK_POINTER_RESET
+    state[P] = FLAG_I
+    state[PC] = rom.read_cartridge(RESET_VECTOR) | \
+        (rom.read_cartridge(RESET_VECTOR + 1) << 8)
+    state[PPU_ADDRESS_INCREMENT] = 1
+    return state, mem, vram
+
+
+def set_button(state: np.ndarray, button: int, pressed: bool):
+    if pressed:
+        state[JOYPAD1_BUTTONS] |= 1 << button
+    else:
+        state[JOYPAD1_BUTTONS] &= ~(1 << button)
+
+
+# Cartridge access for mapper 0, the only MAPPER tag implemented so far
+@njit(cache=True)
+def cartridge_index(state, address):
+    if address >= 0x8000:
+        return PRG_ROM_OFFSET + (address & state[PRG_ROM_MASK])
+    return PRG_RAM_OFFSET + (address & (PRG_RAM_SIZE - 1))
+
+
+@njit(cache=True)
+def nametable_index(state, address):
+    address = (address - 0x2000) & 0xFFF  # 3000-3EFF is a mirror
+    if state[VERTICAL_MIRRORING]:
+        address = address & 0x7FF
+    else:  # horizontal mirroring
+        if (address >= 0x400) and (address < 0xC00):
+            address = address - 0x400
+        elif address >= 0xC00:
+            address = address - 0x800
+    return address
+
+
+@njit(cache=True)
+def palette_index(address):
+    address = (address - 0x3F00) & 0x1F
+    if (address > 0x0F) and ((address & 3) == 0):
+        address = address - 0x10
+    return PALETTE_OFFSET + address
+
+
+@njit(cache=True)
+def ppu_read_memory(state, mem, vram, address):
+    address = address & 0x3FFF  # mirror >0x4000
+    if address < 0x2000:  # pattern tables
+        return np.int64(mem[state[CHR_ROM_OFFSET] + address])
+    elif address < 0x3F00:  # nametables
+        return np.int64(vram[nametable_index(state, address)])
+    else:  # palette memory
+        return np.int64(vram[palette_index(address)])
+
+
+@njit(cache=True)
+def ppu_write_memory(state, vram, address, value):
+    address = address & 0x3FFF  # mirror >0x4000
+    if address < 0x2000:  # pattern tables are ROM for mapper 0
+        return
+    elif address < 0x3F00:  # nametables
+        vram[nametable_index(state, address)] = value
+    else:  # palette memory
+        vram[palette_index(address)] = value
+
+
+@njit(cache=True)
+def ppu_read_register(state, mem, vram, address):
+    if address == 0x2002:
+        state[PPU_ADDR_WRITE_LATCH] = 0
+        state[PPU_SCROLL_LATCH] = 0
+        current = state[PPU_STATUS]
+        state[PPU_STATUS] = current & 0b01111111  # clear vblank
+        return current
+    elif address == 0x2004:
+        return np.int64(vram[SPR_OFFSET + (state[PPU_SPR_ADDRESS] & 0xFF)])
+    elif address == 0x2007:
+        addr = state[PPU_ADDR]
+        if (addr & 0x3FFF) < 0x3F00:
+            value = state[PPU_BUFFER2007]
+            state[PPU_BUFFER2007] = ppu_read_memory(state, mem, vram, addr)
+        else:
+            value = ppu_read_memory(state, mem, vram, addr)
+            state[PPU_BUFFER2007] = ppu_read_memory(state, mem, vram,
+                                                    addr - 0x1000)
+        # Every read to 0x2007 there is an increment
+        state[PPU_ADDR] = addr + state[PPU_ADDRESS_INCREMENT]
+        return value
+    raise LookupError("Error: Unrecognized PPU read")
+
+
+@njit(cache=True)
+def ppu_write_register(state, vram, address, value):
+    if address == 0x2000:  # Control1
+        state[PPU_NAMETABLE_ADDRESS] = 0x2000 + (value & 0b00000011) * 0x400
+        state[PPU_ADDRESS_INCREMENT] = 32 if (value & 0b00000100) else 1
+        state[PPU_SPR_PATTERN_TABLE_ADDRESS] = \
+            ((value & 0b00001000) >> 3) * 0x1000
+        state[PPU_BACKGROUND_PATTERN_TABLE_ADDRESS] = \
+            ((value & 0b00010000) >> 4) * 0x1000
+        state[PPU_GENERATE_NMI] = (value >> 7) & 1
+    elif address == 0x2001:  # Control2
+        state[PPU_SHOW_BACKGROUND] = (value >> 3) & 1
+        state[PPU_SHOW_SPRITES] = (value >> 4) & 1
+        state[PPU_LEFT_8_BACKGROUND_SHOW] = (value >> 1) & 1
+        state[PPU_LEFT_8_SPRITE_SHOW] = (value >> 2) & 1
+    elif address == 0x2003:
+        state[PPU_SPR_ADDRESS] = value
+    elif address == 0x2004:
+        vram[SPR_OFFSET + (state[PPU_SPR_ADDRESS] & 0xFF)] = value
+        state[PPU_SPR_ADDRESS] += 1
+    elif address == 0x2005:  # scroll
+        if not state[PPU_SCROLL_LATCH]:
+            state[PPU_SCROLL_X] = value
+        else:
+            state[PPU_SCROLL_Y] = value
+        state[PPU_SCROLL_LATCH] ^= 1
+    elif address == 0x2006:
+        addr = state[PPU_ADDR]
+        if not state[PPU_ADDR_WRITE_LATCH]:  # first write
+            state[PPU_ADDR] = (addr & 0x00FF) | ((value & 0xFF) << 8)
+        else:  # second write
+            state[PPU_ADDR] = (addr & 0xFF00) | (value & 0xFF)
+        state[PPU_ADDR_WRITE_LATCH] ^= 1
+    elif address == 0x2007:
+        ppu_write_memory(state, vram, state[PPU_ADDR], value)
+        state[PPU_ADDR] += state[PPU_ADDRESS_INCREMENT]
+    else:
+        raise LookupError("Error: Unrecognized PPU write")
+
+
+# The display buffer is a (NES_WIDTH, NES_HEIGHT, 3) view of the screen
+@njit(cache=True)
+def put_pixel(display_buffer, x, y, color):
+    display_buffer[x, y, 0] = NES_PALETTE_RGB[color, 0]
+    display_buffer[x, y, 1] = NES_PALETTE_RGB[color, 1]
+    display_buffer[x, y, 2] = NES_PALETTE_RGB[color, 2]
+
+
+@njit(cache=True)
+def draw_background(state, mem, vram, display_buffer):
+    nametable_address = state[PPU_NAMETABLE_ADDRESS]
+    # First decoded tile of the pattern table
+    tiles = state[CHR_TILES_OFFSET] + \
+        (state[PPU_BACKGROUND_PATTERN_TABLE_ADDRESS] >> 4) * 64
+    scroll_x = state[PPU_SCROLL_X]
+    scroll_y = state[PPU_SCROLL_Y]
+    attribute_table_address = nametable_address + 960
+    # 32 tiles in width and 30 tiles in height
+    for y in range(30):
+        for x in range(32):
+            nametable_entry = ppu_read_memory(state, mem, vram,
+                                              nametable_address + y * 32 + x)
+            attribute_entry = ppu_read_memory(
+                state, mem, vram,
+                attribute_table_address + (y // 4) * 8 + x // 4)
+            # https://forums.nesdev.com/viewtopic.php?f=10&t=13315
+            block = (y & 0x02) | ((x & 0x02) >> 1)
+            attribute_bits = ((attribute_entry >> (block * 2)) & 3) << 2
+            tile = tiles + nametable_entry * 64
+            for fine_y in range(8):
+                y_screen_loc = (y * 8 + fine_y - scroll_y) % NES_HEIGHT
+                for fine_x in range(8):
+                    pixel = mem[tile + fine_y * 8 + fine_x]
+                    x_screen_loc = (x * 8 + fine_x - scroll_x) % NES_WIDTH
+                    # If the background is transparent use the first color
+                    if pixel == 0:
+                        color = vram[PALETTE_OFFSET]
+                    else:
+                        color = vram[PALETTE_OFFSET + (pixel | attribute_bits)]
+                    put_pixel(display_buffer, x_screen_loc, y_screen_loc,
+                              color & 0x3F)
+
+
+@njit(cache=True)
+def draw_sprites(state, mem, vram, display_buffer, background_transparent):
+    # First decoded tile of the pattern table
+    tiles = state[CHR_TILES_OFFSET] + \
+        (state[PPU_SPR_PATTERN_TABLE_ADDRESS] >> 4) * 64
+    # Sprite zero hits need both layers on and the left 8 pixels not clipped
+    sprite_zero_hit_possible = (state[PPU_SHOW_BACKGROUND] != 0) and \
+        (state[PPU_SHOW_SPRITES] != 0) and not background_transparent
+    left_8_clipped = (state[PPU_LEFT_8_SPRITE_SHOW] == 0) or \
+        (state[PPU_LEFT_8_BACKGROUND_SHOW] == 0)
+    for i in range(SPR_RAM_SIZE - 4, -4, -4):
+        y_position = np.int64(vram[SPR_OFFSET + i])
+        if y_position == 0xFF:  # 0xFF is a marker for no sprite data
+            continue
+        index = np.int64(vram[SPR_OFFSET + i + 1])
+        attributes = np.int64(vram[SPR_OFFSET + i + 2])
+        x_position = np.int64(vram[SPR_OFFSET + i + 3])
+        background_sprite = (attributes >> 5) & 1
+        flip_x = (attributes >> 6) & 1
+        flip_y = (attributes >> 7) & 1
+        tile = tiles + index * 64
+        # The sprite's four palette entries; color 0 is transparent
+        palette = PALETTE_OFFSET + 0x10 + ((attributes & 3) << 2)
+        for y in range(y_position, y_position + 8):
+            if y >= NES_HEIGHT:
+                break
+            sprite_line = y - y_position
+            if flip_y:
+                sprite_line = 7 - sprite_line
+            row = tile + sprite_line * 8
+            for x in range(x_position, x_position + 8):
+                if x >= NES_WIDTH:
+                    break
+                x_loc = x - x_position  # position within sprite
+                if flip_x:
+                    x_loc = 7 - x_loc
+                bit1and0 = mem[row + x_loc]
+                if bit1and0 == 0:  # transparent pixel... skip
+                    continue
+                # This is not transparent. Is it a sprite zero hit therefore?
+                if i == 0 and sprite_zero_hit_possible and \
+                        not (x < 8 and left_8_clipped):
+                    state[PPU_STATUS] |= 0b01000000
+                # Background sprites don't draw over opaque pixels
+                if background_sprite and not background_transparent:
+                    continue
+                color = vram[palette + bit1and0]
+                put_pixel(display_buffer, x, y, color & 0x3F)
+
+
+@njit(cache=True)
+def ppu_step(state, mem, vram, display_buffer):
+    scanline = state[PPU_SCANLINE]
+    cycle = state[PPU_CYCLE]
+    # Our simplified PPU draws just once per frame
+    if (scanline == 240) and (cycle == 256):
+        if state[PPU_SHOW_BACKGROUND]:
+            draw_background(state, mem, vram, display_buffer)
+        if state[PPU_SHOW_SPRITES]:
+            draw_sprites(state, mem, vram, display_buffer, False)
+    if (scanline == 241) and (cycle == 1):
+        state[PPU_STATUS] |= 0b10000000  # set vblank
+    if (scanline == 261) and (cycle == 1):
+        # Vblank off, clear sprite zero, clear sprite overflow
+        state[PPU_STATUS] |= 0b00011111
+
+    cycle += 1
+    if cycle > 340:
+        cycle = 0
+        scanline += 1
+        if scanline > 261:
+            scanline = 0
+    state[PPU_SCANLINE] = scanline
+    state[PPU_CYCLE] = cycle
+
+
+@njit(cache=True)
+def cpu_read(state, mem, vram, address):
+    # Memory map at http://wiki.nesdev.com/w/index.php/CPU_memory_map
+    if address < 0x2000:  # main ram 2 KB goes up to 0x800
+        return np.int64(mem[address & 0x7FF])  # mirrors for next 6 KB
+    elif address < 0x4000:  # 2000-2007 is PPU, mirrors every 8 bytes
+        return ppu_read_register(state, mem, vram, (address & 7) | 0x2000)
+    elif address == 0x4016:  # joypad 1 status
+        buttons = state[JOYPAD1_BUTTONS]
+        if state[JOYPAD1_STROBE]:
+            return buttons & 1
+        state[JOYPAD1_READ_COUNT] += 1
+        read_count = state[JOYPAD1_READ_COUNT]
+        if read_count <= 8:
+            return 0x40 | ((buttons >> (read_count - 1)) & 1)
+        return 0x41
+    elif address < 0x6000:
+        return 0  # unimplemented other kinds of IO
+    else:  # addresses from 0x6000 to 0xFFFF are from the cartridge
+        return np.int64(mem[cartridge_index(state, address)])
+
+
+@njit(cache=True)
+def cpu_write(state, mem, vram, address, value):
+    # Memory map at https://wiki.nesdev.org/w/index.php/CPU_memory_map
+    if address < 0x2000:  # main RAM 2 KB goes up to 0x800
+        mem[address & 0x7FF] = value  # mirrors for next 6 KB
+    elif address < 0x3FFF:  # 2000-2007 is PPU, mirrors every 8 bytes
+        ppu_write_register(state, vram, (address & 7) | 0x2000, value)
+    elif address == 0x4014:  # DMA transfer of sprite data
+        from_address = value << 8  # address to start copying from
+        for i in range(SPR_RAM_SIZE):  # copy all 256 bytes to sprite ram
+            vram[SPR_OFFSET + i] = cpu_read(state, mem, vram,
+                                            from_address + i)
+        # Stall for 512 cycles while this completes
+        state[STALL] = 512
+    elif address == 0x4016:  # joypad 1
+        if state[JOYPAD1_STROBE] and not (value & 1):
+            state[JOYPAD1_READ_COUNT] = 0
+        state[JOYPAD1_STROBE] = value & 1
+    elif address >= 0x6000:  # cartridge, where only PRG RAM is writable
+        mem[PRG_RAM_OFFSET + (address & (PRG_RAM_SIZE - 1))] = value
+
+
+@njit(cache=True)
+def address_for_mode(state, mem, vram, data, mode):
+    if mode == MODE_ABSOLUTE or mode == MODE_ZEROPAGE:
+        return data
+    elif mode == MODE_ABSOLUTE_X or mode == MODE_ABSOLUTE_Y or \
+            mode == MODE_INDIRECT_INDEXED:
+        index = state[X] if mode == MODE_ABSOLUTE_X else state[Y]
+        base = data
+        if mode == MODE_INDIRECT_INDEXED:
+            # 0xFF for zero-page wrapping in next two lines
+            base = (np.int64(mem[(data + 1) & 0xFF]) << 8) | \
+                np.int64(mem[data & 0xFF])
+        address = (base + index) & 0xFFFF
+        state[PAGE_CROSSED] = (address & 0xFF00) != \
+            ((address - index) & 0xFF00)
+        return address
+    elif mode == MODE_INDEXED_INDIRECT:
+        # 0xFF for zero-page wrapping in next two lines
+        ls = np.int64(mem[(data + state[X]) & 0xFF])
+        ms = np.int64(mem[(data + state[X] + 1) & 0xFF])
+        return (ms << 8) | ls
+    elif mode == MODE_INDIRECT:
+        # The pointer can be anywhere in memory, and its high byte wraps
+        # within the page
+        ls = cpu_read(state, mem, vram, data)
+        ms = cpu_read(state, mem, vram, (data & 0xFF00) | ((data + 1) & 0xFF))
+        return (ms << 8) | ls
+    elif mode == MODE_RELATIVE:
+        if data < 0x80:
+            return (state[PC] + 2 + data) & 0xFFFF
+        return (state[PC] + 2 + (data - 256)) & 0xFFFF  # signed
+    elif mode == MODE_ZEROPAGE_X:
+        return (data + state[X]) & 0xFF
+    elif mode == MODE_ZEROPAGE_Y:
+        return (data + state[Y]) & 0xFF
+    return 0
+
+
+@njit(cache=True)
+def read_memory(state, mem, vram, location, mode):
+    if mode == MODE_IMMEDIATE:
+        return location  # location is actually data in this case
+    return cpu_read(state, mem, vram,
+                    address_for_mode(state, mem, vram, location, mode))
+
+
+@njit(cache=True)
+def write_memory(state, mem, vram, location, mode, value):
+    if mode == MODE_IMMEDIATE:
+        mem[location & 0x7FF] = value
+        return
+    cpu_write(state, mem, vram,
+              address_for_mode(state, mem, vram, location, mode), value)
+
+
+@njit(cache=True)
+def set_zn(state, value):
+    flags = state[P] & ~(FLAG_Z | FLAG_N)
+    if value == 0:
+        flags |= FLAG_Z
+    if (value & 0x80) or (value < 0):
+        flags |= FLAG_N
+    state[P] = flags
+
+
+@njit(cache=True)
+def set_flag(state, flag, condition):
+    if condition:
+        state[P] |= flag
+    else:
+        state[P] &= ~flag
+
+
+@njit(cache=True)
+def stack_push(state, mem, value):
+    mem[0x100 | state[SP]] = value
+    state[SP] = (state[SP] - 1) & 0xFF
+
+
+@njit(cache=True)
+def stack_pop(state, mem):
+    state[SP] = (state[SP] + 1) & 0xFF
+    return np.int64(mem[0x100 | state[SP]])
+
+
+@njit(cache=True)
+def read_vector(state, mem, vram, vector):
+    return cpu_read(state, mem, vram, vector) | \
+        (cpu_read(state, mem, vram, vector + 1) << 8)
+
+
+@njit(cache=True)
+def interrupt(state, mem, vram, vector):
+    stack_push(state, mem, (state[PC] >> 8) & 0xFF)
+    stack_push(state, mem, state[PC] & 0xFF)
+    # https://nesdev.org/the%20'B'%20flag%20&%20BRK%20instruction.txt
+    stack_push(state, mem, state[P] | FLAG_B | FLAG_U)
+    state[P] |= FLAG_I
+    state[PC] = read_vector(state, mem, vram, vector)
+
+
+@njit(cache=True)
+def trigger_nmi(state, mem, vram):
+    interrupt(state, mem, vram, NMI_VECTOR)
+
+
+# Opcode handlers, one free function per instruction type. They all take
+# the same (state, mem, vram, mode, data) arguments so that execute() can
+# dispatch on a single equality test per arm, which LLVM lowers into a
+# jump table.
+@njit(cache=True)
+def op_lda(state, mem, vram, mode, data):
+    state[A] = read_memory(state, mem, vram, data, mode)
+    set_zn(state, state[A])
+
+
+@njit(cache=True)
+def op_ldx(state, mem, vram, mode, data):
+    state[X] = read_memory(state, mem, vram, data, mode)
+    set_zn(state, state[X])
+
+
+@njit(cache=True)
+def op_ldy(state, mem, vram, mode, data):
+    state[Y] = read_memory(state, mem, vram, data, mode)
+    set_zn(state, state[Y])
+
+
+@njit(cache=True)
+def op_sta(state, mem, vram, mode, data):
+    write_memory(state, mem, vram, data, mode, state[A])
+
+
+@njit(cache=True)
+def op_stx(state, mem, vram, mode, data):
+    write_memory(state, mem, vram, data, mode, state[X])
+
+
+@njit(cache=True)
+def op_sty(state, mem, vram, mode, data):
+    write_memory(state, mem, vram, data, mode, state[Y])
+
+
+# Shared by all eight branches, taken when the flag matches is_set
+@njit(cache=True)
+def branch(state, mem, vram, mode, data, flag, is_set):
+    if ((state[P] & flag) != 0) == is_set:
+        state[PC] = address_for_mode(state, mem, vram, data, mode)
+        state[JUMPED] = 1
+        # Branch instructions are +1 ticks if they succeeded
+        state[CYCLES] += 1
+
+
+@njit(cache=True)
+def add_with_carry(state, a, src, carry):
+    total = a + src + carry
+    overflow = ~(a ^ src) & (a ^ total) & 0x80
+    result = total & 0xFF
+    # C, V, Z and N all come out of the one sum, so write them at once
+    state[P] = (state[P] & ~(FLAG_C | FLAG_Z | FLAG_V | FLAG_N)) | \
+        (total >> 8) | (overflow >> 1) | ((result == 0) << 1) | \
+        (result & FLAG_N)
+    state[A] = result
+
+
+@njit(cache=True)
+def op_adc(state, mem, vram, mode, data):
+    src = read_memory(state, mem, vram, data, mode)
+    add_with_carry(state, state[A], src, state[P] & FLAG_C)
+
+
+# A - src - borrow is A + ~src + carry in 8 bits
+@njit(cache=True)
+def op_sbc(state, mem, vram, mode, data):
+    src = read_memory(state, mem, vram, data, mode)
+    add_with_carry(state, state[A], src ^ 0xFF, state[P] & FLAG_C)
+
+
+@njit(cache=True)
+def op_and(state, mem, vram, mode, data):
+    state[A] &= read_memory(state, mem, vram, data, mode)
+    set_zn(state, state[A])
+
+
+@njit(cache=True)
+def op_ora(state, mem, vram, mode, data):
+    state[A] |= read_memory(state, mem, vram, data, mode)
+    set_zn(state, state[A])
+
+
+@njit(cache=True)
+def op_eor(state, mem, vram, mode, data):
+    state[A] ^= read_memory(state, mem, vram, data, mode)
+    set_zn(state, state[A])
+
+
+# Shared by CMP, CPX and CPY
+@njit(cache=True)
+def compare(state, mem, vram, mode, data, register):
+    src = read_memory(state, mem, vram, data, mode)
+    set_flag(state, FLAG_C, register >= src)
+    set_zn(state, register - src)
+
+
+@njit(cache=True)
+def op_bit(state, mem, vram, mode, data):
+    src = read_memory(state, mem, vram, data, mode)
+    set_flag(state, FLAG_V, (src >> 6) & 1)
+    set_flag(state, FLAG_Z, (src & state[A]) == 0)
+    set_flag(state, FLAG_N, (src >> 7) == 1)
+
+
+@njit(cache=True)
+def read_shift_operand(state, mem, vram, mode, data):
+    if mode == MODE_ACCUMULATOR:
+        return state[A]
+    return read_memory(state, mem, vram, data, mode)
+
+
+@njit(cache=True)
+def write_shift_result(state, mem, vram, mode, data, src):
+    set_zn(state, src)
+    if mode == MODE_ACCUMULATOR:
+        state[A] = src
+    else:
+        write_memory(state, mem, vram, data, mode, src)
+
+
+@njit(cache=True)
+def op_asl(state, mem, vram, mode, data):
+    src = read_shift_operand(state, mem, vram, mode, data)
+    set_flag(state, FLAG_C, src >> 7)  # carry is set to 7th bit
+    write_shift_result(state, mem, vram, mode, data, (src << 1) & 0xFF)
+
+
+@njit(cache=True)
+def op_lsr(state, mem, vram, mode, data):
+    src = read_shift_operand(state, mem, vram, mode, data)
+    set_flag(state, FLAG_C, src & 1)  # carry is set to 0th bit
+    write_shift_result(state, mem, vram, mode, data, src >> 1)
+
+
+@njit(cache=True)
+def op_rol(state, mem, vram, mode, data):
+    src = read_shift_operand(state, mem, vram, mode, data)
+    old_c = state[P] & FLAG_C
+    set_flag(state, FLAG_C, (src >> 7) & 1)  # carry is 7th bit
+    write_shift_result(state, mem, vram, mode, data,
+                       ((src << 1) | old_c) & 0xFF)
+
+
+@njit(cache=True)
+def op_ror(state, mem, vram, mode, data):
+    src = read_shift_operand(state, mem, vram, mode, data)
+    old_c = state[P] & FLAG_C
+    set_flag(state, FLAG_C, src & 1)  # carry is set to 0th bit
+    write_shift_result(state, mem, vram, mode, data,
+                       ((src >> 1) | (old_c << 7)) & 0xFF)
+
+
+@njit(cache=True)
+def op_inc(state, mem, vram, mode, data):
+    src = (read_memory(state, mem, vram, data, mode) + 1) & 0xFF
+    write_memory(state, mem, vram, data, mode, src)
+    set_zn(state, src)
+
+
+@njit(cache=True)
+def op_dec(state, mem, vram, mode, data):
+    src = (read_memory(state, mem, vram, data, mode) - 1) & 0xFF
+    write_memory(state, mem, vram, data, mode, src)
+    set_zn(state, src)
+
+
+# Register to register moves and increments, dest = value & 0xFF
+@njit(cache=True)
+def load_register(state, dest, value):
+    state[dest] = value & 0xFF
+    set_zn(state, state[dest])
+
+
+@njit(cache=True)
+def op_jmp(state, mem, vram, mode, data):
+    state[PC] = address_for_mode(state, mem, vram, data, mode)
+    state[JUMPED] = 1
+
+
+@njit(cache=True)
+def op_jsr(state, mem, vram, mode, data):
+    state[PC] += 2
+    stack_push(state, mem, (state[PC] >> 8) & 0xFF)
+    stack_push(state, mem, state[PC] & 0xFF)
+    state[PC] = address_for_mode(state, mem, vram, data, mode)
+    state[JUMPED] = 1
+
+
+@njit(cache=True)
+def op_rts(state, mem, vram, mode, data):
+    lb = stack_pop(state, mem)
+    hb = stack_pop(state, mem)
+    state[PC] = ((hb << 8) | lb) + 1  # 1 past last instruction
+    state[JUMPED] = 1
+
+
+@njit(cache=True)
+def op_rti(state, mem, vram, mode, data):
+    # Pull status out, B is never really set in the register
+    state[P] = stack_pop(state, mem) & ~(FLAG_B | FLAG_U)
+    lb = stack_pop(state, mem)
+    hb = stack_pop(state, mem)
+    state[PC] = (hb << 8) | lb
+    state[JUMPED] = 1
+
+
+@njit(cache=True)
+def op_brk(state, mem, vram, mode, data):
+    state[PC] += 2
+    interrupt(state, mem, vram, IRQ_BRK_VECTOR)
+    state[JUMPED] = 1
+
+
+@njit(cache=True)
+def execute(state, mem, vram, opcode, mode, data):
+    instruction_type = OPCODE_TYPE[opcode]
+    if instruction_type == ADC:
+        op_adc(state, mem, vram, mode, data)
+    elif instruction_type == AND:
+        op_and(state, mem, vram, mode, data)
+    elif instruction_type == ASL:
+        op_asl(state, mem, vram, mode, data)
+    elif instruction_type == BCC:
+        branch(state, mem, vram, mode, data, FLAG_C, False)
+    elif instruction_type == BCS:
+        branch(state, mem, vram, mode, data, FLAG_C, True)
+    elif instruction_type == BEQ:
+        branch(state, mem, vram, mode, data, FLAG_Z, True)
+    elif instruction_type == BIT:
+        op_bit(state, mem, vram, mode, data)
+    elif instruction_type == BMI:
+        branch(state, mem, vram, mode, data, FLAG_N, True)
+    elif instruction_type == BNE:
+        branch(state, mem, vram, mode, data, FLAG_Z, False)
+    elif instruction_type == BPL:
+        branch(state, mem, vram, mode, data, FLAG_N, False)
+    elif instruction_type == BRK:
+        op_brk(state, mem, vram, mode, data)
+    elif instruction_type == BVC:
+        branch(state, mem, vram, mode, data, FLAG_V, False)
+    elif instruction_type == BVS:
+        branch(state, mem, vram, mode, data, FLAG_V, True)
+    elif instruction_type == CLC:
+        state[P] &= ~FLAG_C
+    elif instruction_type == CLD:
+        state[P] &= ~FLAG_D
+    elif instruction_type == CLI:
+        state[P] &= ~FLAG_I
+    elif instruction_type == CLV:
+        state[P] &= ~FLAG_V
+    elif instruction_type == CMP:
+        compare(state, mem, vram, mode, data, state[A])
+    elif instruction_type == CPX:
+        compare(state, mem, vram, mode, data, state[X])
+    elif instruction_type == CPY:
+        compare(state, mem, vram, mode, data, state[Y])
+    elif instruction_type == DEC:
+        op_dec(state, mem, vram, mode, data)
+    elif instruction_type == DEX:
+        load_register(state, X, state[X] - 1)
+    elif instruction_type == DEY:
+        load_register(state, Y, state[Y] - 1)
+    elif instruction_type == EOR:
+        op_eor(state, mem, vram, mode, data)
+    elif instruction_type == INC:
+        op_inc(state, mem, vram, mode, data)
+    elif instruction_type == INX:
+        load_register(state, X, state[X] + 1)
+    elif instruction_type == INY:
+        load_register(state, Y, state[Y] + 1)
+    elif instruction_type == JMP:
+        op_jmp(state, mem, vram, mode, data)
+    elif instruction_type == JSR:
+        op_jsr(state, mem, vram, mode, data)
+    elif instruction_type == LDA:
+        op_lda(state, mem, vram, mode, data)
+    elif instruction_type == LDX:
+        op_ldx(state, mem, vram, mode, data)
+    elif instruction_type == LDY:
+        op_ldy(state, mem, vram, mode, data)
+    elif instruction_type == LSR:
+        op_lsr(state, mem, vram, mode, data)
+    elif instruction_type == NOP:
+        pass
+    elif instruction_type == ORA:
+        op_ora(state, mem, vram, mode, data)
+    elif instruction_type == PHA:
+        stack_push(state, mem, state[A])
+    elif instruction_type == PHP:
+        stack_push(state, mem, state[P] | FLAG_B | FLAG_U)
+    elif instruction_type == PLA:
+        load_register(state, A, stack_pop(state, mem))
+    elif instruction_type == PLP:
+        state[P] = stack_pop(state, mem) & ~(FLAG_B | FLAG_U)
+    elif instruction_type == ROL:
+        op_rol(state, mem, vram, mode, data)
+    elif instruction_type == ROR:
+        op_ror(state, mem, vram, mode, data)
+    elif instruction_type == RTI:
+        op_rti(state, mem, vram, mode, data)
+    elif instruction_type == RTS:
+        op_rts(state, mem, vram, mode, data)
+    elif instruction_type == SBC:
+        op_sbc(state, mem, vram, mode, data)
+    elif instruction_type == SEC:
+        state[P] |= FLAG_C
+    elif instruction_type == SED:
+        state[P] |= FLAG_D
+    elif instruction_type == SEI:
+        state[P] |= FLAG_I
+    elif instruction_type == STA:
+        op_sta(state, mem, vram, mode, data)
+    elif instruction_type == STX:
+        op_stx(state, mem, vram, mode, data)
+    elif instruction_type == STY:
+        op_sty(state, mem, vram, mode, data)
+    elif instruction_type == TAX:
+        load_register(state, X, state[A])
+    elif instruction_type == TAY:
+        load_register(state, Y, state[A])
+    elif instruction_type == TSX:
+        load_register(state, X, state[SP])
+    elif instruction_type == TXA:
+        load_register(state, A, state[X])
+    elif instruction_type == TXS:
+        state[SP] = state[X]
+    elif instruction_type == TYA:
+        load_register(state, A, state[Y])
+    else:
+        print("Opcode", opcode, "is unimplemented.")
+
+
+@njit(cache=True)
+def cpu_step(state, mem, vram):
+    if state[STALL] > 0:
+        state[STALL] -= 1
+        state[CYCLES] += 1
+        return
+
+    pc = state[PC]
+    opcode = cpu_read(state, mem, vram, pc)
+    state[PAGE_CROSSED] = 0
+    state[JUMPED] = 0
+    mode = np.int64(OPCODE_MODE[opcode])
+    length = np.int64(OPCODE_LENGTH[opcode])
+    data = 0
+    for i in range(1, length):
+        data |= cpu_read(state, mem, vram, pc + i) << ((i - 1) * 8)
+
+    execute(state, mem, vram, opcode, mode, data)
+
+    if not state[JUMPED]:
+        state[PC] += length
+    state[CYCLES] += OPCODE_TICKS[opcode]
+    if state[PAGE_CROSSED]:
+        state[CYCLES] += OPCODE_PAGE_TICKS[opcode]
+
+
+# PPU positions, as scanline * PPU_CYCLES_PER_SCANLINE + cycle, where
+# ppu_step() does more than count: drawing the frame, then setting and
+# clearing vblank. Stepping from the first two lands on the frame end and
+# the NMI check respectively.
+PPU_CYCLES_PER_SCANLINE = 341
+PPU_CYCLES_PER_FRAME = 262 * PPU_CYCLES_PER_SCANLINE
+PPU_EVENTS = np.array([240 * PPU_CYCLES_PER_SCANLINE + 256,
+                       241 * PPU_CYCLES_PER_SCANLINE + 1,
+                       261 * PPU_CYCLES_PER_SCANLINE + 1], dtype=np.int64)
+
+
+# PPU cycles until the PPU next reaches one of PPU_EVENTS, 0 if it is on one
+@njit(cache=True)
+def cycles_to_ppu_event(state):
+    position = state[PPU_SCANLINE] * PPU_CYCLES_PER_SCANLINE + \
+        state[PPU_CYCLE]
+    nearest = PPU_CYCLES_PER_FRAME
+    for event in PPU_EVENTS:
+        distance = (event - position) % PPU_CYCLES_PER_FRAME
+        if distance < nearest:
+            nearest = distance
+    return nearest
+
+
+# Moves the PPU on by cycles without stepping through them one at a time,
+# only valid when no PPU_EVENTS position is passed
+@njit(cache=True)
+def skip_ppu_cycles(state, cycles):
+    position = (state[PPU_SCANLINE] * PPU_CYCLES_PER_SCANLINE +
+                state[PPU_CYCLE] + cycles) % PPU_CYCLES_PER_FRAME
+    state[PPU_SCANLINE] = position // PPU_CYCLES_PER_SCANLINE
+    state[PPU_CYCLE] = position % PPU_CYCLES_PER_SCANLINE
+
+
+# Runs CPU instructions until they have taken at least ppu_cycles PPU
+# cycles, or just one when ppu_cycles is 0, and leaves those PPU cycles
+# pending. Nothing the CPU can see changes between PPU events, so the CPU
+# can run up to the next one without the PPU catching up in between.
+@njit(cache=True)
+def run_cpu(state, mem, vram, ppu_cycles):
+    start = state[CYCLES]
+    cpu_step(state, mem, vram)
+    while (state[CYCLES] - start) * 3 < ppu_cycles:
+        cpu_step(state, mem, vram)
+    state[PPU_PENDING_CYCLES] = (state[CYCLES] - start) * 3
+
+
+# Runs the console until the PPU finishes drawing a frame, which happens
+# at scanline 240, cycle 257. PPU cycles still owed for the last CPU
+# instruction are kept in the state and paid off on the next call.
+@njit(cache=True)
+def run_frame(state, mem, vram, display_buffer):
+    while True:
+        # 3 PPU cycles for every CPU tick. Cycles before the next event are
+        # skipped over in one go, since they only move the PPU along.
+        while state[PPU_PENDING_CYCLES] > 0:
+            skip = min(cycles_to_ppu_event(state), state[PPU_PENDING_CYCLES])
+            if skip > 0:
+                skip_ppu_cycles(state, skip)
+                state[PPU_PENDING_CYCLES] -= skip
+                continue
+            state[PPU_PENDING_CYCLES] -= 1
+            ppu_step(state, mem, vram, display_buffer)
+            if (state[PPU_SCANLINE] == 241) and (state[PPU_CYCLE] == 2) \
+                    and state[PPU_GENERATE_NMI]:
+                trigger_nmi(state, mem, vram)
+            if (state[PPU_SCANLINE] == 240) and (state[PPU_CYCLE] == 257):
+                return
+        run_cpu(state, mem, vram, cycles_to_ppu_event(state))
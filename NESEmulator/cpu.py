@@ -1,50 +1,63 @@
 from __future__ import annotations
-from enum import Enum
-from dataclasses import dataclass
+from struct import Struct
 from array import array
-from typing import Callable
+from functools import partial
+from typing import Callable, NamedTuple
 from NESEmulator.ppu import PPU, SPR_RAM_SIZE
-from NESEmulator.rom import ROM
-
-MemMode = Enum("MemMode", "DUMMY ABSOLUTE ABSOLUTE_X ABSOLUTE_Y ACCUMULATOR "
-                          "IMMEDIATE IMPLIED INDEXED_INDIRECT INDIRECT "
-                          "INDIRECT_INDEXED RELATIVE ZEROPAGE ZEROPAGE_X "
-                          "ZEROPAGE_Y")
-
-InstructionType = Enum("InstructionType", "ADC AHX ALR ANC AND ARR ASL AXS "
-                                          "BCC BCS BEQ BIT BMI BNE BPL BRK "
-                                          "BVC BVS CLC CLD CLI CLV CMP CPX "
-                                          "CPY DCP DEC DEX DEY EOR INC INX "
-                                          "INY ISC JMP JSR KIL LAS LAX LDA "
-                                          "LDX LDY LSR NOP ORA PHA PHP PLA "
-                                          "PLP RLA ROL ROR RRA RTI RTS SAX "
-                                          "SBC SEC SED SEI SHX SHY SLO SRE "
-                                          "STA STX STY TAS TAX TAY TSX TXA "
-                                          "TXS TYA XAA")
-
-
-@dataclass(frozen=True)
-class Instruction:
-    type: InstructionType
-    method: Callable[[Instruction, int], None]
-    mode: MemMode
-    length: int
-    ticks: int
-    page_ticks: int
-
-
-@dataclass
-class Joypad:
-    strobe: bool = False
-    read_count: int = 0
-    a: bool = False
-    b: bool = False
-    select: bool = False
-    start: bool = False
-    up: bool = False
-    down: bool = False
-    left: bool = False
-    right: bool = False
+from NESEmulator.rom import ROM, PRG_RAM_MASK
+
+# Addressing modes
+MODE_DUMMY = 0
+MODE_ABSOLUTE = 1
+MODE_ABSOLUTE_X = 2
+MODE_ABSOLUTE_Y = 3
+MODE_ACCUMULATOR = 4
+MODE_IMMEDIATE = 5
+MODE_IMPLIED = 6
+MODE_INDEXED_INDIRECT = 7
+MODE_INDIRECT = 8
+MODE_INDIRECT_INDEXED = 9
+MODE_RELATIVE = 10
+MODE_ZEROPAGE = 11
+MODE_ZEROPAGE_X = 12
+MODE_ZEROPAGE_Y = 13
+# Names by value, for printing
+MODE_NAMES = ("DUMMY", "ABSOLUTE", "ABSOLUTE_X", "ABSOLUTE_Y", "ACCUMULATOR",
+              "IMMEDIATE", "IMPLIED", "INDEXED_INDIRECT", "INDIRECT",
+              "INDIRECT_INDEXED", "RELATIVE", "ZEROPAGE", "ZEROPAGE_X",
+              "ZEROPAGE_Y")
+
+# Instruction types, numbered in the order of their names
+INSTRUCTION_NAMES = ("ADC", "AHX", "ALR", "ANC", "AND", "ARR", "ASL", "AXS",
+                     "BCC", "BCS", "BEQ", "BIT", "BMI", "BNE", "BPL", "BRK",
+                     "BVC", "BVS", "CLC", "CLD", "CLI", "CLV", "CMP", "CPX",
+                     "CPY", "DCP", "DEC", "DEX", "DEY", "EOR", "INC", "INX",
+                     "INY", "ISC", "JMP", "JSR", "KIL", "LAS", "LAX", "LDA",
+                     "LDX", "LDY", "LSR", "NOP", "ORA", "PHA", "PHP", "PLA",
+                     "PLP", "RLA", "ROL", "ROR", "RRA", "RTI", "RTS", "SAX",
+                     "SBC", "SEC", "SED", "SEI", "SHX", "SHY", "SLO", "SRE",
+                     "STA", "STX", "STY", "TAS", "TAX", "TAY", "TSX", "TXA",
+                     "TXS", "TYA", "XAA")
+(ADC, AHX, ALR, ANC, AND, ARR, ASL, AXS, BCC, BCS, BEQ, BIT, BMI, BNE, BPL,
+ BRK, BVC, BVS, CLC, CLD, CLI, CLV, CMP, CPX, CPY, DCP, DEC, DEX, DEY, EOR,
+ INC, INX, INY, ISC, JMP, JSR, KIL, LAS, LAX, LDA, LDX, LDY, LSR, NOP, ORA,
+ PHA, PHP, PLA, PLP, RLA, ROL, ROR, RRA, RTI, RTS, SAX, SBC, SEC, SED, SEI,
+ SHX, SHY, SLO, SRE, STA, STX, STY, TAS, TAX, TAY, TSX, TXA, TXS, TYA,
+ XAA) = range(len(INSTRUCTION_NAMES))
+
+
+# A run of instructions compiled into one Python function, which returns the
+# number of ticks it took
+class Block(NamedTuple):
+    run: Callable[[], int]
+    start: int
+    end: int  # one past the last byte of the block
+    max_ticks: int
+
+
+# Joypad button bits, in the order they are shifted out of 0x4016
+(BUTTON_A, BUTTON_B, BUTTON_SELECT, BUTTON_START, BUTTON_UP, BUTTON_DOWN,
+ BUTTON_LEFT, BUTTON_RIGHT) = range(8)
 
 
 STACK_POINTER_RESET = 0xFD
@@ -53,567 +66,779 @@ RESET_VECTOR = 0xFFFC
 NMI_VECTOR = 0xFFFA
 IRQ_BRK_VECTOR = 0xFFFE
 MEM_SIZE = 2048
+# Status register bits. B and the unused bit 5 only exist on the stack.
+FLAG_C = 0b00000001  # Carry
+FLAG_Z = 0b00000010  # Zero
+FLAG_I = 0b00000100  # Interrupt Disable
+FLAG_D = 0b00001000  # Decimal Mode
+FLAG_B = 0b00010000  # Break Command
+FLAG_U = 0b00100000  # Unused, always 1
+FLAG_V = 0b01000000  # oVerflow
+FLAG_N = 0b10000000  # Negative
+FLAGS = {"C": FLAG_C, "Z": FLAG_Z, "I": FLAG_I, "D": FLAG_D, "V": FLAG_V,
+         "N": FLAG_N}
+INSTRUCTION_STRUCT = Struct("<BBB")  # opcode and up to two data bytes
+OPCODE_STRUCT = Struct("BBBB")  # mode, length, ticks and page_ticks
+DATA_MASKS = (0, 0, 0xFF, 0xFFFF)  # data bits used, by instruction length
+BLOCK_THRESHOLD = 50  # entries into a block before it gets compiled
+MAX_BLOCK_LENGTH = 32  # instructions
+# The flag each branch tests and the value it branches on, either the flag
+# itself or 0, so the test is a plain integer compare
+BRANCH_CONDITIONS = {BCC: (FLAG_C, 0), BCS: (FLAG_C, FLAG_C),
+                     BEQ: (FLAG_Z, FLAG_Z), BMI: (FLAG_N, FLAG_N),
+                     BNE: (FLAG_Z, 0), BPL: (FLAG_N, 0),
+                     BVC: (FLAG_V, 0), BVS: (FLAG_V, FLAG_V)}
+BRANCHES = frozenset(BRANCH_CONDITIONS)
+CONTROL_FLOW = BRANCHES | {JMP, JSR, RTS, RTI, BRK}
+# Instructions that set both Z and N without reading them first
+ZN_WRITERS = frozenset({ADC, AND, ASL, BIT, CMP, CPX, CPY, DEC, DEX, DEY,
+                        EOR, INC, INX, INY, LDA, LDX, LDY, LSR, ORA, PLA,
+                        ROL, ROR, SBC, TAX, TAY, TSX, TXA, TYA})
+ZN_READERS = frozenset({BEQ, BMI, BNE, BPL, BRK, PHP})
+MEMORY_WRITERS = frozenset({STA, STX, STY, INC, DEC, ASL, LSR, ROL, ROR})
+# Handled by a NAME_A method on the accumulator and NAME_M on memory
+SHIFTS = frozenset({ASL, LSR, ROL, ROR})
+# (type, mode, length, ticks, page_ticks) for every opcode
+INSTRUCTIONS = (
+    (BRK, MODE_IMPLIED, 1, 7, 0),  # 00
+    (ORA, MODE_INDEXED_INDIRECT, 2, 6, 0),  # 01
+    (KIL, MODE_IMPLIED, 0, 2, 0),  # 02
+    (SLO, MODE_INDEXED_INDIRECT, 0, 8, 0),  # 03
+    (NOP, MODE_ZEROPAGE, 2, 3, 0),  # 04
+    (ORA, MODE_ZEROPAGE, 2, 3, 0),  # 05
+    (ASL, MODE_ZEROPAGE, 2, 5, 0),  # 06
+    (SLO, MODE_ZEROPAGE, 0, 5, 0),  # 07
+    (PHP, MODE_IMPLIED, 1, 3, 0),  # 08
+    (ORA, MODE_IMMEDIATE, 2, 2, 0),  # 09
+    (ASL, MODE_ACCUMULATOR, 1, 2, 0),  # 0a
+    (ANC, MODE_IMMEDIATE, 0, 2, 0),  # 0b
+    (NOP, MODE_ABSOLUTE, 3, 4, 0),  # 0c
+    (ORA, MODE_ABSOLUTE, 3, 4, 0),  # 0d
+    (ASL, MODE_ABSOLUTE, 3, 6, 0),  # 0e
+    (SLO, MODE_ABSOLUTE, 0, 6, 0),  # 0f
+    (BPL, MODE_RELATIVE, 2, 2, 1),  # 10
+    (ORA, MODE_INDIRECT_INDEXED, 2, 5, 1),  # 11
+    (KIL, MODE_IMPLIED, 0, 2, 0),  # 12
+    (SLO, MODE_INDIRECT_INDEXED, 0, 8, 0),  # 13
+    (NOP, MODE_ZEROPAGE_X, 2, 4, 0),  # 14
+    (ORA, MODE_ZEROPAGE_X, 2, 4, 0),  # 15
+    (ASL, MODE_ZEROPAGE_X, 2, 6, 0),  # 16
+    (SLO, MODE_ZEROPAGE_X, 0, 6, 0),  # 17
+    (CLC, MODE_IMPLIED, 1, 2, 0),  # 18
+    (ORA, MODE_ABSOLUTE_Y, 3, 4, 1),  # 19
+    (NOP, MODE_IMPLIED, 1, 2, 0),  # 1a
+    (SLO, MODE_ABSOLUTE_Y, 0, 7, 0),  # 1b
+    (NOP, MODE_ABSOLUTE_X, 3, 4, 1),  # 1c
+    (ORA, MODE_ABSOLUTE_X, 3, 4, 1),  # 1d
+    (ASL, MODE_ABSOLUTE_X, 3, 7, 0),  # 1e
+    (SLO, MODE_ABSOLUTE_X, 0, 7, 0),  # 1f
+    (JSR, MODE_ABSOLUTE, 3, 6, 0),  # 20
+    (AND, MODE_INDEXED_INDIRECT, 2, 6, 0),  # 21
+    (KIL, MODE_IMPLIED, 0, 2, 0),  # 22
+    (RLA, MODE_INDEXED_INDIRECT, 0, 8, 0),  # 23
+    (BIT, MODE_ZEROPAGE, 2, 3, 0),  # 24
+    (AND, MODE_ZEROPAGE, 2, 3, 0),  # 25
+    (ROL, MODE_ZEROPAGE, 2, 5, 0),  # 26
+    (RLA, MODE_ZEROPAGE, 0, 5, 0),  # 27
+    (PLP, MODE_IMPLIED, 1, 4, 0),  # 28
+    (AND, MODE_IMMEDIATE, 2, 2, 0),  # 29
+    (ROL, MODE_ACCUMULATOR, 1, 2, 0),  # 2a
+    (ANC, MODE_IMMEDIATE, 0, 2, 0),  # 2b
+    (BIT, MODE_ABSOLUTE, 3, 4, 0),  # 2c
+    (AND, MODE_ABSOLUTE, 3, 4, 0),  # 2d
+    (ROL, MODE_ABSOLUTE, 3, 6, 0),  # 2e
+    (RLA, MODE_ABSOLUTE, 0, 6, 0),  # 2f
+    (BMI, MODE_RELATIVE, 2, 2, 1),  # 30
+    (AND, MODE_INDIRECT_INDEXED, 2, 5, 1),  # 31
+    (KIL, MODE_IMPLIED, 0, 2, 0),  # 32
+    (RLA, MODE_INDIRECT_INDEXED, 0, 8, 0),  # 33
+    (NOP, MODE_ZEROPAGE_X, 2, 4, 0),  # 34
+    (AND, MODE_ZEROPAGE_X, 2, 4, 0),  # 35
+    (ROL, MODE_ZEROPAGE_X, 2, 6, 0),  # 36
+    (RLA, MODE_ZEROPAGE_X, 0, 6, 0),  # 37
+    (SEC, MODE_IMPLIED, 1, 2, 0),  # 38
+    (AND, MODE_ABSOLUTE_Y, 3, 4, 1),  # 39
+    (NOP, MODE_IMPLIED, 1, 2, 0),  # 3a
+    (RLA, MODE_ABSOLUTE_Y, 0, 7, 0),  # 3b
+    (NOP, MODE_ABSOLUTE_X, 3, 4, 1),  # 3c
+    (AND, MODE_ABSOLUTE_X, 3, 4, 1),  # 3d
+    (ROL, MODE_ABSOLUTE_X, 3, 7, 0),  # 3e
+    (RLA, MODE_ABSOLUTE_X, 0, 7, 0),  # 3f
+    (RTI, MODE_IMPLIED, 1, 6, 0),  # 40
+    (EOR, MODE_INDEXED_INDIRECT, 2, 6, 0),  # 41
+    (KIL, MODE_IMPLIED, 0, 2, 0),  # 42
+    (SRE, MODE_INDEXED_INDIRECT, 0, 8, 0),  # 43
+    (NOP, MODE_ZEROPAGE, 2, 3, 0),  # 44
+    (EOR, MODE_ZEROPAGE, 2, 3, 0),  # 45
+    (LSR, MODE_ZEROPAGE, 2, 5, 0),  # 46
+    (SRE, MODE_ZEROPAGE, 0, 5, 0),  # 47
+    (PHA, MODE_IMPLIED, 1, 3, 0),  # 48
+    (EOR, MODE_IMMEDIATE, 2, 2, 0),  # 49
+    (LSR, MODE_ACCUMULATOR, 1, 2, 0),  # 4a
+    (ALR, MODE_IMMEDIATE, 0, 2, 0),  # 4b
+    (JMP, MODE_ABSOLUTE, 3, 3, 0),  # 4c
+    (EOR, MODE_ABSOLUTE, 3, 4, 0),  # 4d
+    (LSR, MODE_ABSOLUTE, 3, 6, 0),  # 4e
+    (SRE, MODE_ABSOLUTE, 0, 6, 0),  # 4f
+    (BVC, MODE_RELATIVE, 2, 2, 1),  # 50
+    (EOR, MODE_INDIRECT_INDEXED, 2, 5, 1),  # 51
+    (KIL, MODE_IMPLIED, 0, 2, 0),  # 52
+    (SRE, MODE_INDIRECT_INDEXED, 0, 8, 0),  # 53
+    (NOP, MODE_ZEROPAGE_X, 2, 4, 0),  # 54
+    (EOR, MODE_ZEROPAGE_X, 2, 4, 0),  # 55
+    (LSR, MODE_ZEROPAGE_X, 2, 6, 0),  # 56
+    (SRE, MODE_ZEROPAGE_X, 0, 6, 0),  # 57
+    (CLI, MODE_IMPLIED, 1, 2, 0),  # 58
+    (EOR, MODE_ABSOLUTE_Y, 3, 4, 1),  # 59
+    (NOP, MODE_IMPLIED, 1, 2, 0),  # 5a
+    (SRE, MODE_ABSOLUTE_Y, 0, 7, 0),  # 5b
+    (NOP, MODE_ABSOLUTE_X, 3, 4, 1),  # 5c
+    (EOR, MODE_ABSOLUTE_X, 3, 4, 1),  # 5d
+    (LSR, MODE_ABSOLUTE_X, 3, 7, 0),  # 5e
+    (SRE, MODE_ABSOLUTE_X, 0, 7, 0),  # 5f
+    (RTS, MODE_IMPLIED, 1, 6, 0),  # 60
+    (ADC, MODE_INDEXED_INDIRECT, 2, 6, 0),  # 61
+    (KIL, MODE_IMPLIED, 0, 2, 0),  # 62
+    (RRA, MODE_INDEXED_INDIRECT, 0, 8, 0),  # 63
+    (NOP, MODE_ZEROPAGE, 2, 3, 0),  # 64
+    (ADC, MODE_ZEROPAGE, 2, 3, 0),  # 65
+    (ROR, MODE_ZEROPAGE, 2, 5, 0),  # 66
+    (RRA, MODE_ZEROPAGE, 0, 5, 0),  # 67
+    (PLA, MODE_IMPLIED, 1, 4, 0),  # 68
+    (ADC, MODE_IMMEDIATE, 2, 2, 0),  # 69
+    (ROR, MODE_ACCUMULATOR, 1, 2, 0),  # 6a
+    (ARR, MODE_IMMEDIATE, 0, 2, 0),  # 6b
+    (JMP, MODE_INDIRECT, 3, 5, 0),  # 6c
+    (ADC, MODE_ABSOLUTE, 3, 4, 0),  # 6d
+    (ROR, MODE_ABSOLUTE, 3, 6, 0),  # 6e
+    (RRA, MODE_ABSOLUTE, 0, 6, 0),  # 6f
+    (BVS, MODE_RELATIVE, 2, 2, 1),  # 70
+    (ADC, MODE_INDIRECT_INDEXED, 2, 5, 1),  # 71
+    (KIL, MODE_IMPLIED, 0, 2, 0),  # 72
+    (RRA, MODE_INDIRECT_INDEXED, 0, 8, 0),  # 73
+    (NOP, MODE_ZEROPAGE_X, 2, 4, 0),  # 74
+    (ADC, MODE_ZEROPAGE_X, 2, 4, 0),  # 75
+    (ROR, MODE_ZEROPAGE_X, 2, 6, 0),  # 76
+    (RRA, MODE_ZEROPAGE_X, 0, 6, 0),  # 77
+    (SEI, MODE_IMPLIED, 1, 2, 0),  # 78
+    (ADC, MODE_ABSOLUTE_Y, 3, 4, 1),  # 79
+    (NOP, MODE_IMPLIED, 1, 2, 0),  # 7a
+    (RRA, MODE_ABSOLUTE_Y, 0, 7, 0),  # 7b
+    (NOP, MODE_ABSOLUTE_X, 3, 4, 1),  # 7c
+    (ADC, MODE_ABSOLUTE_X, 3, 4, 1),  # 7d
+    (ROR, MODE_ABSOLUTE_X, 3, 7, 0),  # 7e
+    (RRA, MODE_ABSOLUTE_X, 0, 7, 0),  # 7f
+    (NOP, MODE_IMMEDIATE, 2, 2, 0),  # 80
+    (STA, MODE_INDEXED_INDIRECT, 2, 6, 0),  # 81
+    (NOP, MODE_IMMEDIATE, 0, 2, 0),  # 82
+    (SAX, MODE_INDEXED_INDIRECT, 0, 6, 0),  # 83
+    (STY, MODE_ZEROPAGE, 2, 3, 0),  # 84
+    (STA, MODE_ZEROPAGE, 2, 3, 0),  # 85
+    (STX, MODE_ZEROPAGE, 2, 3, 0),  # 86
+    (SAX, MODE_ZEROPAGE, 0, 3, 0),  # 87
+    (DEY, MODE_IMPLIED, 1, 2, 0),  # 88
+    (NOP, MODE_IMMEDIATE, 0, 2, 0),  # 89
+    (TXA, MODE_IMPLIED, 1, 2, 0),  # 8a
+    (XAA, MODE_IMMEDIATE, 0, 2, 0),  # 8b
+    (STY, MODE_ABSOLUTE, 3, 4, 0),  # 8c
+    (STA, MODE_ABSOLUTE, 3, 4, 0),  # 8d
+    (STX, MODE_ABSOLUTE, 3, 4, 0),  # 8e
+    (SAX, MODE_ABSOLUTE, 0, 4, 0),  # 8f
+    (BCC, MODE_RELATIVE, 2, 2, 1),  # 90
+    (STA, MODE_INDIRECT_INDEXED, 2, 6, 0),  # 91
+    (KIL, MODE_IMPLIED, 0, 2, 0),  # 92
+    (AHX, MODE_INDIRECT_INDEXED, 0, 6, 0),  # 93
+    (STY, MODE_ZEROPAGE_X, 2, 4, 0),  # 94
+    (STA, MODE_ZEROPAGE_X, 2, 4, 0),  # 95
+    (STX, MODE_ZEROPAGE_Y, 2, 4, 0),  # 96
+    (SAX, MODE_ZEROPAGE_Y, 0, 4, 0),  # 97
+    (TYA, MODE_IMPLIED, 1, 2, 0),  # 98
+    (STA, MODE_ABSOLUTE_Y, 3, 5, 0),  # 99
+    (TXS, MODE_IMPLIED, 1, 2, 0),  # 9a
+    (TAS, MODE_ABSOLUTE_Y, 0, 5, 0),  # 9b
+    (SHY, MODE_ABSOLUTE_X, 0, 5, 0),  # 9c
+    (STA, MODE_ABSOLUTE_X, 3, 5, 0),  # 9d
+    (SHX, MODE_ABSOLUTE_Y, 0, 5, 0),  # 9e
+    (AHX, MODE_ABSOLUTE_Y, 0, 5, 0),  # 9f
+    (LDY, MODE_IMMEDIATE, 2, 2, 0),  # a0
+    (LDA, MODE_INDEXED_INDIRECT, 2, 6, 0),  # a1
+    (LDX, MODE_IMMEDIATE, 2, 2, 0),  # a2
+    (LAX, MODE_INDEXED_INDIRECT, 0, 6, 0),  # a3
+    (LDY, MODE_ZEROPAGE, 2, 3, 0),  # a4
+    (LDA, MODE_ZEROPAGE, 2, 3, 0),  # a5
+    (LDX, MODE_ZEROPAGE, 2, 3, 0),  # a6
+    (LAX, MODE_ZEROPAGE, 0, 3, 0),  # a7
+    (TAY, MODE_IMPLIED, 1, 2, 0),  # a8
+    (LDA, MODE_IMMEDIATE, 2, 2, 0),  # a9
+    (TAX, MODE_IMPLIED, 1, 2, 0),  # aa
+    (LAX, MODE_IMMEDIATE, 0, 2, 0),  # ab
+    (LDY, MODE_ABSOLUTE, 3, 4, 0),  # ac
+    (LDA, MODE_ABSOLUTE, 3, 4, 0),  # ad
+    (LDX, MODE_ABSOLUTE, 3, 4, 0),  # ae
+    (LAX, MODE_ABSOLUTE, 0, 4, 0),  # af
+    (BCS, MODE_RELATIVE, 2, 2, 1),  # b0
+    (LDA, MODE_INDIRECT_INDEXED, 2, 5, 1),  # b1
+    (KIL, MODE_IMPLIED, 0, 2, 0),  # b2
+    (LAX, MODE_INDIRECT_INDEXED, 0, 5, 1),  # b3
+    (LDY, MODE_ZEROPAGE_X, 2, 4, 0),  # b4
+    (LDA, MODE_ZEROPAGE_X, 2, 4, 0),  # b5
+    (LDX, MODE_ZEROPAGE_Y, 2, 4, 0),  # b6
+    (LAX, MODE_ZEROPAGE_Y, 0, 4, 0),  # b7
+    (CLV, MODE_IMPLIED, 1, 2, 0),  # b8
+    (LDA, MODE_ABSOLUTE_Y, 3, 4, 1),  # b9
+    (TSX, MODE_IMPLIED, 1, 2, 0),  # ba
+    (LAS, MODE_ABSOLUTE_Y, 0, 4, 1),  # bb
+    (LDY, MODE_ABSOLUTE_X, 3, 4, 1),  # bc
+    (LDA, MODE_ABSOLUTE_X, 3, 4, 1),  # bd
+    (LDX, MODE_ABSOLUTE_Y, 3, 4, 1),  # be
+    (LAX, MODE_ABSOLUTE_Y, 0, 4, 1),  # bf
+    (CPY, MODE_IMMEDIATE, 2, 2, 0),  # c0
+    (CMP, MODE_INDEXED_INDIRECT, 2, 6, 0),  # c1
+    (NOP, MODE_IMMEDIATE, 0, 2, 0),  # c2
+    (DCP, MODE_INDEXED_INDIRECT, 0, 8, 0),  # c3
+    (CPY, MODE_ZEROPAGE, 2, 3, 0),  # c4
+    (CMP, MODE_ZEROPAGE, 2, 3, 0),  # c5
+    (DEC, MODE_ZEROPAGE, 2, 5, 0),  # c6
+    (DCP, MODE_ZEROPAGE, 0, 5, 0),  # c7
+    (INY, MODE_IMPLIED, 1, 2, 0),  # c8
+    (CMP, MODE_IMMEDIATE, 2, 2, 0),  # c9
+    (DEX, MODE_IMPLIED, 1, 2, 0),  # ca
+    (AXS, MODE_IMMEDIATE, 0, 2, 0),  # cb
+    (CPY, MODE_ABSOLUTE, 3, 4, 0),  # cc
+    (CMP, MODE_ABSOLUTE, 3, 4, 0),  # cd
+    (DEC, MODE_ABSOLUTE, 3, 6, 0),  # ce
+    (DCP, MODE_ABSOLUTE, 0, 6, 0),  # cf
+    (BNE, MODE_RELATIVE, 2, 2, 1),  # d0
+    (CMP, MODE_INDIRECT_INDEXED, 2, 5, 1),  # d1
+    (KIL, MODE_IMPLIED, 0, 2, 0),  # d2
+    (DCP, MODE_INDIRECT_INDEXED, 0, 8, 0),  # d3
+    (NOP, MODE_ZEROPAGE_X, 2, 4, 0),  # d4
+    (CMP, MODE_ZEROPAGE_X, 2, 4, 0),  # d5
+    (DEC, MODE_ZEROPAGE_X, 2, 6, 0),  # d6
+    (DCP, MODE_ZEROPAGE_X, 0, 6, 0),  # d7
+    (CLD, MODE_IMPLIED, 1, 2, 0),  # d8
+    (CMP, MODE_ABSOLUTE_Y, 3, 4, 1),  # d9
+    (NOP, MODE_IMPLIED, 1, 2, 0),  # da
+    (DCP, MODE_ABSOLUTE_Y, 0, 7, 0),  # db
+    (NOP, MODE_ABSOLUTE_X, 3, 4, 1),  # dc
+    (CMP, MODE_ABSOLUTE_X, 3, 4, 1),  # dd
+    (DEC, MODE_ABSOLUTE_X, 3, 7, 0),  # de
+    (DCP, MODE_ABSOLUTE_X, 0, 7, 0),  # df
+    (CPX, MODE_IMMEDIATE, 2, 2, 0),  # e0
+    (SBC, MODE_INDEXED_INDIRECT, 2, 6, 0),  # e1
+    (NOP, MODE_IMMEDIATE, 0, 2, 0),  # e2
+    (ISC, MODE_INDEXED_INDIRECT, 0, 8, 0),  # e3
+    (CPX, MODE_ZEROPAGE, 2, 3, 0),  # e4
+    (SBC, MODE_ZEROPAGE, 2, 3, 0),  # e5
+    (INC, MODE_ZEROPAGE, 2, 5, 0),  # e6
+    (ISC, MODE_ZEROPAGE, 0, 5, 0),  # e7
+    (INX, MODE_IMPLIED, 1, 2, 0),  # e8
+    (SBC, MODE_IMMEDIATE, 2, 2, 0),  # e9
+    (NOP, MODE_IMPLIED, 1, 2, 0),  # ea
+    (SBC, MODE_IMMEDIATE, 0, 2, 0),  # eb
+    (CPX, MODE_ABSOLUTE, 3, 4, 0),  # ec
+    (SBC, MODE_ABSOLUTE, 3, 4, 0),  # ed
+    (INC, MODE_ABSOLUTE, 3, 6, 0),  # ee
+    (ISC, MODE_ABSOLUTE, 0, 6, 0),  # ef
+    (BEQ, MODE_RELATIVE, 2, 2, 1),  # f0
+    (SBC, MODE_INDIRECT_INDEXED, 2, 5, 1),  # f1
+    (KIL, MODE_IMPLIED, 0, 2, 0),  # f2
+    (ISC, MODE_INDIRECT_INDEXED, 0, 8, 0),  # f3
+    (NOP, MODE_ZEROPAGE_X, 2, 4, 0),  # f4
+    (SBC, MODE_ZEROPAGE_X, 2, 4, 0),  # f5
+    (INC, MODE_ZEROPAGE_X, 2, 6, 0),  # f6
+    (ISC, MODE_ZEROPAGE_X, 0, 6, 0),  # f7
+    (SED, MODE_IMPLIED, 1, 2, 0),  # f8
+    (SBC, MODE_ABSOLUTE_Y, 3, 4, 1),  # f9
+    (NOP, MODE_IMPLIED, 1, 2, 0),  # fa
+    (ISC, MODE_ABSOLUTE_Y, 0, 7, 0),  # fb
+    (NOP, MODE_ABSOLUTE_X, 3, 4, 1),  # fc
+    (SBC, MODE_ABSOLUTE_X, 3, 4, 1),  # fd
+    (INC, MODE_ABSOLUTE_X, 3, 7, 0),  # fe
+    (ISC, MODE_ABSOLUTE_X, 0, 7, 0),  # ff
+)
+# Byte-sized fields of INSTRUCTIONS packed 4 per opcode, so decoding reads
+# them all with one unpack
+OPCODE_TABLE = b"".join(OPCODE_STRUCT.pack(*entry[1:])
+                        for entry in INSTRUCTIONS)
+# Z and N for each byte value, to be or'ed into P. The upper half is the
+# negative differences compares produce, indexed by value & 0x1FF, which
+# count as negative.
+ZN_FLAGS = bytes(((value == 0) << 1) | (value & FLAG_N)
+                 for value in range(256)) + bytes([FLAG_N]) * 256
+SET_ZN = f"cpu.P = (cpu.P & {~(FLAG_Z | FLAG_N) & 0xFF}) | ZN_FLAGS[value]"
+SET_CZN = (f"cpu.P = (cpu.P & {~(FLAG_C | FLAG_Z | FLAG_N) & 0xFF}) | "
+           "({carry}) | ZN_FLAGS[value]")
+# Bodies of the instructions specialize() writes out for each addressing
+# mode, with the operand as {src}, a line storing value back to it as
+# {store} and the resolved address in address
+SPECIALIZED_SOURCE = {
+    JMP: ["cpu.PC = address", "cpu.jumped = True"],
+    LDA: ["value = {src}", "cpu.A = value", SET_ZN],
+    LDX: ["value = {src}", "cpu.X = value", SET_ZN],
+    LDY: ["value = {src}", "cpu.Y = value", SET_ZN],
+    AND: ["value = cpu.A & {src}", "cpu.A = value", SET_ZN],
+    ORA: ["value = cpu.A | {src}", "cpu.A = value", SET_ZN],
+    EOR: ["value = cpu.A ^ {src}", "cpu.A = value", SET_ZN],
+    ADC: ["cpu.add_with_carry({src})"],
+    SBC: ["cpu.add_with_carry({src} ^ 0xFF)"],
+    CMP: ["src = {src}",
+          f"cpu.P = (cpu.P & {~(FLAG_C | FLAG_Z | FLAG_N) & 0xFF}) | "
+          "(cpu.A >= src) | ZN_FLAGS[(cpu.A - src) & 0x1FF]"],
+    CPX: ["src = {src}",
+          f"cpu.P = (cpu.P & {~(FLAG_C | FLAG_Z | FLAG_N) & 0xFF}) | "
+          "(cpu.X >= src) | ZN_FLAGS[(cpu.X - src) & 0x1FF]"],
+    CPY: ["src = {src}",
+          f"cpu.P = (cpu.P & {~(FLAG_C | FLAG_Z | FLAG_N) & 0xFF}) | "
+          "(cpu.Y >= src) | ZN_FLAGS[(cpu.Y - src) & 0x1FF]"],
+    BIT: ["src = {src}",
+          f"cpu.P = (cpu.P & {~(FLAG_Z | FLAG_V | FLAG_N) & 0xFF}) | "
+          f"(src & {FLAG_V | FLAG_N}) | (((src & cpu.A) == 0) << 1)"],
+    STA: ["value = cpu.A", "{store}"],
+    STX: ["value = cpu.X", "{store}"],
+    STY: ["value = cpu.Y", "{store}"],
+    INC: ["value = ({src} + 1) & 0xFF", "{store}", SET_ZN],
+    DEC: ["value = ({src} - 1) & 0xFF", "{store}", SET_ZN],
+    ASL: ["src = {src}", "value = (src << 1) & 0xFF",
+          SET_CZN.format(carry="src >> 7"), "{store}"],
+    LSR: ["src = {src}", "value = src >> 1",
+          SET_CZN.format(carry="src & 1"), "{store}"],
+    ROL: ["src = {src}", f"value = ((src << 1) | (cpu.P & {FLAG_C})) & 0xFF",
+          SET_CZN.format(carry="src >> 7"), "{store}"],
+    ROR: ["src = {src}", f"value = (src >> 1) | ((cpu.P & {FLAG_C}) << 7)",
+          SET_CZN.format(carry="src & 1"), "{store}"],
+}
+# Lines working out address for each addressing mode that reads or writes
+# memory
+ADDRESS_SOURCE = {
+    MODE_ZEROPAGE: ["address = data"],
+    MODE_ZEROPAGE_X: ["address = (data + cpu.X) & 0xFF"],
+    MODE_ZEROPAGE_Y: ["address = (data + cpu.Y) & 0xFF"],
+    MODE_ABSOLUTE: ["address = data"],
+    MODE_ABSOLUTE_X: ["address = (data + cpu.X) & 0xFFFF"],
+    MODE_ABSOLUTE_Y: ["address = (data + cpu.Y) & 0xFFFF"],
+    MODE_INDEXED_INDIRECT: ["address = ram[(data + cpu.X) & 0xFF] | "
+                            "(ram[(data + cpu.X + 1) & 0xFF] << 8)"],
+    MODE_INDIRECT_INDEXED: ["base = ram[data & 0xFF] | "
+                            "(ram[(data + 1) & 0xFF] << 8)",
+                            "address = (base + cpu.Y) & 0xFFFF"],
+    MODE_INDIRECT: ["address = cpu.address_indirect(data)"],
+}
+# Indexed modes note when they cross a page, which can cost a tick, by
+# comparing against the address before indexing
+PAGE_BASES = {MODE_ABSOLUTE_X: "data", MODE_ABSOLUTE_Y: "data",
+              MODE_INDIRECT_INDEXED: "base"}
+ZEROPAGE_MODES = frozenset({MODE_ZEROPAGE, MODE_ZEROPAGE_X, MODE_ZEROPAGE_Y})
+
+
+# Source of a function taking the opcode's data and running it with its
+# addressing mode filled in, or None when the opcode has no template. RAM,
+# including the zero page, is read and written without read_memory.
+def specialized_source(opcode: int) -> str | None:
+    instruction_type, mode, _, _, page_ticks = INSTRUCTIONS[opcode]
+    lines = SPECIALIZED_SOURCE.get(instruction_type)
+    if lines is None:
+        return None
+    prefix = []
+    if mode == MODE_IMMEDIATE:
+        src, store = "data", None
+    elif mode == MODE_ACCUMULATOR:
+        src, store = "cpu.A", ["cpu.A = value"]
+    elif mode in ZEROPAGE_MODES:
+        prefix = ADDRESS_SOURCE[mode]
+        src, store = "ram[address]", ["ram[address] = value"]
+    elif mode in ADDRESS_SOURCE:
+        prefix = ADDRESS_SOURCE[mode]
+        if page_ticks and mode in PAGE_BASES:
+            prefix = prefix + [f"cpu.page_crossed = (address & 0xFF00) != "
+                               f"({PAGE_BASES[mode]} & 0xFF00)"]
+        src = (f"(ram[address & 0x7FF] if address < 0x2000 else "
+               f"cpu.read_memory(address, {MODE_ABSOLUTE}))")
+        store = ["if address < 0x2000:", "    ram[address & 0x7FF] = value",
+                 "else:",
+                 f"    cpu.write_memory(address, {MODE_ABSOLUTE}, value)"]
+    else:
+        return None
+    body = []
+    for line in lines:
+        if line == "{store}":
+            if store is None:
+                return None
+            body += store
+        else:
+            body.append(line.format(src=src))
+    return "\n".join([f"def opcode_{opcode:02X}(data):"] +
+                     ["    " + line for line in prefix + body])
+
+
+# Specialized opcodes compiled once at import, and run for each CPU with
+# that CPU's globals
+SPECIALIZED_CODE = {
+    opcode: compile(source, f"<opcode {opcode:02X}>", "exec")
+    for opcode, source in enumerate(map(specialized_source, range(256)))
+    if source is not None}
+
+
+def add_flags(a: int, src: int, carry: int) -> int:
+    total = a + src + carry
+    result = total & 0xFF
+    return (total >> 8) | ((~(a ^ src) & (a ^ total) & 0x80) >> 1) | (
+        (result == 0) << 1) | (result & FLAG_N)
+
+
+# A + src + carry and the C, Z, V and N flags it sets, for every input,
+# indexed by (A << 9) | (src << 1) | carry
+ADD_RESULTS = bytes((a + src + carry) & 0xFF for a in range(256)
+                    for src in range(256) for carry in (0, 1))
+ADD_FLAGS = bytes(add_flags(a, src, carry) for a in range(256)
+                  for src in range(256) for carry in (0, 1))
 
 
 class CPU:
-    def __init__(self, ppu: PPU, rom: ROM):
+    def __init__(self, ppu: PPU, rom: ROM, jit: bool = False):
         # Connections to Other Parts of the Console
         self.ppu: PPU = ppu
         self.rom: ROM = rom
+        # Bound once, as games poll the PPU registers in tight loops
+        self.ppu_read_register = ppu.read_register
         # Memory on the CPU
-        self.ram = array('B', [0] * MEM_SIZE)
+        self.ram = bytearray(MEM_SIZE)
+        # Last cartridge page read from, (address & 0xE000, memory, mask)
+        self.tlb_tag: int = -1
+        self.tlb_memory = None
+        self.tlb_mask: int = 0
         # Registers
         self.A: int = 0
         self.X: int = 0
         self.Y: int = 0
         self.SP: int = STACK_POINTER_RESET
-        self.PC: int = self.read_memory(RESET_VECTOR, MemMode.ABSOLUTE) | \
+        self.PC: int = self.read_memory(RESET_VECTOR, MODE_ABSOLUTE) | \
                        (self.read_memory(RESET_VECTOR + 1,
-                                         MemMode.ABSOLUTE) << 8)
-        # Flags
-        self.C: bool = False  # Carry
-        self.Z: bool = False  # Zero
-        self.I: bool = True  # Interrupt Disable
-        self.D: bool = False  # Decimal Mode
-        self.B: bool = False  # Break Command
-        self.V: bool = False  # oVerflow
-        self.N: bool = False  # Negative
+                                         MODE_ABSOLUTE) << 8)
+        # Flags, packed like the status register but without B and bit 5
+        self.P: int = FLAG_I
+        # Address resolvers indexed by addressing mode
+        self.address_by_mode = [
+            self.address_none, self.address_absolute, self.address_absolute_x,
+            self.address_absolute_y, self.address_none, self.address_none,
+            self.address_none, self.address_indexed_indirect,
+            self.address_indirect, self.address_indirect_indexed,
+            self.address_relative, self.address_absolute,
+            self.address_zeropage_x, self.address_zeropage_y]
         # Miscellaneous State
         self.jumped: bool = False
         self.page_crossed: bool = False
         self.cpu_ticks: int = 0
         self.stall: int = 0  # Number of cycles to stall
-        self.joypad1 = Joypad()
-
-        self.instructions = [
-            Instruction(InstructionType.BRK, self.BRK, MemMode.IMPLIED, 1, 7, 0),  # 00
-            Instruction(InstructionType.ORA, self.ORA, MemMode.INDEXED_INDIRECT, 2, 6, 0),
-            Instruction(InstructionType.KIL, self.unimplemented, MemMode.IMPLIED, 0, 2, 0),
-            Instruction(InstructionType.SLO, self.unimplemented, MemMode.INDEXED_INDIRECT, 0, 8, 0),
-            Instruction(InstructionType.NOP, self.NOP, MemMode.ZEROPAGE, 2, 3, 0),  # 04
-            Instruction(InstructionType.ORA, self.ORA, MemMode.ZEROPAGE, 2, 3, 0),  # 05
-            Instruction(InstructionType.ASL, self.ASL, MemMode.ZEROPAGE, 2, 5, 0),  # 06
-            Instruction(InstructionType.SLO, self.unimplemented, MemMode.ZEROPAGE, 0, 5, 0),
-            Instruction(InstructionType.PHP, self.PHP, MemMode.IMPLIED, 1, 3, 0),  # 08
-            Instruction(InstructionType.ORA, self.ORA, MemMode.IMMEDIATE, 2, 2, 0),  # 09
-            Instruction(InstructionType.ASL, self.ASL, MemMode.ACCUMULATOR, 1, 2, 0),  # 0a
-            Instruction(InstructionType.ANC, self.unimplemented, MemMode.IMMEDIATE, 0, 2, 0),
-            Instruction(InstructionType.NOP, self.NOP, MemMode.ABSOLUTE, 3, 4, 0),  # 0c
-            Instruction(InstructionType.ORA, self.ORA, MemMode.ABSOLUTE, 3, 4, 0),  # 0d
-            Instruction(InstructionType.ASL, self.ASL, MemMode.ABSOLUTE, 3, 6, 0),  # 0e
-            Instruction(InstructionType.SLO, self.unimplemented, MemMode.ABSOLUTE, 0, 6, 0),
-            Instruction(InstructionType.BPL, self.BPL, MemMode.RELATIVE, 2, 2, 1),  # 10
-            Instruction(InstructionType.ORA, self.ORA, MemMode.INDIRECT_INDEXED, 2, 5, 1),
-            Instruction(InstructionType.KIL, self.unimplemented, MemMode.IMPLIED, 0, 2, 0),
-            Instruction(InstructionType.SLO, self.unimplemented, MemMode.INDIRECT_INDEXED, 0, 8, 0),
-            Instruction(InstructionType.NOP, self.NOP, MemMode.ZEROPAGE_X, 2, 4, 0),  # 14
-            Instruction(InstructionType.ORA, self.ORA, MemMode.ZEROPAGE_X, 2, 4, 0),  # 15
-            Instruction(InstructionType.ASL, self.ASL, MemMode.ZEROPAGE_X, 2, 6, 0),  # 16
-            Instruction(InstructionType.SLO, self.unimplemented, MemMode.ZEROPAGE_X, 0, 6, 0),
-            Instruction(InstructionType.CLC, self.CLC, MemMode.IMPLIED, 1, 2, 0),  # 18
-            Instruction(InstructionType.ORA, self.ORA, MemMode.ABSOLUTE_Y, 3, 4, 1),  # 19
-            Instruction(InstructionType.NOP, self.NOP, MemMode.IMPLIED, 1, 2, 0),  # 1a
-            Instruction(InstructionType.SLO, self.unimplemented, MemMode.ABSOLUTE_Y, 0, 7, 0),
-            Instruction(InstructionType.NOP, self.NOP, MemMode.ABSOLUTE_X, 3, 4, 1),  # 1c
-            Instruction(InstructionType.ORA, self.ORA, MemMode.ABSOLUTE_X, 3, 4, 1),  # 1d
-            Instruction(InstructionType.ASL, self.ASL, MemMode.ABSOLUTE_X, 3, 7, 0),  # 1e
-            Instruction(InstructionType.SLO, self.unimplemented, MemMode.ABSOLUTE_X, 0, 7, 0),
-            Instruction(InstructionType.JSR, self.JSR, MemMode.ABSOLUTE, 3, 6, 0),  # 20
-            Instruction(InstructionType.AND, self.AND, MemMode.INDEXED_INDIRECT, 2, 6, 0),
-            Instruction(InstructionType.KIL, self.unimplemented, MemMode.IMPLIED, 0, 2, 0),
-            Instruction(InstructionType.RLA, self.unimplemented, MemMode.INDEXED_INDIRECT, 0, 8, 0),
-            Instruction(InstructionType.BIT, self.BIT, MemMode.ZEROPAGE, 2, 3, 0),  # 24
-            Instruction(InstructionType.AND, self.AND, MemMode.ZEROPAGE, 2, 3, 0),  # 25
-            Instruction(InstructionType.ROL, self.ROL, MemMode.ZEROPAGE, 2, 5, 0),  # 26
-            Instruction(InstructionType.RLA, self.unimplemented, MemMode.ZEROPAGE, 0, 5, 0),
-            Instruction(InstructionType.PLP, self.PLP, MemMode.IMPLIED, 1, 4, 0),  # 28
-            Instruction(InstructionType.AND, self.AND, MemMode.IMMEDIATE, 2, 2, 0),  # 29
-            Instruction(InstructionType.ROL, self.ROL, MemMode.ACCUMULATOR, 1, 2, 0),  # 2a
-            Instruction(InstructionType.ANC, self.unimplemented, MemMode.IMMEDIATE, 0, 2, 0),
-            Instruction(InstructionType.BIT, self.BIT, MemMode.ABSOLUTE, 3, 4, 0),  # 2c
-            Instruction(InstructionType.AND, self.AND, MemMode.ABSOLUTE, 3, 4, 0),  # 2d
-            Instruction(InstructionType.ROL, self.ROL, MemMode.ABSOLUTE, 3, 6, 0),  # 2e
-            Instruction(InstructionType.RLA, self.unimplemented, MemMode.ABSOLUTE, 0, 6, 0),
-            Instruction(InstructionType.BMI, self.BMI, MemMode.RELATIVE, 2, 2, 1),  # 30
-            Instruction(InstructionType.AND, self.AND, MemMode.INDIRECT_INDEXED, 2, 5, 1),
-            Instruction(InstructionType.KIL, self.unimplemented, MemMode.IMPLIED, 0, 2, 0),
-            Instruction(InstructionType.RLA, self.unimplemented, MemMode.INDIRECT_INDEXED, 0, 8, 0),
-            Instruction(InstructionType.NOP, self.NOP, MemMode.ZEROPAGE_X, 2, 4, 0),  # 34
-            Instruction(InstructionType.AND, self.AND, MemMode.ZEROPAGE_X, 2, 4, 0),  # 35
-            Instruction(InstructionType.ROL, self.ROL, MemMode.ZEROPAGE_X, 2, 6, 0),  # 36
-            Instruction(InstructionType.RLA, self.unimplemented, MemMode.ZEROPAGE_X, 0, 6, 0),
-            Instruction(InstructionType.SEC, self.SEC, MemMode.IMPLIED, 1, 2, 0),  # 38
-            Instruction(InstructionType.AND, self.AND, MemMode.ABSOLUTE_Y, 3, 4, 1),  # 39
-            Instruction(InstructionType.NOP, self.NOP, MemMode.IMPLIED, 1, 2, 0),  # 3a
-            Instruction(InstructionType.RLA, self.unimplemented, MemMode.ABSOLUTE_Y, 0, 7, 0),
-            Instruction(InstructionType.NOP, self.NOP, MemMode.ABSOLUTE_X, 3, 4, 1),  # 3c
-            Instruction(InstructionType.AND, self.AND, MemMode.ABSOLUTE_X, 3, 4, 1),  # 3d
-            Instruction(InstructionType.ROL, self.ROL, MemMode.ABSOLUTE_X, 3, 7, 0),  # 3e
-            Instruction(InstructionType.RLA, self.unimplemented, MemMode.ABSOLUTE_X, 0, 7, 0),
-            Instruction(InstructionType.RTI, self.RTI, MemMode.IMPLIED, 1, 6, 0),  # 40
-            Instruction(InstructionType.EOR, self.EOR, MemMode.INDEXED_INDIRECT, 2, 6, 0),
-            Instruction(InstructionType.KIL, self.unimplemented, MemMode.IMPLIED, 0, 2, 0),
-            Instruction(InstructionType.SRE, self.unimplemented, MemMode.INDEXED_INDIRECT, 0, 8, 0),
-            Instruction(InstructionType.NOP, self.NOP, MemMode.ZEROPAGE, 2, 3, 0),  # 44
-            Instruction(InstructionType.EOR, self.EOR, MemMode.ZEROPAGE, 2, 3, 0),  # 45
-            Instruction(InstructionType.LSR, self.LSR, MemMode.ZEROPAGE, 2, 5, 0),  # 46
-            Instruction(InstructionType.SRE, self.unimplemented, MemMode.ZEROPAGE, 0, 5, 0),
-            Instruction(InstructionType.PHA, self.PHA, MemMode.IMPLIED, 1, 3, 0),  # 48
-            Instruction(InstructionType.EOR, self.EOR, MemMode.IMMEDIATE, 2, 2, 0),  # 49
-            Instruction(InstructionType.LSR, self.LSR, MemMode.ACCUMULATOR, 1, 2, 0),
-            Instruction(InstructionType.ALR, self.unimplemented, MemMode.IMMEDIATE, 0, 2, 0),
-            Instruction(InstructionType.JMP, self.JMP, MemMode.ABSOLUTE, 3, 3, 0),  # 4c
-            Instruction(InstructionType.EOR, self.EOR, MemMode.ABSOLUTE, 3, 4, 0),  # 4d
-            Instruction(InstructionType.LSR, self.LSR, MemMode.ABSOLUTE, 3, 6, 0),  # 4e
-            Instruction(InstructionType.SRE, self.unimplemented, MemMode.ABSOLUTE, 0, 6, 0),
-            Instruction(InstructionType.BVC, self.BVC, MemMode.RELATIVE, 2, 2, 1),  # 50
-            Instruction(InstructionType.EOR, self.EOR, MemMode.INDIRECT_INDEXED, 2, 5, 1),
-            Instruction(InstructionType.KIL, self.unimplemented, MemMode.IMPLIED, 0, 2, 0),
-            Instruction(InstructionType.SRE, self.unimplemented, MemMode.INDIRECT_INDEXED, 0, 8, 0),
-            Instruction(InstructionType.NOP, self.NOP, MemMode.ZEROPAGE_X, 2, 4, 0),  # 54
-            Instruction(InstructionType.EOR, self.EOR, MemMode.ZEROPAGE_X, 2, 4, 0),  # 55
-            Instruction(InstructionType.LSR, self.LSR, MemMode.ZEROPAGE_X, 2, 6, 0),  # 56
-            Instruction(InstructionType.SRE, self.unimplemented, MemMode.ZEROPAGE_X, 0, 6, 0),
-            Instruction(InstructionType.CLI, self.CLI, MemMode.IMPLIED, 1, 2, 0),  # 58
-            Instruction(InstructionType.EOR, self.EOR, MemMode.ABSOLUTE_Y, 3, 4, 1),  # 59
-            Instruction(InstructionType.NOP, self.NOP, MemMode.IMPLIED, 1, 2, 0),  # 5a
-            Instruction(InstructionType.SRE, self.unimplemented, MemMode.ABSOLUTE_Y, 0, 7, 0),
-            Instruction(InstructionType.NOP, self.NOP, MemMode.ABSOLUTE_X, 3, 4, 1),  # 5c
-            Instruction(InstructionType.EOR, self.EOR, MemMode.ABSOLUTE_X, 3, 4, 1),  # 5d
-            Instruction(InstructionType.LSR, self.LSR, MemMode.ABSOLUTE_X, 3, 7, 0),  # 5e
-            Instruction(InstructionType.SRE, self.unimplemented, MemMode.ABSOLUTE_X, 0, 7, 0),
-            Instruction(InstructionType.RTS, self.RTS, MemMode.IMPLIED, 1, 6, 0),  # 60
-            Instruction(InstructionType.ADC, self.ADC, MemMode.INDEXED_INDIRECT, 2, 6, 0),
-            Instruction(InstructionType.KIL, self.unimplemented, MemMode.IMPLIED, 0, 2, 0),
-            Instruction(InstructionType.RRA, self.unimplemented, MemMode.INDEXED_INDIRECT, 0, 8, 0),
-            Instruction(InstructionType.NOP, self.NOP, MemMode.ZEROPAGE, 2, 3, 0),  # 64
-            Instruction(InstructionType.ADC, self.ADC, MemMode.ZEROPAGE, 2, 3, 0),  # 65
-            Instruction(InstructionType.ROR, self.ROR, MemMode.ZEROPAGE, 2, 5, 0),  # 66
-            Instruction(InstructionType.RRA, self.unimplemented, MemMode.ZEROPAGE, 0, 5, 0),
-            Instruction(InstructionType.PLA, self.PLA, MemMode.IMPLIED, 1, 4, 0),  # 68
-            Instruction(InstructionType.ADC, self.ADC, MemMode.IMMEDIATE, 2, 2, 0),  # 69
-            Instruction(InstructionType.ROR, self.ROR, MemMode.ACCUMULATOR, 1, 2, 0),  # 6a
-            Instruction(InstructionType.ARR, self.unimplemented, MemMode.IMMEDIATE, 0, 2, 0),
-            Instruction(InstructionType.JMP, self.JMP, MemMode.INDIRECT, 3, 5, 0),  # 6c
-            Instruction(InstructionType.ADC, self.ADC, MemMode.ABSOLUTE, 3, 4, 0),  # 6d
-            Instruction(InstructionType.ROR, self.ROR, MemMode.ABSOLUTE, 3, 6, 0),  # 6e
-            Instruction(InstructionType.RRA, self.unimplemented, MemMode.ABSOLUTE, 0, 6, 0),
-            Instruction(InstructionType.BVS, self.BVS, MemMode.RELATIVE, 2, 2, 1),  # 70
-            Instruction(InstructionType.ADC, self.ADC, MemMode.INDIRECT_INDEXED, 2, 5, 1),
-            Instruction(InstructionType.KIL, self.unimplemented, MemMode.IMPLIED, 0, 2, 0),
-            Instruction(InstructionType.RRA, self.unimplemented, MemMode.INDIRECT_INDEXED, 0, 8, 0),
-            Instruction(InstructionType.NOP, self.NOP, MemMode.ZEROPAGE_X, 2, 4, 0),  # 74
-            Instruction(InstructionType.ADC, self.ADC, MemMode.ZEROPAGE_X, 2, 4, 0),  # 75
-            Instruction(InstructionType.ROR, self.ROR, MemMode.ZEROPAGE_X, 2, 6, 0),  # 76
-            Instruction(InstructionType.RRA, self.unimplemented, MemMode.ZEROPAGE_X, 0, 6, 0),
-            Instruction(InstructionType.SEI, self.SEI, MemMode.IMPLIED, 1, 2, 0),  # 78
-            Instruction(InstructionType.ADC, self.ADC, MemMode.ABSOLUTE_Y, 3, 4, 1),  # 79
-            Instruction(InstructionType.NOP, self.NOP, MemMode.IMPLIED, 1, 2, 0),  # 7a
-            Instruction(InstructionType.RRA, self.unimplemented, MemMode.ABSOLUTE_Y, 0, 7, 0),
-            Instruction(InstructionType.NOP, self.NOP, MemMode.ABSOLUTE_X, 3, 4, 1),  # 7c
-            Instruction(InstructionType.ADC, self.ADC, MemMode.ABSOLUTE_X, 3, 4, 1),  # 7d
-            Instruction(InstructionType.ROR, self.ROR, MemMode.ABSOLUTE_X, 3, 7, 0),  # 7e
-            Instruction(InstructionType.RRA, self.unimplemented, MemMode.ABSOLUTE_X, 0, 7, 0),
-            Instruction(InstructionType.NOP, self.NOP, MemMode.IMMEDIATE, 2, 2, 0),  # 80
-            Instruction(InstructionType.STA, self.STA, MemMode.INDEXED_INDIRECT, 2, 6, 0),
-            Instruction(InstructionType.NOP, self.NOP, MemMode.IMMEDIATE, 0, 2, 0),  # 82
-            Instruction(InstructionType.SAX, self.unimplemented, MemMode.INDEXED_INDIRECT, 0, 6, 0),
-            Instruction(InstructionType.STY, self.STY, MemMode.ZEROPAGE, 2, 3, 0),  # 84
-            Instruction(InstructionType.STA, self.STA, MemMode.ZEROPAGE, 2, 3, 0),  # 85
-            Instruction(InstructionType.STX, self.STX, MemMode.ZEROPAGE, 2, 3, 0),  # 86
-            Instruction(InstructionType.SAX, self.unimplemented, MemMode.ZEROPAGE, 0, 3, 0),
-            Instruction(InstructionType.DEY, self.DEY, MemMode.IMPLIED, 1, 2, 0),  # 88
-            Instruction(InstructionType.NOP, self.NOP, MemMode.IMMEDIATE, 0, 2, 0),  # 89
-            Instruction(InstructionType.TXA, self.TXA, MemMode.IMPLIED, 1, 2, 0),  # 8a
-            Instruction(InstructionType.XAA, self.unimplemented, MemMode.IMMEDIATE, 0, 2, 0),
-            Instruction(InstructionType.STY, self.STY, MemMode.ABSOLUTE, 3, 4, 0),  # 8c
-            Instruction(InstructionType.STA, self.STA, MemMode.ABSOLUTE, 3, 4, 0),  # 8d
-            Instruction(InstructionType.STX, self.STX, MemMode.ABSOLUTE, 3, 4, 0),  # 8e
-            Instruction(InstructionType.SAX, self.unimplemented, MemMode.ABSOLUTE, 0, 4, 0),
-            Instruction(InstructionType.BCC, self.BCC, MemMode.RELATIVE, 2, 2, 1),  # 90
-            Instruction(InstructionType.STA, self.STA, MemMode.INDIRECT_INDEXED, 2, 6, 0),
-            Instruction(InstructionType.KIL, self.unimplemented, MemMode.IMPLIED, 0, 2, 0),
-            Instruction(InstructionType.AHX, self.unimplemented, MemMode.INDIRECT_INDEXED, 0, 6, 0),
-            Instruction(InstructionType.STY, self.STY, MemMode.ZEROPAGE_X, 2, 4, 0),  # 94
-            Instruction(InstructionType.STA, self.STA, MemMode.ZEROPAGE_X, 2, 4, 0),  # 95
-            Instruction(InstructionType.STX, self.STX, MemMode.ZEROPAGE_Y, 2, 4, 0),  # 96
-            Instruction(InstructionType.SAX, self.unimplemented, MemMode.ZEROPAGE_Y, 0, 4, 0),
-            Instruction(InstructionType.TYA, self.TYA, MemMode.IMPLIED, 1, 2, 0),  # 98
-            Instruction(InstructionType.STA, self.STA, MemMode.ABSOLUTE_Y, 3, 5, 0),  # 99
-            Instruction(InstructionType.TXS, self.TXS, MemMode.IMPLIED, 1, 2, 0),  # 9a
-            Instruction(InstructionType.TAS, self.unimplemented, MemMode.ABSOLUTE_Y, 0, 5, 0),
-            Instruction(InstructionType.SHY, self.unimplemented, MemMode.ABSOLUTE_X, 0, 5, 0),
-            Instruction(InstructionType.STA, self.STA, MemMode.ABSOLUTE_X, 3, 5, 0),  # 9d
-            Instruction(InstructionType.SHX, self.unimplemented, MemMode.ABSOLUTE_Y, 0, 5, 0),
-            Instruction(InstructionType.AHX, self.unimplemented, MemMode.ABSOLUTE_Y, 0, 5, 0),
-            Instruction(InstructionType.LDY, self.LDY, MemMode.IMMEDIATE, 2, 2, 0),  # a0
-            Instruction(InstructionType.LDA, self.LDA, MemMode.INDEXED_INDIRECT, 2, 6, 0),
-            Instruction(InstructionType.LDX, self.LDX, MemMode.IMMEDIATE, 2, 2, 0),  # a2
-            Instruction(InstructionType.LAX, self.unimplemented, MemMode.INDEXED_INDIRECT, 0, 6, 0),
-            Instruction(InstructionType.LDY, self.LDY, MemMode.ZEROPAGE, 2, 3, 0),  # a4
-            Instruction(InstructionType.LDA, self.LDA, MemMode.ZEROPAGE, 2, 3, 0),  # a5
-            Instruction(InstructionType.LDX, self.LDX, MemMode.ZEROPAGE, 2, 3, 0),  # a6
-            Instruction(InstructionType.LAX, self.unimplemented, MemMode.ZEROPAGE, 0, 3, 0),
-            Instruction(InstructionType.TAY, self.TAY, MemMode.IMPLIED, 1, 2, 0),  # a8
-            Instruction(InstructionType.LDA, self.LDA, MemMode.IMMEDIATE, 2, 2, 0),  # a9
-            Instruction(InstructionType.TAX, self.TAX, MemMode.IMPLIED, 1, 2, 0),  # aa
-            Instruction(InstructionType.LAX, self.unimplemented, MemMode.IMMEDIATE, 0, 2, 0),
-            Instruction(InstructionType.LDY, self.LDY, MemMode.ABSOLUTE, 3, 4, 0),  # ac
-            Instruction(InstructionType.LDA, self.LDA, MemMode.ABSOLUTE, 3, 4, 0),  # ad
-            Instruction(InstructionType.LDX, self.LDX, MemMode.ABSOLUTE, 3, 4, 0),  # ae
-            Instruction(InstructionType.LAX, self.unimplemented, MemMode.ABSOLUTE, 0, 4, 0),
-            Instruction(InstructionType.BCS, self.BCS, MemMode.RELATIVE, 2, 2, 1),  # b0
-            Instruction(InstructionType.LDA, self.LDA, MemMode.INDIRECT_INDEXED, 2, 5, 1),
-            Instruction(InstructionType.KIL, self.unimplemented, MemMode.IMPLIED, 0, 2, 0),
-            Instruction(InstructionType.LAX, self.unimplemented, MemMode.INDIRECT_INDEXED, 0, 5, 1),
-            Instruction(InstructionType.LDY, self.LDY, MemMode.ZEROPAGE_X, 2, 4, 0),  # b4
-            Instruction(InstructionType.LDA, self.LDA, MemMode.ZEROPAGE_X, 2, 4, 0),  # b5
-            Instruction(InstructionType.LDX, self.LDX, MemMode.ZEROPAGE_Y, 2, 4, 0),  # b6
-            Instruction(InstructionType.LAX, self.unimplemented, MemMode.ZEROPAGE_Y, 0, 4, 0),
-            Instruction(InstructionType.CLV, self.CLV, MemMode.IMPLIED, 1, 2, 0),  # b8
-            Instruction(InstructionType.LDA, self.LDA, MemMode.ABSOLUTE_Y, 3, 4, 1),  # b9
-            Instruction(InstructionType.TSX, self.TSX, MemMode.IMPLIED, 1, 2, 0),  # ba
-            Instruction(InstructionType.LAS, self.unimplemented, MemMode.ABSOLUTE_Y, 0, 4, 1),
-            Instruction(InstructionType.LDY, self.LDY, MemMode.ABSOLUTE_X, 3, 4, 1),  # bc
-            Instruction(InstructionType.LDA, self.LDA, MemMode.ABSOLUTE_X, 3, 4, 1),  # bd
-            Instruction(InstructionType.LDX, self.LDX, MemMode.ABSOLUTE_Y, 3, 4, 1),  # be
-            Instruction(InstructionType.LAX, self.unimplemented, MemMode.ABSOLUTE_Y, 0, 4, 1),
-            Instruction(InstructionType.CPY, self.CPY, MemMode.IMMEDIATE, 2, 2, 0),  # c0
-            Instruction(InstructionType.CMP, self.CMP, MemMode.INDEXED_INDIRECT, 2, 6, 0),
-            Instruction(InstructionType.NOP, self.NOP, MemMode.IMMEDIATE, 0, 2, 0),  # c2
-            Instruction(InstructionType.DCP, self.unimplemented, MemMode.INDEXED_INDIRECT, 0, 8, 0),
-            Instruction(InstructionType.CPY, self.CPY, MemMode.ZEROPAGE, 2, 3, 0),  # c4
-            Instruction(InstructionType.CMP, self.CMP, MemMode.ZEROPAGE, 2, 3, 0),  # c5
-            Instruction(InstructionType.DEC, self.DEC, MemMode.ZEROPAGE, 2, 5, 0),  # c6
-            Instruction(InstructionType.DCP, self.unimplemented, MemMode.ZEROPAGE, 0, 5, 0),
-            Instruction(InstructionType.INY, self.INY, MemMode.IMPLIED, 1, 2, 0),  # c8
-            Instruction(InstructionType.CMP, self.CMP, MemMode.IMMEDIATE, 2, 2, 0),  # c9
-            Instruction(InstructionType.DEX, self.DEX, MemMode.IMPLIED, 1, 2, 0),  # ca
-            Instruction(InstructionType.AXS, self.unimplemented, MemMode.IMMEDIATE, 0, 2, 0),
-            Instruction(InstructionType.CPY, self.CPY, MemMode.ABSOLUTE, 3, 4, 0),  # cc
-            Instruction(InstructionType.CMP, self.CMP, MemMode.ABSOLUTE, 3, 4, 0),  # cd
-            Instruction(InstructionType.DEC, self.DEC, MemMode.ABSOLUTE, 3, 6, 0),  # ce
-            Instruction(InstructionType.DCP, self.unimplemented, MemMode.ABSOLUTE, 0, 6, 0),
-            Instruction(InstructionType.BNE, self.BNE, MemMode.RELATIVE, 2, 2, 1),  # d0
-            Instruction(InstructionType.CMP, self.CMP, MemMode.INDIRECT_INDEXED, 2, 5, 1),
-            Instruction(InstructionType.KIL, self.unimplemented, MemMode.IMPLIED, 0, 2, 0),
-            Instruction(InstructionType.DCP, self.unimplemented, MemMode.INDIRECT_INDEXED, 0, 8, 0),
-            Instruction(InstructionType.NOP, self.NOP, MemMode.ZEROPAGE_X, 2, 4, 0),  # d4
-            Instruction(InstructionType.CMP, self.CMP, MemMode.ZEROPAGE_X, 2, 4, 0),  # d5
-            Instruction(InstructionType.DEC, self.DEC, MemMode.ZEROPAGE_X, 2, 6, 0),  # d6
-            Instruction(InstructionType.DCP, self.unimplemented, MemMode.ZEROPAGE_X, 0, 6, 0),
-            Instruction(InstructionType.CLD, self.CLD, MemMode.IMPLIED, 1, 2, 0),  # d8
-            Instruction(InstructionType.CMP, self.CMP, MemMode.ABSOLUTE_Y, 3, 4, 1),  # d9
-            Instruction(InstructionType.NOP, self.NOP, MemMode.IMPLIED, 1, 2, 0),  # da
-            Instruction(InstructionType.DCP, self.unimplemented, MemMode.ABSOLUTE_Y, 0, 7, 0),
-            Instruction(InstructionType.NOP, self.NOP, MemMode.ABSOLUTE_X, 3, 4, 1),  # dc
-            Instruction(InstructionType.CMP, self.CMP, MemMode.ABSOLUTE_X, 3, 4, 1),  # dd
-            Instruction(InstructionType.DEC, self.DEC, MemMode.ABSOLUTE_X, 3, 7, 0),  # de
-            Instruction(InstructionType.DCP, self.unimplemented, MemMode.ABSOLUTE_X, 0, 7, 0),
-            Instruction(InstructionType.CPX, self.CPX, MemMode.IMMEDIATE, 2, 2, 0),  # e0
-            Instruction(InstructionType.SBC, self.SBC, MemMode.INDEXED_INDIRECT, 2, 6, 0),
-            Instruction(InstructionType.NOP, self.NOP, MemMode.IMMEDIATE, 0, 2, 0),  # e2
-            Instruction(InstructionType.ISC, self.unimplemented, MemMode.INDEXED_INDIRECT, 0, 8, 0),
-            Instruction(InstructionType.CPX, self.CPX, MemMode.ZEROPAGE, 2, 3, 0),  # e4
-            Instruction(InstructionType.SBC, self.SBC, MemMode.ZEROPAGE, 2, 3, 0),  # e5
-            Instruction(InstructionType.INC, self.INC, MemMode.ZEROPAGE, 2, 5, 0),  # e6
-            Instruction(InstructionType.ISC, self.unimplemented, MemMode.ZEROPAGE, 0, 5, 0),
-            Instruction(InstructionType.INX, self.INX, MemMode.IMPLIED, 1, 2, 0),  # e8
-            Instruction(InstructionType.SBC, self.SBC, MemMode.IMMEDIATE, 2, 2, 0),  # e9
-            Instruction(InstructionType.NOP, self.NOP, MemMode.IMPLIED, 1, 2, 0),  # ea
-            Instruction(InstructionType.SBC, self.SBC, MemMode.IMMEDIATE, 0, 2, 0),  # eb
-            Instruction(InstructionType.CPX, self.CPX, MemMode.ABSOLUTE, 3, 4, 0),  # ec
-            Instruction(InstructionType.SBC, self.SBC, MemMode.ABSOLUTE, 3, 4, 0),  # ed
-            Instruction(InstructionType.INC, self.INC, MemMode.ABSOLUTE, 3, 6, 0),  # ee
-            Instruction(InstructionType.ISC, self.unimplemented, MemMode.ABSOLUTE, 0, 6, 0),
-            Instruction(InstructionType.BEQ, self.BEQ, MemMode.RELATIVE, 2, 2, 1),  # f0
-            Instruction(InstructionType.SBC, self.SBC, MemMode.INDIRECT_INDEXED, 2, 5, 1),
-            Instruction(InstructionType.KIL, self.unimplemented, MemMode.IMPLIED, 0, 2, 0),
-            Instruction(InstructionType.ISC, self.unimplemented, MemMode.INDIRECT_INDEXED, 0, 8, 0),
-            Instruction(InstructionType.NOP, self.NOP, MemMode.ZEROPAGE_X, 2, 4, 0),  # f4
-            Instruction(InstructionType.SBC, self.SBC, MemMode.ZEROPAGE_X, 2, 4, 0),  # f5
-            Instruction(InstructionType.INC, self.INC, MemMode.ZEROPAGE_X, 2, 6, 0),  # f6
-            Instruction(InstructionType.ISC, self.unimplemented, MemMode.ZEROPAGE_X, 0, 6, 0),
-            Instruction(InstructionType.SED, self.SED, MemMode.IMPLIED, 1, 2, 0),  # f8
-            Instruction(InstructionType.SBC, self.SBC, MemMode.ABSOLUTE_Y, 3, 4, 1),  # f9
-            Instruction(InstructionType.NOP, self.NOP, MemMode.IMPLIED, 1, 2, 0),  # fa
-            Instruction(InstructionType.ISC, self.unimplemented, MemMode.ABSOLUTE_Y, 0, 7, 0),
-            Instruction(InstructionType.NOP, self.NOP, MemMode.ABSOLUTE_X, 3, 4, 1),  # fc
-            Instruction(InstructionType.SBC, self.SBC, MemMode.ABSOLUTE_X, 3, 4, 1),  # fd
-            Instruction(InstructionType.INC, self.INC, MemMode.ABSOLUTE_X, 3, 7, 0),  # fe
-            Instruction(InstructionType.ISC, self.unimplemented, MemMode.ABSOLUTE_X, 0, 7, 0),
-        ]
+        # Joypad 1 buttons, one bit each in BUTTON_* order
+        self.joypad1_state: int = 0
+        self.joypad1_strobe: bool = False
+        self.joypad1_read_count: int = 0
+        # Compiled blocks, keyed by their first address
+        self.jit = jit
+        self.block_counter: dict[int, int] = {}
+        self.blocks: dict[int, Block] = {}
+        # Instructions in the cartridge decoded the first time they run,
+        # keyed by address. PRG ROM never changes; writes to PRG RAM drop the
+        # instructions they overlap. Code in CPU RAM is decoded every time.
+        self.decoded: dict[int, tuple] = {}
+
+        # Tables indexed by opcode. Each instruction type is handled by the
+        # method of the same name, or branch() for the branches.
+        self.opc_type = array('B', [entry[0] for entry in INSTRUCTIONS])
+        self.opc_method = []
+        for instruction_type, mode, *_ in INSTRUCTIONS:
+            name = INSTRUCTION_NAMES[instruction_type]
+            if instruction_type in BRANCH_CONDITIONS:
+                method = partial(self.branch,
+                                 *BRANCH_CONDITIONS[instruction_type])
+            elif instruction_type in SHIFTS:
+                method = getattr(self, name + (
+                    "_A" if mode == MODE_ACCUMULATOR else "_M"))
+            else:
+                method = getattr(self, name, self.unimplemented)
+            self.opc_method.append(method)
+        self.opc_tab = OPCODE_TABLE
+        # One function per opcode taking only data, with the mode baked in
+        self.opc_fns = [self.specialize(opcode) for opcode in range(256)]
+
+    # Runs the opcode's code from SPECIALIZED_CODE with this CPU as its
+    # globals. Everything else calls the handler with the mode bound.
+    def specialize(self, opcode: int) -> Callable[[int], None]:
+        code = SPECIALIZED_CODE.get(opcode)
+        if code is None:
+            return partial(self.opc_method[opcode], self.opc_tab[opcode << 2])
+        namespace = {"cpu": self, "ram": self.ram, "ZN_FLAGS": ZN_FLAGS}
+        exec(code, namespace)
+        return namespace[f"opcode_{opcode:02X}"]
 
     # Add memory to accumulator with carry
-    def ADC(self, instruction: Instruction, data: int):
-        src = self.read_memory(data, instruction.mode)
-        signed_result = src + self.A + self.C
-        self.V = bool(~(self.A ^ src) & (self.A ^ signed_result) & 0x80)
-        self.A = (self.A + src + self.C) % 256
-        self.C = signed_result > 0xFF
-        self.setZN(self.A)
+    def ADC(self, mode: int, data: int):
+        src = self.read_memory(data, mode)
+        self.add_with_carry(src)
 
     # Bitwise AND with accumulator
-    def AND(self, instruction: Instruction, data: int):
-        src = self.read_memory(data, instruction.mode)
-        self.A = self.A & src
-        self.setZN(self.A)
-
-    # Arithmetic shift left
-    def ASL(self, instruction: Instruction, data: int):
-        src = self.A if instruction.mode == MemMode.ACCUMULATOR else (
-            self.read_memory(data, instruction.mode))
-        self.C = bool(src >> 7)  # carry is set to 7th bit
-        src = (src << 1) & 0xFF
-        self.setZN(src)
-        if instruction.mode == MemMode.ACCUMULATOR:
-            self.A = src
-        else:
-            self.write_memory(data, instruction.mode, src)
-
-    # Branch if carry clear
-    def BCC(self, instruction: Instruction, data: int):
-        if not self.C:
-            self.PC = self.address_for_mode(data, instruction.mode)
-            self.jumped = True
-
-    # branch if carry set
-    def BCS(self, instruction: Instruction, data: int):
-        if self.C:
-            self.PC = self.address_for_mode(data, instruction.mode)
-            self.jumped = True
-
-    # Branch on result zero
-    def BEQ(self, instruction: Instruction, data: int):
-        if self.Z:
-            self.PC = self.address_for_mode(data, instruction.mode)
-            self.jumped = True
+    def AND(self, mode: int, data: int):
+        value = self.A & self.read_memory(data, mode)
+        self.A = value
+        self.P = (self.P & ~(FLAG_Z | FLAG_N)) | ZN_FLAGS[value]
+
+    # Arithmetic shift left on the accumulator
+    def ASL_A(self, mode: int, data: int):
+        src = self.A
+        result = (src << 1) & 0xFF
+        # carry is set to 7th bit
+        self.P = (self.P & ~(FLAG_C | FLAG_Z | FLAG_N)) | (src >> 7) | \
+            ZN_FLAGS[result]
+        self.A = result
+
+    # Arithmetic shift left in memory
+    def ASL_M(self, mode: int, data: int):
+        src = self.read_memory(data, mode)
+        result = (src << 1) & 0xFF
+        # carry is set to 7th bit
+        self.P = (self.P & ~(FLAG_C | FLAG_Z | FLAG_N)) | (src >> 7) | \
+            ZN_FLAGS[result]
+        self.write_memory(data, mode, result)
 
     # Bit test bits in memory with accumulator
-    def BIT(self, instruction: Instruction, data: int):
-        src = self.read_memory(data, instruction.mode)
-        self.V = bool((src >> 6) & 1)
-        self.Z = ((src & self.A) == 0)
-        self.N = ((src >> 7) == 1)
-
-    # Branch on result minus
-    def BMI(self, instruction: Instruction, data: int):
-        if self.N:
-            self.PC = self.address_for_mode(data, instruction.mode)
-            self.jumped = True
-
-    # Branch on result not zero
-    def BNE(self, instruction: Instruction, data: int):
-        if not self.Z:
-            self.PC = self.address_for_mode(data, instruction.mode)
-            self.jumped = True
-
-    # Branch on result plus
-    def BPL(self, instruction: Instruction, data: int):
-        if not self.N:
-            self.PC = self.address_for_mode(data, instruction.mode)
+    def BIT(self, mode: int, data: int):
+        src = self.read_memory(data, mode)
+        # V and N are copied straight from bits 6 and 7
+        self.P = (self.P & ~(FLAG_Z | FLAG_V | FLAG_N)) | (
+            src & (FLAG_V | FLAG_N)) | (((src & self.A) == 0) << 1)
+
+    # Shared by all eight branches, taken when the flag's bit in P equals
+    # taken. The opcode table binds flag and taken for each one.
+    def branch(self, flag: int, taken: int, mode: int, data: int):
+        if (self.P & flag) == taken:
+            # Branches are always relative, data is a signed byte
+            self.PC = (self.PC + 2 + data - ((data & 0x80) << 1)) & 0xFFFF
             self.jumped = True
 
     # Force break
-    def BRK(self, instruction: Instruction, data: int):
-        self.PC += 2
+    def BRK(self, mode: int, data: int):
+        push = self.stack_push
+        read = self.read_memory
+        pc = self.PC + 2
         # Push PC to stack
-        self.stack_push((self.PC >> 8) & 0xFF)
-        self.stack_push(self.PC & 0xFF)
+        push((pc >> 8) & 0xFF)
+        push(pc & 0xFF)
         # Push status to stack
-        self.B = True
-        self.stack_push(self.status)
-        self.B = False
-        self.I = True
+        push(self.P | FLAG_U | FLAG_B)
+        self.P |= FLAG_I
         # Set PC to reset vector
-        self.PC = (self.read_memory(IRQ_BRK_VECTOR, MemMode.ABSOLUTE)) | \
-                  (self.read_memory(IRQ_BRK_VECTOR + 1, MemMode.ABSOLUTE) << 8)
+        self.PC = read(IRQ_BRK_VECTOR, MODE_ABSOLUTE) | \
+            (read(IRQ_BRK_VECTOR + 1, MODE_ABSOLUTE) << 8)
         self.jumped = True
 
-    # Branch on overflow clear
-    def BVC(self, instruction: Instruction, data: int):
-        if not self.V:
-            self.PC = self.address_for_mode(data, instruction.mode)
-            self.jumped = True
-
-    # Branch on overflow set
-    def BVS(self, instruction: Instruction, data: int):
-        if self.V:
-            self.PC = self.address_for_mode(data, instruction.mode)
-            self.jumped = True
-
     # Clear carry
-    def CLC(self, instruction: Instruction, data: int):
-        self.C = False
+    def CLC(self, mode: int, data: int):
+        self.P &= ~FLAG_C
 
     # Clear decimal
-    def CLD(self, instruction: Instruction, data: int):
-        self.D = False
+    def CLD(self, mode: int, data: int):
+        self.P &= ~FLAG_D
 
     # Clear interrupt
-    def CLI(self, instruction: Instruction, data: int):
-        self.I = False
+    def CLI(self, mode: int, data: int):
+        self.P &= ~FLAG_I
 
     # Clear overflow
-    def CLV(self, instruction: Instruction, data: int):
-        self.V = False
+    def CLV(self, mode: int, data: int):
+        self.P &= ~FLAG_V
 
     # Compare accumulator
-    def CMP(self, instruction: Instruction, data: int):
-        src = self.read_memory(data, instruction.mode)
-        self.C = self.A >= src
-        self.setZN(self.A - src)
+    def CMP(self, mode: int, data: int):
+        src = self.read_memory(data, mode)
+        self.P = (self.P & ~(FLAG_C | FLAG_Z | FLAG_N)) | (self.A >= src) | \
+            ZN_FLAGS[(self.A - src) & 0x1FF]
 
     # Compare X register
-    def CPX(self, instruction: Instruction, data: int):
-        src = self.read_memory(data, instruction.mode)
-        self.C = self.X >= src
-        self.setZN(self.X - src)
+    def CPX(self, mode: int, data: int):
+        src = self.read_memory(data, mode)
+        self.P = (self.P & ~(FLAG_C | FLAG_Z | FLAG_N)) | (self.X >= src) | \
+            ZN_FLAGS[(self.X - src) & 0x1FF]
 
     # Compare Y register
-    def CPY(self, instruction: Instruction, data: int):
-        src = self.read_memory(data, instruction.mode)
-        self.C = self.Y >= src
-        self.setZN(self.Y - src)
+    def CPY(self, mode: int, data: int):
+        src = self.read_memory(data, mode)
+        self.P = (self.P & ~(FLAG_C | FLAG_Z | FLAG_N)) | (self.Y >= src) | \
+            ZN_FLAGS[(self.Y - src) & 0x1FF]
 
     # Decrement memory
-    def DEC(self, instruction: Instruction, data: int):
-        src = self.read_memory(data, instruction.mode)
+    def DEC(self, mode: int, data: int):
+        src = self.read_memory(data, mode)
         src = (src - 1) & 0xFF
-        self.write_memory(data, instruction.mode, src)
+        self.write_memory(data, mode, src)
         self.setZN(src)
 
     # Decrement X
-    def DEX(self, instruction: Instruction, data: int):
+    def DEX(self, mode: int, data: int):
         self.X = (self.X - 1) & 0xFF
         self.setZN(self.X)
 
     # Decrement Y
-    def DEY(self, instruction: Instruction, data: int):
+    def DEY(self, mode: int, data: int):
         self.Y = (self.Y - 1) & 0xFF
         self.setZN(self.Y)
 
     # Exclusive or memory with accumulator
-    def EOR(self, instruction: Instruction, data: int):
-        self.A ^= self.read_memory(data, instruction.mode)
-        self.setZN(self.A)
+    def EOR(self, mode: int, data: int):
+        value = self.A ^ self.read_memory(data, mode)
+        self.A = value
+        self.P = (self.P & ~(FLAG_Z | FLAG_N)) | ZN_FLAGS[value]
 
     # Increment memory
-    def INC(self, instruction: Instruction, data: int):
-        src = self.read_memory(data, instruction.mode)
+    def INC(self, mode: int, data: int):
+        src = self.read_memory(data, mode)
         src = (src + 1) & 0xFF
-        self.write_memory(data, instruction.mode, src)
+        self.write_memory(data, mode, src)
         self.setZN(src)
 
     # Increment X
-    def INX(self, instruction: Instruction, data: int):
+    def INX(self, mode: int, data: int):
         self.X = (self.X + 1) & 0xFF
         self.setZN(self.X)
 
     # Increment Y
-    def INY(self, instruction: Instruction, data: int):
+    def INY(self, mode: int, data: int):
         self.Y = (self.Y + 1) & 0xFF
         self.setZN(self.Y)
 
     # Jump
-    def JMP(self, instruction: Instruction, data: int):
-        self.PC = self.address_for_mode(data, instruction.mode)
+    def JMP(self, mode: int, data: int):
+        self.PC = self.address_for_mode(data, mode)
         self.jumped = True
 
     # Jump to subroutine
-    def JSR(self, instruction: Instruction, data: int):
-        self.PC += 2
+    def JSR(self, mode: int, data: int):
+        ram = self.ram
+        sp = self.SP
+        pc = self.PC + 2
         # Push PC to stack
-        self.stack_push((self.PC >> 8) & 0xFF)
-        self.stack_push(self.PC & 0xFF)
-        # Jump to subroutine
-        self.PC = self.address_for_mode(data, instruction.mode)
+        ram[0x100 | sp] = (pc >> 8) & 0xFF
+        ram[0x100 | ((sp - 1) & 0xFF)] = pc & 0xFF
+        self.SP = (sp - 2) & 0xFF
+        # Jump to subroutine, which is always absolute
+        self.PC = data
         self.jumped = True
 
     # Load accumulator with memory
-    def LDA(self, instruction: Instruction, data: int):
-        self.A = self.read_memory(data, instruction.mode)
-        self.setZN(self.A)
+    def LDA(self, mode: int, data: int):
+        value = self.read_memory(data, mode)
+        self.A = value
+        self.P = (self.P & ~(FLAG_Z | FLAG_N)) | ZN_FLAGS[value]
 
     # Load X with memory
-    def LDX(self, instruction: Instruction, data: int):
-        self.X = self.read_memory(data, instruction.mode)
-        self.setZN(self.X)
+    def LDX(self, mode: int, data: int):
+        value = self.read_memory(data, mode)
+        self.X = value
+        self.P = (self.P & ~(FLAG_Z | FLAG_N)) | ZN_FLAGS[value]
 
     # Load Y with memory
-    def LDY(self, instruction: Instruction, data: int):
-        self.Y = self.read_memory(data, instruction.mode)
-        self.setZN(self.Y)
-
-    # Logical shift right
-    def LSR(self, instruction: Instruction, data: int):
-        src = self.A if instruction.mode == MemMode.ACCUMULATOR else (
-            self.read_memory(data, instruction.mode))
-        self.C = bool(src & 1)  # carry is set to 0th bit
-        src >>= 1
-        self.setZN(src)
-        if instruction.mode == MemMode.ACCUMULATOR:
-            self.A = src
-        else:
-            self.write_memory(data, instruction.mode, src)
+    def LDY(self, mode: int, data: int):
+        value = self.read_memory(data, mode)
+        self.Y = value
+        self.P = (self.P & ~(FLAG_Z | FLAG_N)) | ZN_FLAGS[value]
+
+    # Logical shift right on the accumulator
+    def LSR_A(self, mode: int, data: int):
+        src = self.A
+        result = src >> 1
+        # carry is set to 0th bit
+        self.P = (self.P & ~(FLAG_C | FLAG_Z | FLAG_N)) | (src & 1) | \
+            ZN_FLAGS[result]
+        self.A = result
+
+    # Logical shift right in memory
+    def LSR_M(self, mode: int, data: int):
+        src = self.read_memory(data, mode)
+        result = src >> 1
+        # carry is set to 0th bit
+        self.P = (self.P & ~(FLAG_C | FLAG_Z | FLAG_N)) | (src & 1) | \
+            ZN_FLAGS[result]
+        self.write_memory(data, mode, result)
 
     # No op
-    def NOP(self, instruction: Instruction, data: int):
+    def NOP(self, mode: int, data: int):
         pass
 
     # Or memory with accumulator
-    def ORA(self, instruction: Instruction, data: int):
-        self.A |= self.read_memory(data, instruction.mode)
-        self.setZN(self.A)
+    def ORA(self, mode: int, data: int):
+        value = self.A | self.read_memory(data, mode)
+        self.A = value
+        self.P = (self.P & ~(FLAG_Z | FLAG_N)) | ZN_FLAGS[value]
 
     # Push accumulator
-    def PHA(self, instruction: Instruction, data: int):
-        self.stack_push(self.A)
+    def PHA(self, mode: int, data: int):
+        sp = self.SP
+        self.ram[0x100 | sp] = self.A
+        self.SP = (sp - 1) & 0xFF
 
     # Push status
-    def PHP(self, instruction: Instruction, data: int):
+    def PHP(self, mode: int, data: int):
         # https://nesdev.org/the%20'B'%20flag%20&%20BRK%20instruction.txt
-        self.B = True
-        self.stack_push(self.status)
-        self.B = False
+        sp = self.SP
+        self.ram[0x100 | sp] = self.P | FLAG_U | FLAG_B
+        self.SP = (sp - 1) & 0xFF
 
     # Pull accumulator
-    def PLA(self, instruction: Instruction, data: int):
-        self.A = self.stack_pop()
-        self.setZN(self.A)
+    def PLA(self, mode: int, data: int):
+        sp = (self.SP + 1) & 0xFF
+        self.SP = sp
+        value = self.ram[0x100 | sp]
+        self.A = value
+        self.P = (self.P & ~(FLAG_Z | FLAG_N)) | ZN_FLAGS[value]
 
     # Pull status
-    def PLP(self, instruction: Instruction, data: int):
-        self.set_status(self.stack_pop())
-
-    # Rotate one bit left
-    def ROL(self, instruction: Instruction, data: int):
-        src = self.A if instruction.mode == MemMode.ACCUMULATOR else (
-            self.read_memory(data, instruction.mode))
-        old_c = self.C
-        self.C = bool((src >> 7) & 1)  # carry is set to 7th bit
-        src = ((src << 1) | old_c) & 0xFF
-        self.setZN(src)
-        if instruction.mode == MemMode.ACCUMULATOR:
-            self.A = src
-        else:
-            self.write_memory(data, instruction.mode, src)
-
-    # Rotate one bit right
-    def ROR(self, instruction: Instruction, data: int):
-        src = self.A if instruction.mode == MemMode.ACCUMULATOR else (
-            self.read_memory(data, instruction.mode))
-        old_c = self.C
-        self.C = bool(src & 1)  # carry is set to 0th bit
-        src = ((src >> 1) | (old_c << 7)) & 0xFF
-        self.setZN(src)
-        if instruction.mode == MemMode.ACCUMULATOR:
-            self.A = src
-        else:
-            self.write_memory(data, instruction.mode, src)
+    def PLP(self, mode: int, data: int):
+        sp = (self.SP + 1) & 0xFF
+        self.SP = sp
+        self.P = self.ram[0x100 | sp] & ~(FLAG_B | FLAG_U)
+
+    # Rotate one bit left on the accumulator
+    def ROL_A(self, mode: int, data: int):
+        src = self.A
+        P = self.P
+        result = ((src << 1) | (P & FLAG_C)) & 0xFF
+        # carry is set to 7th bit
+        self.P = (P & ~(FLAG_C | FLAG_Z | FLAG_N)) | (src >> 7) | \
+            ZN_FLAGS[result]
+        self.A = result
+
+    # Rotate one bit left in memory
+    def ROL_M(self, mode: int, data: int):
+        src = self.read_memory(data, mode)
+        P = self.P
+        result = ((src << 1) | (P & FLAG_C)) & 0xFF
+        # carry is set to 7th bit
+        self.P = (P & ~(FLAG_C | FLAG_Z | FLAG_N)) | (src >> 7) | \
+            ZN_FLAGS[result]
+        self.write_memory(data, mode, result)
+
+    # Rotate one bit right on the accumulator
+    def ROR_A(self, mode: int, data: int):
+        src = self.A
+        P = self.P
+        result = (src >> 1) | ((P & FLAG_C) << 7)
+        # carry is set to 0th bit
+        self.P = (P & ~(FLAG_C | FLAG_Z | FLAG_N)) | (src & 1) | \
+            ZN_FLAGS[result]
+        self.A = result
+
+    # Rotate one bit right in memory
+    def ROR_M(self, mode: int, data: int):
+        src = self.read_memory(data, mode)
+        P = self.P
+        result = (src >> 1) | ((P & FLAG_C) << 7)
+        # carry is set to 0th bit
+        self.P = (P & ~(FLAG_C | FLAG_Z | FLAG_N)) | (src & 1) | \
+            ZN_FLAGS[result]
+        self.write_memory(data, mode, result)
 
     # Return from interrupt
-    def RTI(self, instruction: Instruction, data: int):
+    def RTI(self, mode: int, data: int):
         # Pull status out
         self.set_status(self.stack_pop())
         # Pull PC out
@@ -623,78 +848,86 @@ class CPU:
         self.jumped = True
 
     # Return from subroutine
-    def RTS(self, instruction: Instruction, data: int):
+    def RTS(self, mode: int, data: int):
+        ram = self.ram
+        sp = self.SP
         # Pull PC out
-        lb = self.stack_pop()
-        hb = self.stack_pop()
+        lb = ram[0x100 | ((sp + 1) & 0xFF)]
+        hb = ram[0x100 | ((sp + 2) & 0xFF)]
+        self.SP = (sp + 2) & 0xFF
         self.PC = ((hb << 8) | lb) + 1  # 1 past last instruction
         self.jumped = True
 
     # Subtract with carry
-    def SBC(self, instruction: Instruction, data: int):
-        src = self.read_memory(data, instruction.mode)
-        signed_result = self.A - src - (1 - self.C)
-        # Set overflow
-        self.V = bool((self.A ^ src) & (self.A ^ signed_result) & 0x80)
-        self.A = (self.A - src - (1 - self.C)) % 256
-        self.C = not (signed_result < 0)  # set carry
-        self.setZN(self.A)
+    def SBC(self, mode: int, data: int):
+        src = self.read_memory(data, mode)
+        # A - src - borrow is A + ~src + carry in 8 bits
+        self.add_with_carry(src ^ 0xFF)
 
     # Set carry
-    def SEC(self, instruction: Instruction, data: int):
-        self.C = True
+    def SEC(self, mode: int, data: int):
+        self.P |= FLAG_C
 
     # Set decimal
-    def SED(self, instruction: Instruction, data: int):
-        self.D = True
+    def SED(self, mode: int, data: int):
+        self.P |= FLAG_D
 
     # Set interrupt
-    def SEI(self, instruction: Instruction, data: int):
-        self.I = True
+    def SEI(self, mode: int, data: int):
+        self.P |= FLAG_I
 
     # Store accumulator
-    def STA(self, instruction: Instruction, data: int):
-        self.write_memory(data, instruction.mode, self.A)
+    def STA(self, mode: int, data: int):
+        self.write_memory(data, mode, self.A)
 
     # Store X register
-    def STX(self, instruction: Instruction, data: int):
-        self.write_memory(data, instruction.mode, self.X)
+    def STX(self, mode: int, data: int):
+        self.write_memory(data, mode, self.X)
 
     # Store Y register
-    def STY(self, instruction: Instruction, data: int):
-        self.write_memory(data, instruction.mode, self.Y)
+    def STY(self, mode: int, data: int):
+        self.write_memory(data, mode, self.Y)
 
     # Transfer A to X
-    def TAX(self, instruction: Instruction, data: int):
+    def TAX(self, mode: int, data: int):
         self.X = self.A
         self.setZN(self.X)
 
     # Transfer A to Y
-    def TAY(self, instruction: Instruction, data: int):
+    def TAY(self, mode: int, data: int):
         self.Y = self.A
         self.setZN(self.Y)
 
     # Transfer stack pointer to X
-    def TSX(self, instruction: Instruction, data: int):
+    def TSX(self, mode: int, data: int):
         self.X = self.SP
         self.setZN(self.X)
 
     # Transfer X to A
-    def TXA(self, instruction: Instruction, data: int):
+    def TXA(self, mode: int, data: int):
         self.A = self.X
         self.setZN(self.A)
 
     # Transfer X to SP
-    def TXS(self, instruction: Instruction, data: int):
+    def TXS(self, mode: int, data: int):
         self.SP = self.X
 
     # Transfer Y to A
-    def TYA(self, instruction: Instruction, data: int):
+    def TYA(self, mode: int, data: int):
         self.A = self.Y
         self.setZN(self.A)
 
-    def unimplemented(self, instruction: Instruction, data: int):
-        print(f"{instruction.type.name} is unimplemented.")
+    def unimplemented(self, mode: int, data: int):
+        opcode = self.read_memory(self.PC, MODE_ABSOLUTE)
+        print(f"{INSTRUCTION_NAMES[self.opc_type[opcode]]} "
+              f"({MODE_NAMES[mode]}) is unimplemented.")
+
+    # Steps until done() is true, only checking it every chunk steps
+    def run_until(self, done: Callable[[], bool], chunk: int = 4096):
+        step = self.step
+        while not done():
+            for _ in range(chunk):
+                step()
 
     def step(self):
         if self.stall > 0:
@@ -702,144 +935,393 @@ class CPU:
             self.cpu_ticks += 1
             return
 
-        opcode = self.read_memory(self.PC, MemMode.ABSOLUTE)
+        # Attributes used more than once are read into locals
+        pc = self.PC
+        if self.blocks:
+            block = self.blocks.get(pc)
+            # A block may only run when it can't overlap the NMI or the end of
+            # the frame, so the PPU sees the same thing as stepping would
+            if block is not None and block.max_ticks * 3 < min(
+                    self.ppu.cycles_until(241, 2),
+                    self.ppu.cycles_until(240, 257)):
+                self.cpu_ticks += block.run()
+                if self.jumped:
+                    self.count_block_entry()
+                return
+
         self.page_crossed = False
         self.jumped = False
-        instruction = self.instructions[opcode]
-        data = 0
-        for i in range(1, instruction.length):
-            data |= (self.read_memory(self.PC + i,
-                                      MemMode.ABSOLUTE) << ((i - 1) * 8))
-
-        instruction.method(instruction, data)
-
-        if not self.jumped:
-            self.PC += instruction.length
-        elif instruction.type in {InstructionType.BCC, InstructionType.BCS,
-                                  InstructionType.BEQ, InstructionType.BMI,
-                                  InstructionType.BNE, InstructionType.BPL,
-                                  InstructionType.BVC, InstructionType.BVS}:
+        entry = self.decoded.get(pc)
+        if entry is None:
+            entry = self.decode(pc)
+            if pc >= 0x6000:
+                self.decoded[pc] = entry
+        function, data, length, ticks, page_ticks, is_branch = entry
+
+        function(data)
+
+        jumped = self.jumped
+        if not jumped:
+            self.PC = pc + length
+        elif is_branch:
             # Branch instructions are +1 ticks if they succeeded
-            self.cpu_ticks += 1
-        self.cpu_ticks += instruction.ticks
+            ticks += 1
         if self.page_crossed:
-            self.cpu_ticks += instruction.page_ticks
-
-    def address_for_mode(self, data: int, mode: MemMode) -> int:
-        def different_pages(address1: int, address2: int) -> bool:
-            return (address1 & 0xFF00) != (address2 & 0xFF00)
-
-        address = 0
-        match mode:
-            case MemMode.ABSOLUTE:
-                address = data
-            case MemMode.ABSOLUTE_X:
-                address = (data + self.X) & 0xFFFF
-                self.page_crossed = different_pages(address, address - self.X)
-            case MemMode.ABSOLUTE_Y:
-                address = (data + self.Y) & 0xFFFF
-                self.page_crossed = different_pages(address, address - self.Y)
-            case MemMode.INDEXED_INDIRECT:
-                # 0xFF for zero-page wrapping in next two lines
-                ls = self.ram[(data + self.X) & 0xFF]
-                ms = self.ram[(data + self.X + 1) & 0xFF]
-                address = (ms << 8) | ls
-            case MemMode.INDIRECT:
-                ls = self.ram[data]
-                ms = self.ram[data + 1]
-                if (data & 0xFF) == 0xFF:
-                    ms = self.ram[data & 0xFF00]
-                address = (ms << 8) | ls
-            case MemMode.INDIRECT_INDEXED:
-                # 0xFF for zero-page wrapping in next two lines
-                ls = self.ram[data & 0xFF]
-                ms = self.ram[(data + 1) & 0xFF]
-                address = (ms << 8) | ls
-                address = (address + self.Y) & 0xFFFF
-                self.page_crossed = different_pages(address, address - self.Y)
-            case MemMode.RELATIVE:
-                address = (self.PC + 2 + data) & 0xFFFF if (data < 0x80) \
-                    else (self.PC + 2 + (data - 256)) & 0xFFFF  # signed
-            case MemMode.ZEROPAGE:
-                address = data
-            case MemMode.ZEROPAGE_X:
-                address = (data + self.X) & 0xFF
-            case MemMode.ZEROPAGE_Y:
-                address = (data + self.Y) & 0xFF
+            ticks += page_ticks
+        self.cpu_ticks += ticks
+        if jumped and self.jit:
+            self.count_block_entry()
+
+    # (function, data, length, ticks, page_ticks, is_branch) for the
+    # instruction at pc
+    def decode(self, pc: int) -> tuple:
+        opcode, data = self.fetch(pc)
+        _, length, ticks, page_ticks = OPCODE_STRUCT.unpack_from(
+            self.opc_tab, opcode << 2)
+        return (self.opc_fns[opcode], data, length, ticks, page_ticks,
+                self.opc_type[opcode] in BRANCHES)
+
+    # The opcode at pc and its data bytes, only reading as many bytes as
+    # the instruction has
+    def fetch(self, pc: int) -> tuple[int, int]:
+        offset = pc & self.rom.prg_rom_mask
+        if pc >= 0x8000 and offset <= self.rom.prg_rom_mask - 2:
+            # Fetch the whole instruction from PRG ROM at once
+            opcode, low, high = INSTRUCTION_STRUCT.unpack_from(
+                self.rom.prg_rom, offset)
+            return opcode, (low | (high << 8)) & DATA_MASKS[
+                self.opc_tab[(opcode << 2) + 1]]
+        opcode = self.read_memory(pc, MODE_ABSOLUTE)
+        length = self.opc_tab[(opcode << 2) + 1]
+        if length < 2:
+            return opcode, 0
+        data = self.read_memory(pc + 1, MODE_ABSOLUTE)
+        if length == 3:
+            data |= self.read_memory(pc + 2, MODE_ABSOLUTE) << 8
+        return opcode, data
+
+    # Blocks start wherever a jump lands; hot ones get compiled. Code below
+    # 0x6000 is in RAM and changes too often to be worth compiling.
+    def count_block_entry(self):
+        if self.PC < 0x6000:
+            return
+        count = self.block_counter.get(self.PC, 0) + 1
+        self.block_counter[self.PC] = count
+        if count == BLOCK_THRESHOLD:
+            block = self.compile_block(self.PC)
+            if block is not None:
+                self.blocks[self.PC] = block
+
+    # Instructions in a block can't be unimplemented or touch the PPU, APU or
+    # joypad registers, since they run without the PPU catching up
+    def block_safe(self, opcode: int, data: int) -> bool:
+        if self.opc_method[opcode] == self.unimplemented:
+            return False
+        mode = self.opc_tab[opcode << 2]
+        if mode == MODE_ABSOLUTE:
+            return (self.opc_type[opcode] in CONTROL_FLOW or data < 0x2000
+                    or data >= 0x6000)
+        if mode == MODE_ABSOLUTE_X or mode == MODE_ABSOLUTE_Y:
+            return data + 0xFF < 0x2000 or 0x6000 <= data <= 0xFF00
+        if mode == MODE_INDEXED_INDIRECT or mode == MODE_INDIRECT_INDEXED:
+            return False
+        return True
+
+    # Python source for instructions simple enough to be written out in full
+    @staticmethod
+    def inline_source(instruction_type: int, mode: int,
+                      data: int, set_flags: bool) -> list[str] | None:
+        def zn(register: str) -> list[str]:
+            if not set_flags:
+                return []
+            return [f"cpu.P = (cpu.P & {~(FLAG_Z | FLAG_N) & 0xFF}) | "
+                    f"ZN_FLAGS[cpu.{register}]"]
+
+        name = INSTRUCTION_NAMES[instruction_type]
+        if instruction_type in (LDA, LDX, LDY) and mode == MODE_IMMEDIATE:
+            lines = [f"cpu.{name[2]} = {data}"]
+            if set_flags:
+                flags = (FLAG_Z if data == 0 else 0) | (data & FLAG_N)
+                lines.append(f"cpu.P = (cpu.P & {~(FLAG_Z | FLAG_N) & 0xFF}) | "
+                             f"{flags}")
+            return lines
+        if instruction_type in (LDA, LDX, LDY) and mode == MODE_ZEROPAGE:
+            return [f"cpu.{name[2]} = ram[{data}]"] + zn(name[2])
+        if instruction_type in (STA, STX, STY) and mode == MODE_ZEROPAGE:
+            return [f"ram[{data}] = cpu.{name[2]}"]
+        if instruction_type in (TAX, TAY, TXA, TYA):
+            return [f"cpu.{name[2]} = cpu.{name[1]}"] + zn(name[2])
+        if instruction_type == TSX:
+            return ["cpu.X = cpu.SP"] + zn("X")
+        if instruction_type == TXS:
+            return ["cpu.SP = cpu.X"]
+        if instruction_type in (INX, INY):
+            return [f"cpu.{name[2]} = (cpu.{name[2]} + 1) & 0xFF"] + \
+                zn(name[2])
+        if instruction_type in (DEX, DEY):
+            return [f"cpu.{name[2]} = (cpu.{name[2]} - 1) & 0xFF"] + \
+                zn(name[2])
+        if instruction_type in (CLC, CLD, CLI, CLV):
+            return [f"cpu.P &= {~FLAGS[name[2]] & 0xFF}"]
+        if instruction_type in (SEC, SED, SEI):
+            return [f"cpu.P |= {FLAGS[name[2]]}"]
+        if instruction_type == NOP:
+            return []
+        return None
+
+    # Generates one function for the instructions from start up to and
+    # including the next control flow instruction
+    def compile_block(self, start: int) -> Block | None:
+        entries: list[tuple[int, int, int]] = []  # (address, opcode, data)
+        pc = start
+        while len(entries) < MAX_BLOCK_LENGTH and pc <= 0xFFFD:
+            opcode, data = self.fetch(pc)
+            length = self.opc_tab[(opcode << 2) + 1]
+            if not self.block_safe(opcode, data):
+                break
+            entries.append((pc, opcode, data))
+            pc += length
+            # Stop after writes to the cartridge, which may change the code
+            if self.opc_type[opcode] in CONTROL_FLOW or (
+                    self.opc_type[opcode] in MEMORY_WRITERS
+                    and data >= 0x6000):
+                break
+        if not entries:
+            return None
+
+        # Z and N only need computing if nothing later in the block
+        # overwrites them before they are read
+        set_flags = []
+        flags_live = True
+        for _, opcode, _ in reversed(entries):
+            set_flags.append(flags_live)
+            if self.opc_type[opcode] in ZN_WRITERS:
+                flags_live = False
+            elif self.opc_type[opcode] in ZN_READERS:
+                flags_live = True
+        set_flags.reverse()
+
+        name = f"block_{start:04X}"
+        namespace = {"cpu": self, "ram": self.ram, "ZN_FLAGS": ZN_FLAGS}
+        source = [f"def {name}():"]
+        body = []
+        base_ticks = 0
+        max_ticks = 0
+        for index, (address, opcode, data) in enumerate(entries):
+            instruction_type = self.opc_type[opcode]
+            mode, length, ticks, page_ticks = OPCODE_STRUCT.unpack_from(
+                self.opc_tab, opcode << 2)
+            base_ticks += ticks
+            max_ticks += ticks + page_ticks
+            inline = self.inline_source(instruction_type, mode, data,
+                                        set_flags[index])
+            if inline is not None:
+                body += inline
+                continue
+            namespace[f"h{index}"] = self.opc_fns[opcode]
+            call = f"h{index}({data})"
+            if instruction_type in CONTROL_FLOW:
+                body += [f"cpu.PC = {address}", "cpu.jumped = False", call]
+                if instruction_type in BRANCHES:
+                    max_ticks += 1
+                    body += ["if cpu.jumped:", "    ticks += 1", "else:",
+                             f"    cpu.PC = {address + length}"]
+                continue
+            if page_ticks and mode in {MODE_ABSOLUTE_X, MODE_ABSOLUTE_Y}:
+                body += ["cpu.page_crossed = False", call,
+                         "if cpu.page_crossed:", f"    ticks += {page_ticks}"]
+            else:
+                body.append(call)
+        if self.opc_type[entries[-1][1]] not in CONTROL_FLOW:
+            body += [f"cpu.PC = {pc}", "cpu.jumped = False"]
+        body = [f"ticks = {base_ticks}"] + body + ["return ticks"]
+        source += [f"    {line}" for line in body]
+        exec("\n".join(source), namespace)
+        return Block(namespace[name], start, pc, max_ticks)
+
+    # Drops compiled blocks that cover a cartridge RAM address that was
+    # written to, so they get recompiled with the new code
+    def invalidate_blocks(self, address: int):
+        address = 0x6000 + (address & PRG_RAM_MASK)
+        for start in [start for start, block in self.blocks.items()
+                      if block.start <= address < block.end]:
+            del self.blocks[start]
+            del self.block_counter[start]
+
+    def address_for_mode(self, data: int, mode: int) -> int:
+        return self.address_by_mode[mode](data)
+
+    # One address resolver per addressing mode, looked up by mode in
+    # address_by_mode instead of testing the mode against each in turn
+    @staticmethod
+    def address_none(data: int) -> int:
+        return 0
+
+    @staticmethod
+    def address_absolute(data: int) -> int:
+        return data
+
+    def address_absolute_x(self, data: int) -> int:
+        address = (data + self.X) & 0xFFFF
+        self.page_crossed = (address & 0xFF00) != (data & 0xFF00)
+        return address
+
+    def address_absolute_y(self, data: int) -> int:
+        address = (data + self.Y) & 0xFFFF
+        self.page_crossed = (address & 0xFF00) != (data & 0xFF00)
+        return address
+
+    def address_indexed_indirect(self, data: int) -> int:
+        # 0xFF for zero-page wrapping in next two lines
+        ls = self.ram[(data + self.X) & 0xFF]
+        ms = self.ram[(data + self.X + 1) & 0xFF]
+        return (ms << 8) | ls
+
+    def address_indirect(self, data: int) -> int:
+        # The pointer can be anywhere in memory, and its high byte wraps
+        # within the page
+        ls = self.read_memory(data, MODE_ABSOLUTE)
+        ms = self.read_memory((data & 0xFF00) | ((data + 1) & 0xFF),
+                              MODE_ABSOLUTE)
+        return (ms << 8) | ls
+
+    def address_indirect_indexed(self, data: int) -> int:
+        # 0xFF for zero-page wrapping in next two lines
+        ls = self.ram[data & 0xFF]
+        ms = self.ram[(data + 1) & 0xFF]
+        base = (ms << 8) | ls
+        address = (base + self.Y) & 0xFFFF
+        self.page_crossed = (address & 0xFF00) != (base & 0xFF00)
         return address
 
-    def read_memory(self, location: int, mode: MemMode) -> int:
-        if mode == MemMode.IMMEDIATE:
+    def address_relative(self, data: int) -> int:
+        # data is a signed byte
+        return (self.PC + 2 + data - ((data & 0x80) << 1)) & 0xFFFF
+
+    def address_zeropage_x(self, data: int) -> int:
+        return (data + self.X) & 0xFF
+
+    def address_zeropage_y(self, data: int) -> int:
+        return (data + self.Y) & 0xFF
+
+    def read_memory(self, location: int, mode: int) -> int:
+        if mode == MODE_IMMEDIATE:
             return location  # location is actually data in this case
-        address = self.address_for_mode(location, mode)
-
-        # Memory map at http://wiki.nesdev.com/w/index.php/CPU_memory_map
-        if address < 0x2000:  # main ram 2 KB goes up to 0x800
-            return self.ram[address % 0x800]  # mirrors for next 6 KB
-        elif address < 0x4000:  # 2000-2007 is PPU, mirrors every 8 bytes
-            temp = ((address % 8) | 0x2000)  # get data from ppu register
-            return self.ppu.read_register(temp)
-        elif address == 0x4016:  # joypad 1 status
-            if self.joypad1.strobe:
-                return self.joypad1.a
-            self.joypad1.read_count += 1
-            match self.joypad1.read_count:
-                case 1:
-                    return 0x40 | self.joypad1.a
-                case 2:
-                    return 0x40 | self.joypad1.b
-                case 3:
-                    return 0x40 | self.joypad1.select
-                case 4:
-                    return 0x40 | self.joypad1.start
-                case 5:
-                    return 0x40 | self.joypad1.up
-                case 6:
-                    return 0x40 | self.joypad1.down
-                case 7:
-                    return 0x40 | self.joypad1.left
-                case 8:
-                    return 0x40 | self.joypad1.right
-                case _:
-                    return 0x41
-        elif address < 0x6000:
-            return 0  # unimplemented other kinds of IO
-        else:  # addresses from 0x6000 to 0xFFFF are from the cartridge
-            return self.rom.read_cartridge(address)
-
-    def write_memory(self, location: int, mode: MemMode, value: int):
-        if mode == MemMode.IMMEDIATE:
+        address = location if mode == MODE_ABSOLUTE else \
+            self.address_by_mode[mode](location)
+        # RAM and the PPU registers, which games poll, are read inline
+        if address < 0x2000:
+            return self.ram[address & 0x7FF]
+        if address < 0x4000:  # 2000-2007 is PPU, mirrors every 8 bytes
+            return self.ppu_read_register((address & 7) | 0x2000)
+        return self.read_by_page[address >> 13](self, address)
+
+    def write_memory(self, location: int, mode: int, value: int):
+        if mode == MODE_IMMEDIATE:
             self.ram[location] = value
             return
 
-        address = self.address_for_mode(location, mode)
-        # Memory map at https://wiki.nesdev.org/w/index.php/CPU_memory_map
-        if address < 0x2000:  # main RAM 2 KB goes up to 0x800
-            self.ram[address % 0x800] = value  # mirrors for next 6 KB
-        elif address < 0x3FFF:  # 2000-2007 is PPU, mirrors every 8 bytes
-            temp = ((address % 8) | 0x2000)  # write data to PPU register
-            self.ppu.write_register(temp, value)
-        elif address == 0x4014:  # DMA transfer of sprite data
-            from_address = value * 0x100  # address to start copying from
-            for i in range(SPR_RAM_SIZE):  # copy all 256 bytes to sprite ram
-                self.ppu.spr[i] = self.read_memory((from_address + i),
-                                                   MemMode.ABSOLUTE)
+        address = location if mode == MODE_ABSOLUTE else \
+            self.address_by_mode[mode](location)
+        if address < 0x2000:
+            self.ram[address & 0x7FF] = value
+        else:
+            self.write_by_page[address >> 13](self, address, value)
+
+    # Memory map at https://wiki.nesdev.org/w/index.php/CPU_memory_map, one
+    # reader and writer per 8K page, looked up by address >> 13
+    def read_ram(self, address: int) -> int:
+        return self.ram[address & 0x7FF]  # 2 KB mirrored up to 0x2000
+
+    def read_ppu(self, address: int) -> int:
+        # 2000-2007 is PPU, mirrors every 8 bytes
+        return self.ppu_read_register((address & 7) | 0x2000)
+
+    def read_io(self, address: int) -> int:
+        if address == 0x4016:  # joypad 1 status
+            if self.joypad1_strobe:
+                return self.joypad1_state & 1
+            self.joypad1_read_count += 1
+            if self.joypad1_read_count <= 8:
+                return 0x40 | ((self.joypad1_state >>
+                                (self.joypad1_read_count - 1)) & 1)
+            return 0x41
+        return 0  # unimplemented other kinds of IO
+
+    # Addresses from 0x6000 to 0xFFFF are from the cartridge
+    def read_cartridge(self, address: int) -> int:
+        # Consecutive reads are usually from the same 8K page, so keep
+        # the last page the mapper resolved and read from it directly
+        if (address & 0xE000) != self.tlb_tag:
+            page = self.rom.read_pages[address >> 13]
+            if page is None:
+                return self.rom.read_cartridge(address)
+            self.tlb_tag = address & 0xE000
+            self.tlb_memory, self.tlb_mask = page
+        return self.tlb_memory[address & self.tlb_mask]
+
+    def write_ram(self, address: int, value: int):
+        self.ram[address & 0x7FF] = value
+
+    def write_ppu(self, address: int, value: int):
+        if address < 0x3FFF:  # 2000-2007 is PPU, mirrors every 8 bytes
+            self.ppu.write_register((address & 7) | 0x2000, value)
+
+    def write_io(self, address: int, value: int):
+        if address == 0x4014:  # DMA transfer of sprite data
+            from_address = value << 8  # address to start copying from
+            if from_address < 0x2000:  # a page of RAM is copied in one go
+                start = from_address & 0x7FF
+                self.ppu.spr[:] = self.ram[start:start + SPR_RAM_SIZE]
+            elif (from_address >= 0x6000 and
+                  self.rom.read_pages[from_address >> 13] is not None):
+                # as is a page of cartridge memory the mapper maps directly
+                memory, mask = self.rom.read_pages[from_address >> 13]
+                start = from_address & mask
+                self.ppu.spr[:] = memory[start:start + SPR_RAM_SIZE]
+            else:
+                for i in range(SPR_RAM_SIZE):  # copy all 256 bytes
+                    self.ppu.spr[i] = self.read_memory((from_address + i),
+                                                       MODE_ABSOLUTE)
             # Stall for 512 cycles while this completes
             self.stall = 512
         elif address == 0x4016:  # joypad 1
-            if self.joypad1.strobe and (not bool(value & 1)):
-                self.joypad1.read_count = 0
-            self.joypad1.strobe = bool(value & 1)
-            return
-        elif address < 0x6000:
-            return  # unimplemented other kinds of IO
-        else:  # addresses from 0x6000 to 0xFFFF are from the cartridge
-            # We haven't implemented support for cartridge RAM
-            return self.rom.write_cartridge(address, value)
+            if self.joypad1_strobe and (not bool(value & 1)):
+                self.joypad1_read_count = 0
+            self.joypad1_strobe = bool(value & 1)
+        # unimplemented other kinds of IO
+
+    def write_cartridge(self, address: int, value: int):
+        # We haven't implemented support for cartridge RAM
+        if self.blocks:
+            self.invalidate_blocks(address)
+        # Any instruction decoded from PRG RAM that covers the byte is stale
+        address_in_ram = 0x6000 + (address & PRG_RAM_MASK)
+        for pc in range(address_in_ram - 2, address_in_ram + 1):
+            self.decoded.pop(pc, None)
+        self.rom.write_cartridge(address, value)
+
+    # Kept on the class rather than each CPU: past 30 instance attributes
+    # CPython stops storing them inline, and every self.X gets slower
+    read_by_page = (read_ram, read_ppu, read_io) + (read_cartridge,) * 5
+    write_by_page = (write_ram, write_ppu, write_io) + (write_cartridge,) * 5
+
+    def set_button(self, button: int, pressed: bool):
+        if pressed:
+            self.joypad1_state |= 1 << button
+        else:
+            self.joypad1_state &= ~(1 << button)
+
+    # Adds to A with carry, looking up the result and flags
+    def add_with_carry(self, src: int):
+        index = (self.A << 9) | (src << 1) | (self.P & FLAG_C)
+        self.A = ADD_RESULTS[index]
+        self.P = (self.P & ~(FLAG_C | FLAG_Z | FLAG_V | FLAG_N)) | \
+            ADD_FLAGS[index]
 
     def setZN(self, value: int):
-        self.Z = (value == 0)
-        self.N = bool(value & 0x80) or (value < 0)
+        # Negative differences from compares count as negative too
+        self.P = (self.P & ~(FLAG_Z | FLAG_N)) | ZN_FLAGS[value & 0x1FF]
 
     def stack_push(self, value: int):
         self.ram[(0x100 | self.SP)] = value
@@ -851,37 +1333,28 @@ class CPU:
 
     @property
     def status(self) -> int:
-        return (self.C | self.Z << 1 | self.I << 2 | self.D << 3 |
-                self.B << 4 | 1 << 5 | self.V << 6 | self.N << 7)
+        return self.P | FLAG_U
 
     def set_status(self, temp: int):
-        self.C = bool(temp & 0b00000001)
-        self.Z = bool(temp & 0b00000010)
-        self.I = bool(temp & 0b00000100)
-        self.D = bool(temp & 0b00001000)
         # https://nesdev.org/the%20'B'%20flag%20&%20BRK%20instruction.txt
-        self.B = False
-        self.V = bool(temp & 0b01000000)
-        self.N = bool(temp & 0b10000000)
+        self.P = temp & ~(FLAG_B | FLAG_U)
 
     def trigger_NMI(self):
         self.stack_push((self.PC >> 8) & 0xFF)
         self.stack_push(self.PC & 0xFF)
         # https://nesdev.org/the%20'B'%20flag%20&%20BRK%20instruction.txt
-        self.B = True
-        self.stack_push(self.status)
-        self.B = False
-        self.I = True
+        self.stack_push(self.status | FLAG_B)
+        self.P |= FLAG_I
         # Set PC to NMI vector
-        self.PC = (self.read_memory(NMI_VECTOR, MemMode.ABSOLUTE)) | \
-                  (self.read_memory(NMI_VECTOR + 1, MemMode.ABSOLUTE) << 8)
+        self.PC = (self.read_memory(NMI_VECTOR, MODE_ABSOLUTE)) | \
+                  (self.read_memory(NMI_VECTOR + 1, MODE_ABSOLUTE) << 8)
 
     def log(self) -> str:
-        opcode = self.read_memory(self.PC, MemMode.ABSOLUTE)
-        instruction = self.instructions[opcode]
-        data1 = "  " if instruction.length < 2 else f"{self.read_memory(self.PC + 1, 
-                                                                        MemMode.ABSOLUTE):02X}"
-        data2 = "  " if instruction.length < 3 else f"{self.read_memory(self.PC + 2, 
-                                                                        MemMode.ABSOLUTE):02X}"
-        return f"{self.PC:04X}  {opcode:02X} {data1} {data2}  {instruction.type.name}{29 * ' '}" \
+        opcode = self.read_memory(self.PC, MODE_ABSOLUTE)
+        length = self.opc_tab[(opcode << 2) + 1]
+        data1 = "  " if length < 2 else f"{self.read_memory(self.PC + 1, 
+                                                                        MODE_ABSOLUTE):02X}"
+        data2 = "  " if length < 3 else f"{self.read_memory(self.PC + 2, 
+                                                                        MODE_ABSOLUTE):02X}"
+        return f"{self.PC:04X}  {opcode:02X} {data1} {data2}  {INSTRUCTION_NAMES[self.opc_type[opcode]]}{29 * ' '}" \
                f"A:{self.A:02X} X:{self.X:02X} Y:{self.Y:02X} P:{self.status:02X} SP:{self.SP:02X}"
@@ -1,4 +1,3 @@
-from array import array
 from NESEmulator.rom import ROM
 import numpy as np
 
@@ -7,26 +6,39 @@ NAMETABLE_SIZE = 2048
 PALETTE_SIZE = 32
 NES_WIDTH = 256
 NES_HEIGHT = 240
-NES_PALETTE = [0x7C7C7C, 0x0000FC, 0x0000BC, 0x4428BC, 0x940084, 0xA80020,
-               0xA81000, 0x881400, 0x503000, 0x007800, 0x006800, 0x005800,
-               0x004058, 0x000000, 0x000000, 0x000000, 0xBCBCBC, 0x0078F8,
-               0x0058F8, 0x6844FC, 0xD800CC, 0xE40058, 0xF83800, 0xE45C10,
-               0xAC7C00, 0x00B800, 0x00A800, 0x00A844, 0x008888, 0x000000,
-               0x000000, 0x000000, 0xF8F8F8, 0x3CBCFC, 0x6888FC, 0x9878F8,
-               0xF878F8, 0xF85898, 0xF87858, 0xFCA044, 0xF8B800, 0xB8F818,
-               0x58D854, 0x58F898, 0x00E8D8, 0x787878, 0x000000, 0x000000,
-               0xFCFCFC, 0xA4E4FC, 0xB8B8F8, 0xD8B8F8, 0xF8B8F8, 0xF8A4C0,
-               0xF0D0B0, 0xFCE0A8, 0xF8D878, 0xD8F878, 0xB8F8B8, 0xB8F8D8,
-               0x00FCFC, 0xF8D8F8, 0x000000, 0x000000]
+# Screen color of each of the 64 NES colors, as 0xRRGGBB
+NES_PALETTE = np.array([0x7C7C7C, 0x0000FC, 0x0000BC, 0x4428BC, 0x940084,
+                        0xA80020, 0xA81000, 0x881400, 0x503000, 0x007800,
+                        0x006800, 0x005800, 0x004058, 0x000000, 0x000000,
+                        0x000000, 0xBCBCBC, 0x0078F8, 0x0058F8, 0x6844FC,
+                        0xD800CC, 0xE40058, 0xF83800, 0xE45C10, 0xAC7C00,
+                        0x00B800, 0x00A800, 0x00A844, 0x008888, 0x000000,
+                        0x000000, 0x000000, 0xF8F8F8, 0x3CBCFC, 0x6888FC,
+                        0x9878F8, 0xF878F8, 0xF85898, 0xF87858, 0xFCA044,
+                        0xF8B800, 0xB8F818, 0x58D854, 0x58F898, 0x00E8D8,
+                        0x787878, 0x000000, 0x000000, 0xFCFCFC, 0xA4E4FC,
+                        0xB8B8F8, 0xD8B8F8, 0xF8B8F8, 0xF8A4C0, 0xF0D0B0,
+                        0xFCE0A8, 0xF8D878, 0xD8F878, 0xB8F8B8, 0xB8F8D8,
+                        0x00FCFC, 0xF8D8F8, 0x000000, 0x000000],
+                       dtype=np.uint32)
+# Tile coordinates of each of the 30x32 background tiles, and how far its
+# 2 bits are shifted in its attribute table byte
+TILE_Y, TILE_X = np.mgrid[0:30, 0:32]
+ATTRIBUTE_SHIFTS = ((TILE_Y & 0x02) | ((TILE_X & 0x02) >> 1)) * 2
 
 
 class PPU:
     def __init__(self, rom: ROM):
         self.rom = rom
         # PPU memory
-        self.spr = array('B', [0] * SPR_RAM_SIZE)  # sprite RAM
-        self.nametables = array('B', [0] * NAMETABLE_SIZE)  # nametable RAM
-        self.palette = array('B', [0] * PALETTE_SIZE)  # palette RAM
+        # Byte buffers, so they can be copied into with slices and viewed
+        # as NumPy arrays without copying
+        self.spr = bytearray(SPR_RAM_SIZE)  # sprite RAM
+        self.nametables = bytearray(NAMETABLE_SIZE)  # nametable RAM
+        self.palette = bytearray(PALETTE_SIZE)  # palette RAM
+        # Screen color of each palette RAM entry, kept up to date on writes
+        self.palette_lut = np.full(PALETTE_SIZE, NES_PALETTE[0],
+                                   dtype=np.uint32)
         # Registers
         self.addr = 0  # main PPU address register
         self.addr_write_latch = False
@@ -51,8 +63,8 @@ class PPU:
         self.buffer2007 = 0
         self.scanline = 0
         self.cycle = 0
-        # Pixels for screen
-        self.display_buffer = np.zeros((NES_WIDTH, NES_HEIGHT), dtype=np.uint32)
+        # Pixels for screen, row by row
+        self.display_buffer = np.zeros((NES_HEIGHT, NES_WIDTH), dtype=np.uint32)
 
     # rendering reference https://wiki.nesdev.org/w/index.php/PPU_rendering
     # status reference http://wiki.nesdev.org/w/index.php/PPU_registers#PPUSTATUS
@@ -76,96 +88,73 @@ class PPU:
             if self.scanline > 261:
                 self.scanline = 0
 
-    def draw_background(self):
-        attribute_table_address = self.nametable_address + 960
-        # 32 tiles in width and 30 tiles in height
-        for y in range(30):
-            for x in range(32):
-                tile_address = self.nametable_address + y * 32 + x
-                nametable_entry = self.read_memory(tile_address)
-                attrx = x // 4
-                attry = y // 4
-                attribute_address = attribute_table_address + attry * 8 + attrx
-                attribute_entry = self.read_memory(attribute_address)
-                # https://forums.nesdev.com/viewtopic.php?f=10&t=13315
-                block = (y & 0x02) | ((x & 0x02) >> 1)
-                attribute_bits = 0
-                if block == 0:
-                    attribute_bits = (attribute_entry & 0b00000011) << 2
-                elif block == 1:
-                    attribute_bits = (attribute_entry & 0b00001100)
-                elif block == 2:
-                    attribute_bits = (attribute_entry & 0b00110000) >> 2
-                elif block == 3:
-                    attribute_bits = (attribute_entry & 0b11000000) >> 4
-                else:
-                    print("Invalid block")
-                for fine_y in range(8):
-                    low_order = self.read_memory(self.background_pattern_table_address +
-                                                 nametable_entry * 16 + fine_y)
-                    high_order = self.read_memory(self.background_pattern_table_address +
-                                                  nametable_entry * 16 + 8 + fine_y)
-                    for fine_x in range(8):
-                        pixel = ((low_order >> (7 - fine_x)) & 1) | (
-                                    ((high_order >> (7 - fine_x)) & 1) << 1) | attribute_bits
-                        x_screen_loc = (x * 8 + fine_x - self.scroll_x) % NES_WIDTH
-                        y_screen_loc = (y * 8 + fine_y - self.scroll_y) % NES_HEIGHT
+    # Number of steps until the PPU next reaches the given scanline and cycle
+    def cycles_until(self, scanline: int, cycle: int) -> int:
+        distance = ((scanline - self.scanline) * 341 +
+                    cycle - self.cycle) % (262 * 341)
+        return distance if distance > 0 else 262 * 341
 
-                        transparent = ((pixel & 3) == 0)
-                        # If the background is transparent use the first color in the palette
-                        color = self.palette[0] if transparent else self.palette[pixel]
-                        self.display_buffer[x_screen_loc, y_screen_loc] = NES_PALETTE[color]
+    def draw_background(self):
+        # The 960 tile entries and 64 attribute bytes of the nametable
+        table = np.frombuffer(self.nametables, dtype=np.uint8, count=1024,
+                              offset=self.nametable_index(
+                                  self.nametable_address))
+        entries = table[:960].reshape(30, 32).astype(np.intp)
+        # https://forums.nesdev.com/viewtopic.php?f=10&t=13315
+        attribute_bits = ((table[960:].reshape(8, 8)[TILE_Y // 4, TILE_X // 4]
+                           >> ATTRIBUTE_SHIFTS) & 3) << 2
+        # Palette RAM index of every pixel; if the background is
+        # transparent use the first color in the palette
+        pixels = self.rom.chr_tiles[
+            (self.background_pattern_table_address >> 4) + entries]
+        indices = np.where(pixels != 0,
+                           pixels | attribute_bits[:, :, None, None], 0)
+        # (tile y, tile x, fine y, fine x) to (y, x), then scrolled
+        colors = self.palette_lut[indices.transpose(0, 2, 1, 3).reshape(
+            NES_HEIGHT, NES_WIDTH)]
+        self.display_buffer[:] = np.roll(
+            colors, (-self.scroll_y, -self.scroll_x), axis=(0, 1))
 
     def draw_sprites(self, background_transparent: bool):
+        tiles = self.rom.chr_tiles[self.spr_pattern_table_address >> 4:]
+        # Whether an opaque pixel of sprite zero can count as a hit, and how
+        # many columns on the left of the screen are clipped for the check
+        zero_hit_possible = (not background_transparent and
+                             self.show_background and self.show_sprites)
+        left_clipped = 8 if (not self.left_8_sprite_show or
+                             not self.left_8_background_show) else 0
         for i in range(SPR_RAM_SIZE - 4, -4, -4):
             y_position = self.spr[i]
-            if y_position == 0xFF:  # 0xFF is a marker for no sprite data
+            # 0xFF is a marker for no sprite data
+            if y_position == 0xFF or y_position >= NES_HEIGHT:
                 continue
-            background_sprite = bool((self.spr[i + 2] >> 5) & 1)
+            attributes = self.spr[i + 2]
             x_position = self.spr[i + 3]
+            # 8x8 color indices of the sprite's tile, flipped and clipped to
+            # the screen
+            tile = tiles[self.spr[i + 1]]
+            if (attributes >> 7) & 1:  # flip y
+                tile = tile[::-1]
+            if (attributes >> 6) & 1:  # flip x
+                tile = tile[:, ::-1]
+            tile = tile[:NES_HEIGHT - y_position, :NES_WIDTH - x_position]
+            opaque = tile != 0
+            if not opaque.any():  # fully transparent sprite... skip
+                continue
 
-            for x in range(x_position, x_position + 8):
-                if x >= NES_WIDTH:
-                    break
-                for y in range(y_position, y_position + 8):
-                    if y >= NES_HEIGHT:
-                        break
-                    flip_y = bool((self.spr[i + 2] >> 7) & 1)
-                    sprite_line = y - y_position
-                    if flip_y:
-                        sprite_line = 7 - sprite_line
-
-                    index = self.spr[i + 1]
-                    bit0s_address = self.spr_pattern_table_address + (index * 16) + sprite_line
-                    bit1s_address = self.spr_pattern_table_address + (index * 16) + sprite_line + 8
-                    bit0s = self.read_memory(bit0s_address)
-                    bit1s = self.read_memory(bit1s_address)
-                    bit3and2 = ((self.spr[i + 2]) & 3) << 2
-
-                    flip_x = bool((self.spr[i + 2] >> 6) & 1)
-                    x_loc = x - x_position  # position within sprite
-                    if not flip_x:
-                        x_loc = 7 - x_loc
-
-                    bit1and0 = (((bit1s >> x_loc) & 1) << 1) | (
-                            ((bit0s >> x_loc) & 1) << 0)
-                    if bit1and0 == 0:  # transparent pixel... skip
-                        continue
-
-                    # This is not transparent. Is it a sprite zero hit therefore?
-                    # Check that left 8 pixel clipping is not off.
-                    if (i == 0) and (not background_transparent) and (not (x < 8 and (
-                            not self.left_8_sprite_show or not self.left_8_background_show))
-                                and self.show_background and self.show_sprites):
-                        self.status |= 0b01000000
-                    # Need to do this after sprite zero checking so we still count background
-                    # sprites for sprite zero checks
-                    if background_sprite and not background_transparent:
-                        continue  # background sprite shouldn't draw over opaque pixels
+            if (i == 0 and zero_hit_possible and
+                    opaque[:, max(left_clipped - x_position, 0):].any()):
+                self.status |= 0b01000000
+            # Need to do this after sprite zero checking so we still count
+            # background sprites for sprite zero checks
+            background_sprite = bool((attributes >> 5) & 1)
+            if background_sprite and not background_transparent:
+                continue  # background sprite shouldn't draw over opaque pixels
 
-                    color = bit3and2 | bit1and0
-                    color = self.read_memory(0x3F10 + color)  # from palette
-                    self.display_buffer[x, y] = NES_PALETTE[color]
+            colors = self.palette_lut[0x10 | ((attributes & 3) << 2) | tile]
+            np.copyto(self.display_buffer[y_position:y_position + 8,
+                                          x_position:x_position + 8],
+                      colors, where=opaque)
 
     def read_register(self, address: int) -> int:
         if address == 0x2002:
@@ -179,7 +168,7 @@ class PPU:
         elif address == 0x2004:
             return self.spr[self.spr_address]
         elif address == 0x2007:
-            if (self.addr % 0x4000) < 0x3F00:
+            if (self.addr & 0x3FFF) < 0x3F00:
                 value = self.buffer2007
                 self.buffer2007 = self.read_memory(self.addr)
             else:
@@ -228,46 +217,43 @@ class PPU:
         else:
             raise LookupError(f"Error: Unrecognized PPU write {address:X}")
 
+    # Index into nametable RAM of a nametable address, after mirroring
+    def nametable_index(self, address: int) -> int:
+        address = (address - 0x2000) & 0xFFF  # 3000-3EFF is a mirror
+        if self.rom.vertical_mirroring:
+            address = address & 0x7FF
+        else:  # horizontal mirroring
+            if (address >= 0x400) and (address < 0xC00):
+                address = address - 0x400
+            elif address >= 0xC00:
+                address = address - 0x800
+        return address
+
     def read_memory(self, address: int) -> int:
-        address = address % 0x4000  # mirror >0x4000
+        address = address & 0x3FFF  # mirror >0x4000
         if address < 0x2000:  # pattern tables
             return self.rom.read_cartridge(address)
         elif address < 0x3F00:  # nametables
-            address = (address - 0x2000) % 0x1000  # 3000-3EFF is a mirror
-            if self.rom.vertical_mirroring:
-                address = address % 0x0800
-            else:  # horizontal mirroring
-                if (address >= 0x400) and (address < 0xC00):
-                    address = address - 0x400
-                elif address >= 0xC00:
-                    address = address - 0x800
-            return self.nametables[address]
+            return self.nametables[self.nametable_index(address)]
         elif address < 0x4000:  # palette memory
-            address = (address - 0x3F00) % 0x20
-            if (address > 0x0F) and ((address % 0x04) == 0):
+            address = (address - 0x3F00) & 0x1F
+            if (address > 0x0F) and ((address & 3) == 0):
                 address = address - 0x10
             return self.palette[address]
         else:
             raise LookupError(f"Error: Unrecognized PPU read at {address:X}")
 
     def write_memory(self, address: int, value: int):
-        address = address % 0x4000  # mirror >0x4000
+        address = address & 0x3FFF  # mirror >0x4000
         if address < 0x2000:  # pattern tables
             return self.rom.write_cartridge(address, value)
         elif address < 0x3F00:  # nametables
-            address = (address - 0x2000) % 0x1000  # 3000-3EFF is a mirror
-            if self.rom.vertical_mirroring:
-                address = address % 0x0800
-            else:  # horizontal mirroring
-                if (address >= 0x400) and (address < 0xC00):
-                    address = address - 0x400
-                elif address >= 0xC00:
-                    address = address - 0x800
-            self.nametables[address] = value
+            self.nametables[self.nametable_index(address)] = value
         elif address < 0x4000:  # palette memory
-            address = (address - 0x3F00) % 0x20
-            if (address > 0x0F) and ((address % 0x04) == 0):
+            address = (address - 0x3F00) & 0x1F
+            if (address > 0x0F) and ((address & 3) == 0):
                 address = address - 0x10
             self.palette[address] = value
+            self.palette_lut[address] = NES_PALETTE[value & 0x3F]
         else:
             raise LookupError(f"Error: Unrecognized PPU write at {address:X}")
@@ -1,62 +1,95 @@
 from pathlib import Path
-from struct import unpack
+import mmap
+from struct import Struct
 from collections import namedtuple
-from array import array
+from collections.abc import Callable
+import numpy as np
 
-Header = namedtuple("Header", "signature prg_rom_size chr_rom_size "
-                              "flags6 flags7 flags8 flags9 flags10 unused")
+Header = namedtuple("Header", "prg_rom_size chr_rom_size flags6 flags7 "
+                              "flags8 flags9 flags10 unused")
 HEADER_SIZE = 16
+HEADER_SIGNATURE = b"NES\x1a"
+HEADER_STRUCT = Struct("!BBBBBBB5s")  # the rest of the header
 TRAINER_SIZE = 512
 PRG_ROM_BASE_UNIT_SIZE = 16384
 CHR_ROM_BASE_UNIT_SIZE = 8192
 PRG_RAM_SIZE = 8192
+# Sizes are powers of two, so wrapping is a mask instead of a modulo
+PRG_RAM_MASK = PRG_RAM_SIZE - 1
+PRG_ROM_SMALL_MASK = PRG_ROM_BASE_UNIT_SIZE - 1
+assert (PRG_RAM_SIZE & PRG_RAM_MASK) == 0
+assert (PRG_ROM_BASE_UNIT_SIZE & PRG_ROM_SMALL_MASK) == 0
 
 
 class ROM:
     def __init__(self, file_name: str | Path):
         with open(file_name, "rb") as file:
-            # Read header and check signature "NES"
-            self.header = Header._make(unpack("!LBBBBBBB5s",
-                                              file.read(HEADER_SIZE)))
-            if self.header.signature != 0x4E45531A:
+            # Map the file instead of copying it, cartridge ROM never changes
+            self.file_map = mmap.mmap(file.fileno(), 0,
+                                      access=mmap.ACCESS_READ)
+            contents = memoryview(self.file_map)
+            # Check signature "NES" and read the rest of the header
+            if contents[:len(HEADER_SIGNATURE)] != HEADER_SIGNATURE:
                 print("Invalid ROM Header Signature")
             else:
                 print("Valid ROM Header Signature")
+            self.header = Header._make(HEADER_STRUCT.unpack_from(
+                contents, len(HEADER_SIGNATURE)))
             # Untangle Mapper - one nibble in flags6 and one nibble in flags7
             self.mapper = (self.header.flags7 & 0xF0) | (
                     (self.header.flags6 & 0xF0) >> 4)
             print(f"Mapper {self.mapper}")
             if self.mapper != 0:
                 print("Invalid Mapper: Only Mapper 0 is Implemented")
-            self.read_cartridge = self.read_mapper0
             self.write_cartridge = self.write_mapper0
             # Check if there's a trainer (4th bit flags6) and read it
             self.has_trainer = bool(self.header.flags6 & 4)
+            offset = HEADER_SIZE
             if self.has_trainer:
-                self.trainer_data = file.read(TRAINER_SIZE)
+                self.trainer_data = contents[offset:offset + TRAINER_SIZE]
+                offset += TRAINER_SIZE
             # Check mirroring from flags6 bit 0
             self.vertical_mirroring = bool(self.header.flags6 & 1)
             print(f"Has vertical mirroring {self.vertical_mirroring}")
             # Read PRG_ROM & CHR_ROM, in multiples of 16K and 8K, respectively
-            self.prg_rom = file.read(PRG_ROM_BASE_UNIT_SIZE *
-                                     self.header.prg_rom_size)
-            self.chr_rom = file.read(CHR_ROM_BASE_UNIT_SIZE *
-                                     self.header.chr_rom_size)
-            self.prg_ram = array('B', [0] * PRG_RAM_SIZE)  # RAM
+            prg_rom_size = PRG_ROM_BASE_UNIT_SIZE * self.header.prg_rom_size
+            self.prg_rom = contents[offset:offset + prg_rom_size]
+            offset += prg_rom_size
+            self.chr_rom = contents[offset:offset + CHR_ROM_BASE_UNIT_SIZE *
+                                    self.header.chr_rom_size]
+            # CHR ROM decoded once into 8x8 tiles of 2-bit color indices,
+            # from the low and high bit planes of each 16-byte tile
+            chr_bytes = np.frombuffer(self.chr_rom, dtype=np.uint8).reshape(
+                -1, 16)
+            low_bits = np.unpackbits(chr_bytes[:, :8], axis=1).reshape(-1, 8, 8)
+            high_bits = np.unpackbits(chr_bytes[:, 8:], axis=1).reshape(-1, 8,
+                                                                        8)
+            self.chr_tiles = low_bits | (high_bits << 1)
+            self.prg_ram = bytearray(PRG_RAM_SIZE)  # RAM
+            # (memory, mask) for each 8K page of the address space, so a read
+            # is one lookup by address >> 13
+            self.prg_rom_mask = 0x7FFF if self.header.prg_rom_size > 1 else \
+                PRG_ROM_SMALL_MASK
+            self.read_pages = [(self.chr_rom, 0x1FFF), None, None,
+                               (self.prg_ram, PRG_RAM_MASK)] + \
+                [(self.prg_rom, self.prg_rom_mask)] * 4
+            self.read_cartridge = self.make_read_mapper0()
 
-    def read_mapper0(self, address: int) -> int:
-        if address < 0x2000:
-            return self.chr_rom[address]
-        elif 0x6000 <= address < 0x8000:
-            return self.prg_ram[address % PRG_RAM_SIZE]
-        elif address >= 0x8000:
-            if self.header.prg_rom_size > 1:
-                return self.prg_rom[address - 0x8000]
-            else:
-                return self.prg_rom[(address - 0x8000) % PRG_ROM_BASE_UNIT_SIZE]
-        else:
-            raise LookupError(f"Tried to read at invalid address {address:X}")
+    # The memory map never changes after loading, so the read function is
+    # built for this cartridge from its page table, kept as a closure local
+    def make_read_mapper0(self) -> Callable[[int], int]:
+        read_pages = self.read_pages
+
+        def read_mapper0(address: int) -> int:
+            page = read_pages[address >> 13]
+            if page is None:
+                raise LookupError(
+                    f"Tried to read at invalid address {address:X}")
+            memory, mask = page
+            return memory[address & mask]
+
+        return read_mapper0
 
     def write_mapper0(self, address: int, value: int):
         if address >= 0x6000:
-            self.prg_ram[address % PRG_RAM_SIZE] = value
+            self.prg_ram[address & PRG_RAM_MASK] = value
@@ -1,13 +1,22 @@
 # tests/test_nesemulator.py
 import unittest
+import numpy as np
 from pathlib import Path
-from NESEmulator.cpu import CPU
+from NESEmulator.cpu import CPU, MODE_ABSOLUTE, BUTTON_A, BUTTON_START, BUTTON_RIGHT
 from NESEmulator.ppu import PPU
 from NESEmulator.rom import ROM
+from NESEmulator import core_nb
+TEST_FOLDER = Path(__file__).resolve().parent.parent / 'NESEmulator' / 'Tests'
+# The test ROMs aren't shipped with the emulator, tests that need them are
+# skipped when they haven't been downloaded
+needs_nestest = unittest.skipUnless((TEST_FOLDER / "nestest").exists(),
+                                    "nestest ROM not found")
+needs_instr_test = unittest.skipUnless(
+    (TEST_FOLDER / "instr_test-v5").exists(), "instr_test-v5 ROMs not found")
 class CPUTestCase(unittest.TestCase):
     def setUp(self) -> None:
-        self.test_folder = (Path(__file__).resolve().parent.parent
-/ 'NESEmulator' / 'Tests')
+        self.test_folder = TEST_FOLDER
+    @needs_nestest
     def test_nes_test(self):
 # Create machinery that we are testing
         rom = ROM(self.test_folder / "nestest" / "nestest.nes")
@@ -28,6 +37,27 @@ class CPUTestCase(unittest.TestCase):
             f"Registers don't match at line {log_line}")
             cpu.step()
             log_line += 1
+    @needs_nestest
+    def test_core_nb_nes_test(self):
+        # The compiled core has to produce the same log as the CPU class
+        rom = ROM(self.test_folder / "nestest" / "nestest.nes")
+        state, mem, vram = core_nb.power_on(rom)
+        state[core_nb.PC] = 0xC000 # special starting location for tests
+        with open(self.test_folder / "nestest" / "nestest.log") as f:
+            correct_lines = f.readlines()
+        log_line = 1
+        while log_line < 5260: # go until first unofficial opcode test
+            our_registers = (f"A:{state[core_nb.A]:02X} X:{state[core_nb.X]:02X} "
+                             f"Y:{state[core_nb.Y]:02X} P:{state[core_nb.P] | core_nb.FLAG_U:02X} "
+                             f"SP:{state[core_nb.SP]:02X}")
+            correct_line = correct_lines[log_line - 1]
+            self.assertEqual(correct_line[0:4], f"{state[core_nb.PC]:04X}",
+            f"PC doesn't match at line {log_line}")
+            self.assertEqual(correct_line[48:73], our_registers,
+            f"Registers don't match at line {log_line}")
+            core_nb.cpu_step(state, mem, vram)
+            log_line += 1
+    @needs_instr_test
     def test_blargg_instr_test_v5_basics(self):
         # Create machinery that we are testing
         rom = ROM(self.test_folder / "instr_test-v5" / "rom_singles" / "01-basics.nes")
@@ -35,12 +65,12 @@ class CPUTestCase(unittest.TestCase):
         cpu = CPU(ppu, rom)
         # Tests run as long as 0x6000 is 80, and then 0x6000 is result code; 0 means success
         rom.prg_ram[0] = 0x80
-        while rom.prg_ram[0] == 0x80: # go until first unofficial opcode test
-            cpu.step()
+        cpu.run_until(lambda: rom.prg_ram[0] != 0x80) # go until first unofficial opcode test
         self.assertEqual(0, rom.prg_ram[0],
                         f"Result code of basics test is {rom.prg_ram[0]} not 0")
         message = bytes(rom.prg_ram[4:]).decode("utf-8")
         print(message[0:message.index("\0")]) # message ends with null terminator
+    @needs_instr_test
     def test_blargg_instr_test_v5_implied(self):
         # Create machinery that we are testing
         rom = ROM(self.test_folder / "instr_test-v5" / "rom_singles" / "02-implied.nes")
@@ -49,12 +79,12 @@ class CPUTestCase(unittest.TestCase):
         # Tests run as long as 0x6000 is 80, and then 0x6000 is result code; 0 means success
         rom.prg_ram[0] = 0x80
 
-        while rom.prg_ram[0] == 0x80: # go until first unofficial opcode test
-            cpu.step()
+        cpu.run_until(lambda: rom.prg_ram[0] != 0x80) # go until first unofficial opcode test
         self.assertEqual(0, rom.prg_ram[0],
                         f"Result code of implied test is {rom.prg_ram[0]} not 0")
         message = bytes(rom.prg_ram[4:]).decode("utf-8")
         print(message[0:message.index("\0")]) # message ends with null terminator
+    @needs_instr_test
     def test_blargg_instr_test_v5_branches(self):
         # Create machinery that we are testing
         rom = ROM(self.test_folder / "instr_test-v5" / "rom_singles" / "10-branches.nes")
@@ -62,12 +92,12 @@ class CPUTestCase(unittest.TestCase):
         cpu = CPU(ppu, rom)
         # Tests run as long as 0x6000 is 80, and then 0x6000 is result code; 0 means success
         rom.prg_ram[0] = 0x80
-        while rom.prg_ram[0] == 0x80: # go until first unofficial opcode test
-            cpu.step()
+        cpu.run_until(lambda: rom.prg_ram[0] != 0x80) # go until first unofficial opcode test
         self.assertEqual(0, rom.prg_ram[0],
                         f"Result code of branches test is {rom.prg_ram[0]} not 0")
         message = bytes(rom.prg_ram[4:]).decode("utf-8")
         print(message[0:message.index("\0")]) # message ends with null terminator
+    @needs_instr_test
     def test_blargg_instr_test_v5_stack(self):
         # Create machinery that we are testing
         rom = ROM(self.test_folder / "instr_test-v5" / "rom_singles" / "11-stack.nes")
@@ -75,13 +105,13 @@ class CPUTestCase(unittest.TestCase):
         cpu = CPU(ppu, rom)
         # Tests run as long as 0x6000 is 80, and then 0x6000 is result code; 0 means success
         rom.prg_ram[0] = 0x80
-        while rom.prg_ram[0] == 0x80: # go until first unofficial opcode test
-            cpu.step()
+        cpu.run_until(lambda: rom.prg_ram[0] != 0x80) # go until first unofficial opcode test
         self.assertEqual(0, rom.prg_ram[0],
                         f"Result code of stack test is {rom.prg_ram[0]} not 0")
         message = bytes(rom.prg_ram[4:]).decode("utf-8")
         print(message[0:message.index("\0")]) # message ends with null terminator
     
+    @needs_instr_test
     def test_blargg_instr_test_v5_jmp_jsr(self):
         # Create machinery that we are testing
         rom = ROM(self.test_folder / "instr_test-v5" / "rom_singles" / "12-jmp_jsr.nes")
@@ -89,12 +119,12 @@ class CPUTestCase(unittest.TestCase):
         cpu = CPU(ppu, rom)
         # Tests run as long as 0x6000 is 80, and then 0x6000 is result code; 0 means success
         rom.prg_ram[0] = 0x80
-        while rom.prg_ram[0] == 0x80: # go until first unofficial opcode test
-            cpu.step()
+        cpu.run_until(lambda: rom.prg_ram[0] != 0x80) # go until first unofficial opcode test
         self.assertEqual(0, rom.prg_ram[0],
                         f"Result code of jmp_jsr test is {rom.prg_ram[0]} not 0")
         message = bytes(rom.prg_ram[4:]).decode("utf-8")
         print(message[0:message.index("\0")]) # message ends with null terminator
+    @needs_instr_test
     def test_blargg_instr_test_v5_rts(self):
         # Create machinery that we are testing
         rom = ROM(self.test_folder / "instr_test-v5" / "rom_singles" / "13-rts.nes")
@@ -102,12 +132,12 @@ class CPUTestCase(unittest.TestCase):
         cpu = CPU(ppu, rom)
         # Tests run as long as 0x6000 is 80, and then 0x6000 is result code; 0 means success
         rom.prg_ram[0] = 0x80
-        while rom.prg_ram[0] == 0x80: # go until first unofficial opcode test
-            cpu.step()
+        cpu.run_until(lambda: rom.prg_ram[0] != 0x80) # go until first unofficial opcode test
         self.assertEqual(0, rom.prg_ram[0],
                         f"Result code of rts test is {rom.prg_ram[0]} not 0")
         message = bytes(rom.prg_ram[4:]).decode("utf-8")
         print(message[0:message.index("\0")]) # message ends with null terminator
+    @needs_instr_test
     def test_blargg_instr_test_v5_rti(self):
         # Create machinery that we are testing
         rom = ROM(self.test_folder / "instr_test-v5" / "rom_singles" / "14-rti.nes")
@@ -115,12 +145,12 @@ class CPUTestCase(unittest.TestCase):
         cpu = CPU(ppu, rom)
         # Tests run as long as 0x6000 is 80, and then 0x6000 is result code; 0 means success
         rom.prg_ram[0] = 0x80
-        while rom.prg_ram[0] == 0x80: # go until first unofficial opcode test
-            cpu.step()
+        cpu.run_until(lambda: rom.prg_ram[0] != 0x80) # go until first unofficial opcode test
         self.assertEqual(0, rom.prg_ram[0],
                         f"Result code of rti test is {rom.prg_ram[0]} not 0")
         message = bytes(rom.prg_ram[4:]).decode("utf-8")
         print(message[0:message.index("\0")]) # message ends with null terminator
+    @needs_instr_test
     def test_blargg_instr_test_v5_brk(self):
         # Create machinery that we are testing
         rom = ROM(self.test_folder / "instr_test-v5" / "rom_singles" / "15-brk.nes")
@@ -128,12 +158,12 @@ class CPUTestCase(unittest.TestCase):
         cpu = CPU(ppu, rom)
         # Tests run as long as 0x6000 is 80, and then 0x6000 is result code; 0 means success
         rom.prg_ram[0] = 0x80
-        while rom.prg_ram[0] == 0x80: # go until first unofficial opcode test
-            cpu.step()
+        cpu.run_until(lambda: rom.prg_ram[0] != 0x80) # go until first unofficial opcode test
         message = bytes(rom.prg_ram[4:]).decode("utf-8")
         print(message[0:message.index("\0")]) # message ends with null terminator
         self.assertEqual(0, rom.prg_ram[0],
                         f"Result code of brk test is {rom.prg_ram[0]} not 0")
+    @needs_instr_test
     def test_blargg_instr_test_v5_special(self):
         # Create machinery that we are testing
         rom = ROM(self.test_folder / "instr_test-v5" / "rom_singles" / "16-special.nes")
@@ -141,11 +171,134 @@ class CPUTestCase(unittest.TestCase):
         cpu = CPU(ppu, rom)
         # Tests run as long as 0x6000 is 80, and then 0x6000 is result code; 0 means success
         rom.prg_ram[0] = 0x80
-        while rom.prg_ram[0] == 0x80: # go until first unofficial opcode test
-            cpu.step()
+        cpu.run_until(lambda: rom.prg_ram[0] != 0x80) # go until first unofficial opcode test
         message = bytes(rom.prg_ram[4:]).decode("utf-8")
         print(message[0:message.index("\0")]) # message ends with null terminator
         self.assertEqual(0, rom.prg_ram[0],
                          f"Result code of special test is {rom.prg_ram[0]} not 0")
+    @needs_instr_test
+    def test_blargg_instr_test_v5_basics_jit(self):
+        # Same as the basics test but with hot blocks compiled
+        rom = ROM(self.test_folder / "instr_test-v5" / "rom_singles" / "01-basics.nes")
+        ppu = PPU(rom)
+        cpu = CPU(ppu, rom, jit=True)
+        rom.prg_ram[0] = 0x80
+        cpu.run_until(lambda: rom.prg_ram[0] != 0x80)
+        self.assertEqual(0, rom.prg_ram[0],
+                        f"Result code of basics test is {rom.prg_ram[0]} not 0")
+    def test_run_until(self):
+        # Steps run in chunks, so the condition is only checked between them
+        rom = ROM(Path(__file__).resolve().parent / "SMB.nes")
+        ppu = PPU(rom)
+        cpu = CPU(ppu, rom)
+        steps = []
+        cpu.step = lambda: steps.append(cpu.PC)
+        cpu.run_until(lambda: len(steps) >= 10, chunk=4)
+        self.assertEqual(12, len(steps))
+        cpu.run_until(lambda: True)
+        self.assertEqual(12, len(steps))
+    def test_joypad_reads(self):
+        # Buttons shift out of 0x4016 one per read after the strobe drops
+        rom = ROM(Path(__file__).resolve().parent / "SMB.nes")
+        ppu = PPU(rom)
+        cpu = CPU(ppu, rom)
+        cpu.set_button(BUTTON_A, True)
+        cpu.set_button(BUTTON_START, True)
+        cpu.set_button(BUTTON_RIGHT, True)
+        cpu.set_button(BUTTON_A, False)
+        cpu.write_memory(0x4016, MODE_ABSOLUTE, 1)
+        self.assertEqual(0, cpu.read_memory(0x4016, MODE_ABSOLUTE))
+        cpu.write_memory(0x4016, MODE_ABSOLUTE, 0)
+        reads = [cpu.read_memory(0x4016, MODE_ABSOLUTE) for _ in range(9)]
+        self.assertEqual([0x40, 0x40, 0x40, 0x41, 0x40, 0x40, 0x40, 0x41,
+                          0x41], reads)
+    def test_prg_ram_code_rewritten(self):
+        # Instructions decoded from PRG RAM are dropped when it is written
+        rom = ROM(Path(__file__).resolve().parent / "SMB.nes")
+        ppu = PPU(rom)
+        cpu = CPU(ppu, rom)
+        cpu.write_memory(0x6000, MODE_ABSOLUTE, 0xA9)  # LDA #$05
+        cpu.write_memory(0x6001, MODE_ABSOLUTE, 0x05)
+        cpu.PC = 0x6000
+        cpu.step()
+        self.assertEqual(5, cpu.A)
+        cpu.write_memory(0x6001, MODE_ABSOLUTE, 0x07)
+        cpu.PC = 0x6000
+        cpu.step()
+        self.assertEqual(7, cpu.A)
+    def test_oam_dma(self):
+        # A page of RAM, PRG RAM or PRG ROM is copied into sprite RAM
+        rom = ROM(Path(__file__).resolve().parent / "SMB.nes")
+        ppu = PPU(rom)
+        cpu = CPU(ppu, rom)
+        for i in range(256):
+            cpu.write_memory(0x0200 + i, MODE_ABSOLUTE, i)
+            cpu.write_memory(0x6100 + i, MODE_ABSOLUTE, 255 - i)
+        cpu.write_memory(0x4014, MODE_ABSOLUTE, 0x02)
+        self.assertEqual(bytes(range(256)), bytes(ppu.spr))
+        cpu.write_memory(0x4014, MODE_ABSOLUTE, 0x61)
+        self.assertEqual(bytes(range(255, -1, -1)), bytes(ppu.spr))
+        cpu.write_memory(0x4014, MODE_ABSOLUTE, 0x80)
+        self.assertEqual(bytes(cpu.read_memory(0x8000 + i, MODE_ABSOLUTE)
+                               for i in range(256)), bytes(ppu.spr))
+    def test_core_nb_jmp_indirect(self):
+        # JMP ($60FF) reads its pointer from PRG RAM, the high byte
+        # wrapping to $6000, in both the CPU class and the compiled core
+        rom = ROM(Path(__file__).resolve().parent / "SMB.nes")
+        cpu = CPU(PPU(rom), rom)
+        state, mem, vram = core_nb.power_on(rom)
+        for address, value in ((0x0300, 0x6C), (0x0301, 0xFF), (0x0302, 0x60),
+                               (0x60FF, 0x34), (0x6000, 0x12),
+                               (0x6100, 0x56)):
+            cpu.write_memory(address, MODE_ABSOLUTE, value)
+            core_nb.cpu_write(state, mem, vram, address, value)
+        cpu.PC = 0x0300
+        cpu.step()
+        state[core_nb.PC] = 0x0300
+        core_nb.cpu_step(state, mem, vram)
+        self.assertEqual(0x1234, cpu.PC)
+        self.assertEqual(0x1234, state[core_nb.PC])
+    def test_run_frame_matches_stepping(self):
+        # Skipping the PPU between events has to match stepping every cycle
+        def run_frames(stepped):
+            rom = ROM(Path(__file__).resolve().parent / "SMB.nes")
+            state, mem, vram = core_nb.power_on(rom)
+            display_buffer = np.zeros((256, 240, 3), dtype=np.uint8)
+            frames = []
+            while len(frames) < 30:
+                if not stepped:
+                    core_nb.run_frame(state, mem, vram, display_buffer)
+                    frames.append((display_buffer.tobytes(), *state[:7]))
+                    continue
+                ticks = state[core_nb.CYCLES]
+                core_nb.cpu_step(state, mem, vram)
+                for _ in range((state[core_nb.CYCLES] - ticks) * 3):
+                    core_nb.ppu_step(state, mem, vram, display_buffer)
+                    if (state[core_nb.PPU_SCANLINE] == 241) and (state[core_nb.PPU_CYCLE] == 2) \
+                            and state[core_nb.PPU_GENERATE_NMI]:
+                        core_nb.trigger_nmi(state, mem, vram)
+                    if (state[core_nb.PPU_SCANLINE] == 240) and (state[core_nb.PPU_CYCLE] == 257):
+                        frames.append((display_buffer.tobytes(), *state[:7]))
+            return frames
+        self.assertEqual(run_frames(True), run_frames(False))
+    def test_jit_matches_interpreter(self):
+        # Compiled blocks have to leave every frame exactly as stepping would
+        def run_frames(jit):
+            rom = ROM(Path(__file__).resolve().parent / "SMB.nes")
+            ppu = PPU(rom)
+            cpu = CPU(ppu, rom, jit=jit)
+            frames = []
+            while len(frames) < 30:
+                ticks = cpu.cpu_ticks
+                cpu.step()
+                for _ in range((cpu.cpu_ticks - ticks) * 3):
+                    ppu.step()
+                    if (ppu.scanline == 241) and (ppu.cycle == 2) and ppu.generate_nmi:
+                        cpu.trigger_NMI()
+                    if (ppu.scanline == 240) and (ppu.cycle == 257):
+                        frames.append((ppu.display_buffer.tobytes(), cpu.PC, cpu.A,
+                                       cpu.X, cpu.Y, cpu.status, cpu.SP, cpu.cpu_ticks))
+            return frames
+        self.assertEqual(run_frames(False), run_frames(True))
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,27 @@
+# Compiles the Numba core ahead of time into NESEmulator/nes_core, so the
+# emulator starts without waiting for the JIT. Run from the repository root:
+#   python tools/build_core.py
+import sys
+from pathlib import Path
+from numba.pycc import CC
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from NESEmulator import core_nb  # noqa: E402
+
+STATE = "int64[:]"
+MEMORY = "uint8[:]"
+DISPLAY_BUFFER = "uint8[:, :, :]"  # pixels3d of the screen, (x, y, rgb)
+
+cc = CC("nes_core")
+cc.output_dir = str(Path(core_nb.__file__).parent)
+cc.export("run_frame", f"void({STATE}, {MEMORY}, {MEMORY}, {DISPLAY_BUFFER})")(
+    core_nb.run_frame.py_func)
+cc.export("cpu_step", f"void({STATE}, {MEMORY}, {MEMORY})")(
+    core_nb.cpu_step.py_func)
+cc.export("run_cpu", f"void({STATE}, {MEMORY}, {MEMORY}, int64)")(
+    core_nb.run_cpu.py_func)
+cc.export("ppu_step", f"void({STATE}, {MEMORY}, {MEMORY}, {DISPLAY_BUFFER})")(
+    core_nb.ppu_step.py_func)
+
+if __name__ == "__main__":
+    cc.compile()